@@ -2,6 +2,7 @@ import tkinter as tk
 import subprocess
 import os
 from tkinter import PhotoImage, messagebox
+from retrieval_daemon import start_daemon
 
 class ChatbotLauncher:
     def __init__(self, root):
@@ -10,6 +11,9 @@ class ChatbotLauncher:
         self.root.geometry("600x500")  # 固定窗口大小
         self.root.resizable(False, False)  # 禁止调整大小
 
+        # One retrieval daemon holds the knowledge base for every program started here
+        self.daemon = start_daemon(["db"])
+
         self.setup_ui()
 
     def setup_ui(self):
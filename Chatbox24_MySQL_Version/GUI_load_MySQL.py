@@ -4,8 +4,13 @@ from tkinter import filedialog, messagebox
 import PyPDF2
 import re
 from tkinterdnd2 import TkinterDnD, DND_FILES
+import sqlite3
 import mysql.connector
 from mysql.connector import Error
+from db_config import DB_CONFIG
+from bm25_index import BM25Index, bm25_path
+
+VECTOR_STORE = "vault_vectors_db"  # Must match the store used by GUI_work / GUI_testing
 
 class PDFProcessor:
     def __init__(self, root):
@@ -14,12 +19,7 @@ class PDFProcessor:
         self.root.geometry("400x400")
         
         # Database configuration
-        self.db_config = {
-            'host': 'localhost',
-            'user': 'root',
-            'password': '1234',
-            'database': 'knowledge_db'
-        }
+        self.db_config = DB_CONFIG
         
         self.setup_ui()
         self.init_db()
@@ -111,12 +111,15 @@ class PDFProcessor:
                 try:
                     conn = mysql.connector.connect(**self.db_config)
                     cursor = conn.cursor()
+                    inserted = []
                     for chunk in chunks:
                         cursor.execute("""
                             INSERT INTO knowledge_base (content, source_type)
                             VALUES (%s, 'PDF')
                         """, (chunk.strip(),))
+                        inserted.append((cursor.lastrowid, chunk.strip()))
                     conn.commit()
+                    self.update_lexical_index(inserted)
                     messagebox.showinfo("Success", "PDF content saved to database!")
                 except Error as e:
                     conn.rollback()
@@ -157,6 +160,7 @@ class PDFProcessor:
                     VALUES (%s, 'Manual')
                 """, (input_text,))
                 conn.commit()
+                self.update_lexical_index([(cursor.lastrowid, input_text)])
                 messagebox.showinfo("Success", "Text saved to database!")
             except Error as e:
                 conn.rollback()
@@ -186,12 +190,15 @@ class PDFProcessor:
         try:
             conn = mysql.connector.connect(**self.db_config)
             cursor = conn.cursor()
+            cursor.execute("SELECT id FROM knowledge_base WHERE content LIKE %s", (f"%{keyword}%",))
+            deleted_ids = [row[0] for row in cursor.fetchall()]
             cursor.execute("""
                 DELETE FROM knowledge_base 
                 WHERE content LIKE %s
             """, (f"%{keyword}%",))
             deleted_rows = cursor.rowcount
             conn.commit()
+            self.update_lexical_index(deleted_ids=deleted_ids)
             if deleted_rows > 0:
                 messagebox.showinfo("Success", f"Deleted {deleted_rows} records containing: {keyword}")
             else:
@@ -204,6 +211,15 @@ class PDFProcessor:
                 cursor.close()
                 conn.close()
 
+    def update_lexical_index(self, rows=(), deleted_ids=()):
+        """Apply inserted/deleted rows to the BM25 index used for retrieval"""
+        try:
+            index = BM25Index(bm25_path(VECTOR_STORE))
+            index.delete(deleted_ids)
+            index.add(rows)
+        except sqlite3.Error as e:
+            print(f"Failed to update lexical index: {e}")
+
 if __name__ == "__main__":
     root = TkinterDnD.Tk()
     app = PDFProcessor(root)
@@ -1,19 +1,25 @@
-import torch
-import ollama
 import os
 import re
-import json
 import threading
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from sklearn.metrics.pairwise import cosine_similarity
-from email import policy
-from email.parser import BytesParser
-from bs4 import BeautifulSoup
+from email_parser import parse_eml_file
 from tkinter import messagebox, ttk
-import hashlib
 import mysql.connector
 from mysql.connector import Error
+from db_config import DB_CONFIG
+from embeddings import embed_text
+from llm_client import chat, warm_up
+from prompt_builder import build_messages
+from retrieval import load_retriever
+from retrieval_daemon import connect_retriever, VAULT_DB
+from vector_store import normalize_rows
+from parse_pool import get_parse_pool
+
+VECTOR_STORE = "vault_vectors_db"
+VECTOR_DTYPE = "float32"  # "float16" halves the store size on disk and in page cache
+VECTOR_QUANTIZATION = None  # "int8" (4x) or "pq" (16x) keeps only compressed codes in memory
+THREAD_MESSAGES = 1  # Test against the newest message; quoted history, signatures and disclaimers are left out
 
 class TestingProcessor:
     def __init__(self, root):
@@ -22,15 +28,13 @@ class TestingProcessor:
         self.root.geometry("800x600")
 
         # Database configuration
-        self.db_config = {
-            'host': 'localhost',
-            'user': 'root',
-            'password': '1234',  # Update to your database password
-            'database': 'knowledge_db'
-        }
+        self.db_config = DB_CONFIG
 
-        self.vault_embeddings_tensor = self.load_or_generate_embeddings()
-        self.vault_content = self.load_vault_content()
+        self.parse_pool = get_parse_pool()
+        self.parse_pool.start()  # Parse workers, forked before any other thread runs
+        warm_up()  # Loads llama3 and the embedding model while the knowledge base loads
+        # Shared with the other front-ends through the retrieval daemon when it runs
+        self.retriever = connect_retriever(VAULT_DB, self.load_or_generate_embeddings)
 
         self.setup_ui()
 
@@ -45,17 +49,13 @@ class TestingProcessor:
         self.root.drop_target_register(DND_FILES)
         self.root.dnd_bind("<<Drop>>", self.on_drop)
 
-    def compute_data_hash(self, contents):
-        """Generate hash value based on database content"""
-        return hashlib.md5(''.join(contents).encode('utf-8')).hexdigest()
-
-    def load_vault_content(self):
-        """Load knowledge base content from database"""
+    def load_vault_rows(self):
+        """Load knowledge base (id, content) rows from database"""
         try:
             conn = mysql.connector.connect(**self.db_config)
             cursor = conn.cursor()
-            cursor.execute("SELECT content FROM knowledge_base")
-            return [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT id, content FROM knowledge_base ORDER BY id")
+            return cursor.fetchall()
         except Error as e:
             messagebox.showerror("Database Error", f"Failed to load knowledge base: {str(e)}")
             return []
@@ -65,108 +65,64 @@ class TestingProcessor:
                 conn.close()
 
     def load_or_generate_embeddings(self, embedding_model='mxbai-embed-large'):
-        """Generate/load embeddings from database"""
-        embeddings_cache_file = 'embeddings_cache.json'
-        cache_info_file = 'cache_info.json'
-
-        # Get current database content
-        current_contents = self.load_vault_content()
-        if not current_contents:
-            return torch.tensor([])
-        
-        current_hash = self.compute_data_hash(current_contents)
-
-        # Check cache validity
-        if os.path.exists(cache_info_file):
-            with open(cache_info_file, 'r') as f:
-                cache_info = json.load(f)
-            if cache_info.get('data_hash') == current_hash:
-                with open(embeddings_cache_file, 'r') as f:
-                    return torch.tensor(json.load(f))
-
-        # Generate new embeddings
-        embeddings = []
-        for content in current_contents:
-            try:
-                response = ollama.embeddings(model=embedding_model, prompt=content.strip())
-                embeddings.append(response["embedding"])
-            except Exception as e:
-                print(f"Failed to generate embedding: {content.strip()}\nError: {e}")
+        """Generate/load embeddings from database; returns the retrieval engine"""
+        # Embed only new or changed rows; drop vectors of deleted rows
+        return load_retriever(self.load_vault_rows(), VECTOR_STORE, embedding_model, VECTOR_DTYPE, VECTOR_QUANTIZATION)
 
-        # Save cache
-        with open(embeddings_cache_file, 'w') as f:
-            json.dump(embeddings, f)
-        with open(cache_info_file, 'w') as f:
-            json.dump({'data_hash': current_hash}, f)
-
-        return torch.tensor(embeddings)
-
-    # Following methods remain unchanged (no functional modifications)
-    # ==============================
     def sparse_context_selection(self, input_text, threshold=0.8, max_k=5):
-        input_embedding = ollama.embeddings(model="mxbai-embed-large", prompt=input_text)["embedding"]
-        cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), self.vault_embeddings_tensor)
-        valid_indices = torch.where(cos_scores >= threshold)[0].tolist()
-        top_indices = sorted(valid_indices, key=lambda i: cos_scores[i], reverse=True)[:max_k]
-        return [self.vault_content[idx].strip() for idx in top_indices]
-
-    def generate_rag_response(self, user_input):
-        relevant_context = self.sparse_context_selection(user_input)
-        context_str = "\n".join(relevant_context) if relevant_context else "No relevant context found."
+        hits = self.retriever.search_text(input_text, min_k=0, max_k=max_k, threshold=threshold)
+        return [content.strip() for _, _, content in hits]
 
-        prompt = f"""
-        User Input:
-        {user_input}
-
-        Relevant Context:
-        {context_str}
-
-        Response:
-        """
-        response = ollama.chat(model="llama3", messages=[{"role": "user", "content": prompt}])
-        return response["message"]["content"]
+    def generate_rag_response(self, user_input, relevant_context=None):
+        if relevant_context is None:
+            relevant_context = self.sparse_context_selection(user_input)
+        messages, _ = build_messages(user_input, relevant_context)
+        return chat(messages, model="llama3", priority="testing")
 
     def calculate_semantic_similarity(self, text1, text2, model="mxbai-embed-large"):
-        embedding1 = ollama.embeddings(model=model, prompt=text1)["embedding"]
-        embedding2 = ollama.embeddings(model=model, prompt=text2)["embedding"]
-        tensor1 = torch.tensor(embedding1).unsqueeze(0)
-        tensor2 = torch.tensor(embedding2).unsqueeze(0)
-        similarity = cosine_similarity(tensor1, tensor2)[0][0]
+        embedding1 = embed_text(text1, model=model)
+        embedding2 = embed_text(text2, model=model)
+        similarity = float(normalize_rows(embedding1) @ normalize_rows(embedding2))
         return similarity
 
     def process_eml_file(self, file_path):
         with open(file_path, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
-        subject = msg["subject"] or "No Subject"
-        text_content = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == 'text/plain':
-                    text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-        else:
-            text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-        return subject, re.sub(r'\s+', ' ', text_content).strip()
+            return parse_eml_file(f, THREAD_MESSAGES)
 
     def process_files_batch(self, file_paths):
-        for file_path in file_paths:
-            if os.path.isfile(file_path) and file_path.endswith(".eml"):
-                subject, body = self.process_eml_file(file_path)
-                try:
-                    question = body.strip()
-                    if not question:
-                        self.display_response("Not a standard training file")
-                        return
-                    rag_response = self.generate_rag_response(question)
-                    similarity = self.calculate_semantic_similarity(question, rag_response)
-                    accuracy = round(similarity * 100, 2)
-                    output_result = (
-                        f"Accuracy: {accuracy}%\n"
-                        f"Standard Answer: {question}\n"
-                        f"RAG Response: {rag_response}"
-                    )
-                    self.display_response(output_result)
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error processing {file_path}: {e}")
+        # Parse everything first so context for the whole drop is retrieved in one batch
+        # Paths go to the parse pool; its workers read and parse the files on all cores
+        questions = []
+        not_standard = False
+        eml_paths = [file_path for file_path in file_paths if os.path.isfile(file_path) and file_path.endswith(".eml")]
+        for file_path, record, error in self.parse_pool.parse_many(((path, path) for path in eml_paths), THREAD_MESSAGES):
+            if error is not None:
+                messagebox.showerror("Error", f"Error processing {file_path}: {error}")
+                continue
+            question = record[1].strip()
+            if not question:
+                not_standard = True
+                break
+            questions.append((file_path, question))
+
+        hits = self.retriever.search_texts([question for _, question in questions], min_k=0)
+        for (file_path, question), question_hits in zip(questions, hits):
+            try:
+                relevant_context = [content.strip() for _, _, content in question_hits]
+                rag_response = self.generate_rag_response(question, relevant_context)
+                similarity = self.calculate_semantic_similarity(question, rag_response)
+                accuracy = round(similarity * 100, 2)
+                output_result = (
+                    f"Accuracy: {accuracy}%\n"
+                    f"Standard Answer: {question}\n"
+                    f"RAG Response: {rag_response}"
+                )
+                self.display_response(output_result)
+            except Exception as e:
+                messagebox.showerror("Error", f"Error processing {file_path}: {e}")
+
+        if not_standard:
+            self.display_response("Not a standard training file")
 
     def display_response(self, response):
         self.output_text.delete("1.0", tk.END)
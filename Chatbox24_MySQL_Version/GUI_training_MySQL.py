@@ -1,17 +1,26 @@
-import torch
-import ollama
-import os
+import io
 import json
 import re
+import queue
 import threading
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from email import policy
-from email.parser import BytesParser
-from bs4 import BeautifulSoup
+from email_parser import parse_eml_file
 from tkinter import messagebox, ttk
+import sqlite3
 import mysql.connector
 from mysql.connector import Error
+from db_config import DB_CONFIG
+from bm25_index import BM25Index, bm25_path
+from llm_client import chat, warm_up
+from training_pipeline import TrainingPipeline, Checkpoint
+from mail_sources import is_mail_source, iter_messages, with_throughput
+from dedup_index import IngestedIndex
+from parse_pool import get_parse_pool
+
+VECTOR_STORE = "vault_vectors_db"  # Must match the store used by GUI_work / GUI_testing
+MAX_OUTPUT_LINES = 5000  # Results kept in the text box during large imports
+THREAD_MESSAGES = 2  # The reply and the message it answers; older history, signatures and disclaimers are left out
 
 class TrainingProcessor:
     def __init__(self, root):
@@ -20,104 +29,139 @@ class TrainingProcessor:
         self.root.geometry("800x600")
 
         # Database configuration
-        self.db_config = {
-            'host': 'localhost',
-            'user': 'root',
-            'password': '1234',  # Update to your actual password
-            'database': 'knowledge_db'
-        }
+        self.db_config = DB_CONFIG
+
+        self.parse_pool = get_parse_pool()
+        self.parse_pool.start()  # Parse workers, forked before any other thread runs
+        warm_up(embed_models=())  # Loads llama3 while the UI comes up
+        self.ui_queue = queue.Queue()  # Pipeline threads -> Tk updates
+        self.ingested = IngestedIndex()  # Emails already in knowledge_base, so resent copies skip the LLM
+        self.running = False
 
         self.setup_ui()
 
     def setup_ui(self):
         """Initialize GUI components"""
-        self.drop_label = tk.Label(self.root, text="Drag and drop your .eml files here", bg="lightgrey", relief="solid")
+        self.drop_label = tk.Label(self.root, text="Drag and drop .eml files, mbox files, zip archives or Maildir folders here", bg="lightgrey", relief="solid")
         self.drop_label.pack(pady=10, padx=10, fill="both", expand=False)
 
         self.status_label = tk.Label(self.root, text="Idle", anchor="w")
         self.status_label.pack(padx=10, fill="x")
 
+        self.read_label = tk.Label(self.root, text="", anchor="w")
+        self.read_label.pack(padx=10, fill="x")
+
         self.output_text = tk.Text(self.root, height=20, wrap="word")
         self.output_text.pack(fill="both", padx=10, pady=10, expand=True)
 
         self.root.drop_target_register(DND_FILES)
         self.root.dnd_bind("<<Drop>>", self.on_drop)
+        self.root.after(100, self.poll_ui_queue)
 
     def on_drop(self, event):
         """Handle file drop event"""
         file_paths = [match[0] if match[0] else match[1] for match in re.findall(r'\{(.*?)\}|([^{}]+)', event.data.strip())]
-        threading.Thread(target=self.process_files_batch, args=(file_paths,)).start()
+        sources = [path for path in file_paths if is_mail_source(path)]
+        for path in file_paths:
+            if path not in sources:
+                self.output_text.insert(tk.END, f"Skipped (not .eml, mbox, zip or a folder): {path}\n")
+        if not sources:
+            return
+        if self.running:
+            messagebox.showinfo("Busy", "Still processing the previous drop, please wait")
+            return
+        self.running = True
+        threading.Thread(target=self.process_files_batch, args=(sources,), daemon=True).start()
 
     def process_files_batch(self, file_paths):
-        """Batch process files and store in database"""
+        """Run dropped files, mbox files, zip archives and Maildir folders through the
+        parse -> extract -> batched write pipeline; messages are read as it asks for more
+        """
+        checkpoint = Checkpoint()
+        if len(checkpoint):
+            self.ui_queue.put(("status", f"Resuming: {len(checkpoint)} emails already stored by an earlier run"))
+        pipeline = TrainingPipeline(
+            parse=lambda data: self.process_eml_file(io.BytesIO(data)),
+            analyze=lambda body: self.analyze_and_process_text(body, "llama3"),
+            write=self.write_records,
+            checkpoint=checkpoint,
+            dedup=self.ingested,
+            normalize=self.clean_input_text,
+            parse_pool=self.parse_pool,
+            thread_messages=THREAD_MESSAGES,
+            on_progress=lambda result, stats: self.ui_queue.put(("progress", result, stats)),
+            keep_results=False,
+        )
+        try:
+            messages = with_throughput(iter_messages(file_paths), lambda stats: self.ui_queue.put(("read", stats)))
+            pipeline.run(messages)
+            self.ui_queue.put(("finished", pipeline.stats))
+        except Exception as e:
+            self.ui_queue.put(("error", str(e)))
+
+    def write_records(self, records):
+        """Insert one batch of extracted records in a single transaction"""
+        conn = mysql.connector.connect(**self.db_config)
         try:
-            conn = mysql.connector.connect(**self.db_config)
             cursor = conn.cursor()
-            
-            for file_path in file_paths:
-                if os.path.isfile(file_path) and file_path.endswith(".eml"):
-                    try:
-                        # Process EML file
-                        subject, body = self.process_eml_file(file_path)
-                        self.update_progress(subject)
-                        
-                        # Analyze text content
-                        analysis_result = self.analyze_and_process_text(body, "llama3")
-                        question = analysis_result.get("Question", "").strip()
-                        answer = analysis_result.get("Answer", "").strip()
-                        
-                        # Build database record
-                        combined_content = f"Question: {question}\nAnswer: {answer if answer else '[No answer provided]'}"
-                        
-                        # Insert into database
-                        cursor.execute("""
-                            INSERT INTO knowledge_base (content, source_type)
-                            VALUES (%s, 'Email')
-                        """, (combined_content,))
-                        
-                        # Display processing result
-                        self.display_response(f"Subject: {subject}\n{combined_content}")
-                    except Exception as e:
-                        messagebox.showerror("Error", f"Failed to process file: {file_path}\nError: {str(e)}")
-                else:
-                    messagebox.showerror("Invalid File", f"Non-.eml file: {file_path}")
-            
-            # Commit transaction
+            inserted = []
+            for record in records:
+                combined_content = f"Question: {record['question']}\nAnswer: {record['answer'] or '[No answer provided]'}"
+                cursor.execute("""
+                    INSERT INTO knowledge_base (content, source_type)
+                    VALUES (%s, 'Email')
+                """, (combined_content,))
+                inserted.append((cursor.lastrowid, combined_content))
             conn.commit()
-            self.update_progress("All files processed")
-            
-        except Error as e:
-            messagebox.showerror("Database Error", f"Database operation failed: {str(e)}")
-            if 'conn' in locals():
-                conn.rollback()
+            cursor.close()
+        except Error:
+            conn.rollback()
+            raise
         finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-
-    def process_eml_file(self, file_path):
-        """Parse EML file content"""
-        with open(file_path, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
-
-        subject = msg["subject"] or "No Subject"
-        text_content = ""
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == 'text/plain':
-                    text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                elif part.get_content_type() == 'text/html':
-                    html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                    text_content += BeautifulSoup(html_content, 'lxml').get_text()
-        else:
-            if msg.get_content_type() == 'text/plain':
-                text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-            elif msg.get_content_type() == 'text/html':
-                html_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-                text_content = BeautifulSoup(html_content, 'lxml').get_text()
-
-        return subject, re.sub(r'\s+', ' ', text_content).strip()
+            conn.close()
+        self.update_lexical_index(inserted)
+
+    def poll_ui_queue(self):
+        """Apply worker updates on the Tk thread"""
+        try:
+            while True:
+                kind, *args = self.ui_queue.get_nowait()
+                if kind == "status":
+                    self.status_label.config(text=args[0])
+                elif kind == "read":
+                    stats = args[0]
+                    self.read_label.config(text=f"Read {stats['messages']} messages, {stats['mb']} MB "
+                                                f"({stats['messages_per_s']} messages/s, {stats['mb_per_s']} MB/s)")
+                elif kind == "progress":
+                    result, stats = args
+                    self.update_progress(stats)
+                    if result["error"]:
+                        self.output_text.insert(tk.END, f"Failed: {result['source']}\n{result['error']}\n\n")
+                    elif result["skipped"]:
+                        self.output_text.insert(tk.END, f"Skipped: {result['source']} ({result['skipped']})\n\n")
+                    else:
+                        answer = result["answer"] or "[No answer provided]"
+                        self.output_text.insert(tk.END, f"Subject: {result['subject']}\n"
+                                                        f"Question: {result['question']}\nAnswer: {answer}\n\n")
+                    self.output_text.delete("1.0", f"end-{MAX_OUTPUT_LINES}l")
+                    self.output_text.see(tk.END)
+                elif kind == "finished":
+                    self.running = False
+                    self.update_progress(args[0], done=True)
+                    if args[0]["failed"]:
+                        messagebox.showwarning("Finished with errors",
+                                               f"{args[0]['failed']} emails failed; drop the same files again to retry them")
+                elif kind == "error":
+                    self.running = False
+                    self.status_label.config(text="Stopped")
+                    messagebox.showerror("Error", f"Processing stopped: {args[0]}")
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_ui_queue)
+
+    def process_eml_file(self, file):
+        """Parse EML file content from a binary file object"""
+        return parse_eml_file(file, THREAD_MESSAGES)
 
     def analyze_and_process_text(self, input_text, ollama_model):
         """Analyze text using LLM"""
@@ -139,12 +183,8 @@ class TrainingProcessor:
           "Answer": "Answer content (omit if none)"
         }}
         """
-        response = ollama.chat(model=ollama_model, messages=[{"role": "system", "content": prompt}])
-
-        if "message" not in response or "content" not in response["message"]:
-            raise RuntimeError(f"Invalid response format: {response}")
-
-        return json.loads(self.extract_json_from_content(response["message"]["content"]))
+        content = chat([{"role": "system", "content": prompt}], model=ollama_model, priority="training")
+        return json.loads(self.extract_json_from_content(content))
 
     def clean_input_text(self, input_text):
         """Clean duplicate content"""
@@ -159,15 +199,23 @@ class TrainingProcessor:
             return match.group(0)
         raise ValueError("No valid JSON found in response")
 
-    def update_progress(self, message):
-        """Update status bar"""
-        self.status_label.config(text=message)
-        self.root.update_idletasks()
-
-    def display_response(self, response):
-        """Display processing result"""
-        self.output_text.delete("1.0", tk.END)
-        self.output_text.insert("1.0", response)
+    def update_lexical_index(self, rows):
+        """Add inserted rows to the BM25 index used for retrieval"""
+        try:
+            BM25Index(bm25_path(VECTOR_STORE)).add(rows)
+        except sqlite3.Error as e:
+            print(f"Failed to update lexical index: {e}")
+
+    def update_progress(self, stats, done=False):
+        """Update status bar with pipeline counters (Tk thread only)"""
+        processed = stats["written"] + stats["skipped"] + stats["failed"]
+        rate = processed / stats["elapsed_s"] if stats["elapsed_s"] else 0.0
+        prefix = "All files processed" if done else f"Processed {processed}/{stats['queued']}"
+        resumed = f", {stats['resumed']} resumed" if stats["resumed"] else ""
+        self.status_label.config(text=f"{prefix}: {stats['written']} stored, {stats['skipped']} skipped "
+                                      f"({stats['llm_calls_saved']} duplicates, LLM not called), "
+                                      f"{stats['failed']} failed{resumed} ({rate:.1f} emails/s), "
+                                      f"{stats['tokens_saved']} prompt tokens of quoted history and signatures left out")
 
 if __name__ == "__main__":
     root = TkinterDnD.Tk()
@@ -1,19 +1,28 @@
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from email import policy
-from email.parser import BytesParser
-from bs4 import BeautifulSoup
-import os
+from email_parser import parse_eml_file
 import re
-import torch
-import ollama
-import hashlib
-import json
-from langdetect import detect
+import queue
+import threading
 from tkinter import messagebox, ttk
-from openai import OpenAI
+from llm_client import chat, chat_stream, warm_up
+from embeddings import embed_text
+from answer_cache import AnswerCache, context_key
+from prompt_builder import build_messages
 import mysql.connector
 from mysql.connector import Error
+from db_config import DB_CONFIG
+from retrieval import load_retriever
+from retrieval_daemon import connect_retriever, VAULT_DB
+from mail_sources import is_mail_source, iter_messages, with_throughput
+from parse_pool import get_parse_pool
+from language_id import get_language_identifier
+
+VECTOR_STORE = "vault_vectors_db"
+VECTOR_DTYPE = "float32"  # "float16" halves the store size on disk and in page cache
+VECTOR_QUANTIZATION = None  # "int8" (4x) or "pq" (16x) keeps only compressed codes in memory
+THREAD_MESSAGES = 1  # Answer the newest message; quoted history, signatures and disclaimers are left out
+WORK_CHUNK = 16  # Emails read and retrieved for at a time, so an archive is never all in memory
 
 class EmailProcessor:
     def __init__(self, root):
@@ -22,22 +31,25 @@ class EmailProcessor:
         self.root.geometry("800x600")
 
         # Database configuration
-        self.db_config = {
-            'host': 'localhost',
-            'user': 'root',
-            'password': '1234',  # Update to your actual password
-            'database': 'knowledge_db'
-        }
+        self.db_config = DB_CONFIG
 
+        self.parse_pool = get_parse_pool()
+        self.parse_pool.start()  # Parse workers, forked before any other thread runs
+        warm_up()  # Loads llama3 and the embedding model while the UI comes up
+        self.language = get_language_identifier().load()  # Profiles load now, not on the first email
         self.email_data = {}  # Stores email subjects and RAG-generated responses
-        self.vault_embeddings_tensor = self.load_or_generate_embeddings()
-        self.vault_content = self.load_vault_content()
+        self.ui_queue = queue.Queue()  # Worker thread -> Tk updates (streamed tokens)
+        self.streaming = None  # (subject, chunks so far) of the response being generated
+        self.answer_cache = AnswerCache()  # Reuses answers to near-identical emails with the same context
+        self.tokens_saved = 0  # Prompt tokens of quoted history and signatures left out
+        # Shared with the other front-ends through the retrieval daemon when it runs
+        self.retriever = connect_retriever(VAULT_DB, self.load_or_generate_embeddings)
 
         self.setup_ui()
 
     def setup_ui(self):
         """Initialize GUI components"""
-        drop_label = tk.Label(self.root, text="Drag and drop your .eml files here", bg="lightgrey", relief="solid")
+        drop_label = tk.Label(self.root, text="Drag and drop .eml files, mbox files, zip archives or Maildir folders here", bg="lightgrey", relief="solid")
         drop_label.pack(pady=10, padx=10, fill="both", expand=False)
 
         subject_menu_label = tk.Label(self.root, text="Select Email Subject:")
@@ -53,21 +65,24 @@ class EmailProcessor:
         copy_button = tk.Button(self.root, text="Copy Response", command=self.copy_to_clipboard)
         copy_button.pack(pady=10)
 
+        self.cache_label = tk.Label(self.root, text="", anchor="w")
+        self.cache_label.pack(padx=10, fill="x")
+
+        self.progress_label = tk.Label(self.root, text="", anchor="w")
+        self.progress_label.pack(padx=10, fill="x")
+
         self.root.drop_target_register(DND_FILES)
         self.root.dnd_bind("<<Drop>>", self.on_drop)
 
-    def compute_data_hash(self, contents):
-        """Generate hash value based on database content"""
-        return hashlib.md5(''.join(contents).encode('utf-8')).hexdigest()
+        self.root.after(50, self.poll_ui_queue)
 
-    def load_vault_content(self):
-        """Load knowledge base content from database"""
+    def load_vault_rows(self):
+        """Load knowledge base (id, content) rows from database"""
         try:
             conn = mysql.connector.connect(**self.db_config)
             cursor = conn.cursor()
-            cursor.execute("SELECT content FROM knowledge_base")
-            contents = [row[0] for row in cursor.fetchall()]
-            return contents
+            cursor.execute("SELECT id, content FROM knowledge_base ORDER BY id")
+            return cursor.fetchall()
         except Error as e:
             messagebox.showerror("Database Error", f"Failed to load content: {str(e)}")
             return []
@@ -77,130 +92,154 @@ class EmailProcessor:
                 conn.close()
 
     def load_or_generate_embeddings(self, embedding_model='mxbai-embed-large'):
-        """Generate embeddings from database content"""
-        embeddings_cache_file = 'embeddings_cache.json'
-        cache_info_file = 'cache_info.json'
-
-        # Get current database content hash
-        current_contents = self.load_vault_content()
-        if not current_contents:
-            return torch.tensor([])
-        
-        current_hash = self.compute_data_hash(current_contents)
-
-        # Check cache validity
-        if os.path.exists(cache_info_file):
-            with open(cache_info_file, 'r') as f:
-                cache_info = json.load(f)
-            if cache_info.get('data_hash') == current_hash:
-                with open(embeddings_cache_file, 'r') as f:
-                    return torch.tensor(json.load(f))
-
-        # Generate new embeddings
-        embeddings = []
-        for content in current_contents:
-            try:
-                response = ollama.embeddings(model=embedding_model, prompt=content.strip())
-                embeddings.append(response["embedding"])
-            except Exception as e:
-                print(f"Failed to generate embedding for content: {content.strip()}\nError: {e}")
-
-        # Save cache
-        with open(embeddings_cache_file, 'w') as f:
-            json.dump(embeddings, f)
-        with open(cache_info_file, 'w') as f:
-            json.dump({'data_hash': current_hash}, f)
-
-        return torch.tensor(embeddings)
+        """Generate embeddings from database content; returns the retrieval engine"""
+        # Embed only new or changed rows; drop vectors of deleted rows
+        return load_retriever(self.load_vault_rows(), VECTOR_STORE, embedding_model, VECTOR_DTYPE, VECTOR_QUANTIZATION)
 
     def sparse_context_selection(self, rewritten_input, min_k=1, max_k=5, threshold=0.8):
-        """Context retrieval logic (unchanged)"""
-        if self.vault_embeddings_tensor.nelement() == 0:
+        """Context retrieval logic"""
+        if not len(self.retriever):
             return []
 
-        input_embedding = ollama.embeddings(model='mxbai-embed-large', prompt=rewritten_input)["embedding"]
-        cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), self.vault_embeddings_tensor)
-
-        valid_indices = torch.where(cos_scores >= threshold)[0].tolist()
-        if len(valid_indices) < min_k:
-            top_indices = torch.topk(cos_scores, k=min_k)[1].tolist()
-        else:
-            sorted_valid_indices = sorted(valid_indices, key=lambda i: cos_scores[i], reverse=True)
-            top_indices = sorted_valid_indices[:max_k]
-
-        return [self.vault_content[idx].strip() for idx in top_indices]
+        hits = self.retriever.search_text(rewritten_input, min_k, max_k, threshold)
+        return [content.strip() for _, _, content in hits]
 
-    def generate_response(self, user_input):
-        """Response generation logic (unchanged)"""
-        relevant_context = self.sparse_context_selection(user_input)
-        context_str = "\n".join(relevant_context) if relevant_context else "No relevant context found."
+    def batch_context_selection(self, inputs, min_k=1, max_k=5, threshold=0.8):
+        """Context retrieval for many inputs with one batched embedding and scoring pass"""
+        hits = self.retriever.search_texts(inputs, min_k, max_k, threshold)
+        return [[content.strip() for _, _, content in input_hits] for input_hits in hits]
 
-        detected_language = detect(user_input)
-        prompt_language = "German" if detected_language == 'de' else "English"
-
-        prompt = f"""
-        You are a helpful assistant. The user expects a concise and accurate response in {prompt_language}.
-        
-        User Input:
-        {user_input}
-
-        Relevant Context:
-        {context_str}
-
-        Response:
+    def generate_response(self, user_input, relevant_context=None, on_token=None):
+        """Response generation logic; retrieves context unless it is passed in.
+        With ``on_token`` the response is streamed and each chunk passed to it.
         """
+        if relevant_context is None:
+            relevant_context = self.sparse_context_selection(user_input)
 
-        client = OpenAI(base_url='http://localhost:11434/v1', api_key='llama3')
-        messages = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}]
-
-        response = client.chat.completions.create(model="llama3", messages=messages, max_tokens=2000)
-        return response.choices[0].message.content
+        prompt_language = self.language.prompt_language(user_input)  # Same answer on every retry
 
-    def process_eml_file(self, file_path):
-        """Process EML files (unchanged)"""
-        with open(file_path, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
-
-        subject = msg["subject"] or "No Subject"
-        text_content = ""
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == 'text/plain':
-                    text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                elif part.get_content_type() == 'text/html':
-                    html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                    text_content += BeautifulSoup(html_content, 'lxml').get_text()
+        # Token-budgeted: lowest-ranked context is dropped first, long emails are cut
+        messages, used_context = build_messages(user_input, relevant_context, prompt_language)
+        key = context_key(used_context, prompt_language)
+        try:
+            query = embed_text(user_input)
+        except Exception as e:
+            print(f"Answer cache skipped: {e!r}")
+            query = None
+        cached = self.answer_cache.get(query, key) if query is not None else None
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+        if on_token is None:
+            response = chat(messages, model="llama3", max_tokens=2000)
         else:
-            if msg.get_content_type() == 'text/plain':
-                text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-            elif msg.get_content_type() == 'text/html':
-                html_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-                text_content = BeautifulSoup(html_content, 'lxml').get_text()
+            parts = []
+            for token in chat_stream(messages, model="llama3", max_tokens=2000):
+                if token:
+                    parts.append(token)
+                    on_token(token)
+            response = "".join(parts)
 
-        return subject, re.sub(r'\s+', ' ', text_content).strip()
+        if query is not None:
+            self.answer_cache.put(query, key, response)
+        return response
+
+    def process_eml_file(self, file):
+        """Process an EML message from a binary file object"""
+        return parse_eml_file(file, THREAD_MESSAGES)
 
     def on_drop(self, event):
-        """Handle file drop (unchanged)"""
+        """Handle file drop; emails are processed on a worker thread"""
         file_paths = re.findall(r'\{(.*?)\}|([^{}]+)', event.data.strip())
 
+        sources = []
         for path_group in file_paths:
             file_path = path_group[0] if path_group[0] else path_group[1]
 
-            if os.path.isfile(file_path) and file_path.endswith(".eml"):
-                subject, body = self.process_eml_file(file_path)
-                response = self.generate_response(body)
-                self.email_data[subject] = response
+            if is_mail_source(file_path):
+                sources.append(file_path)
 
-        self.subject_menu['values'] = list(self.email_data.keys())
-        if self.email_data:
-            self.subject_menu.current(0)
-            self.display_response()
+        if sources:
+            threading.Thread(target=self.process_emails, args=(sources,), daemon=True).start()
+
+    def process_emails(self, sources):
+        """Worker thread: messages are read lazily from .eml files, mbox files, zip
+        archives and Maildir folders and parsed on the parse pool; context is
+        retrieved in one batch per chunk, and responses are streamed to the UI
+        queue as they are generated
+        """
+        try:
+            messages = with_throughput(iter_messages(sources), lambda stats: self.ui_queue.put(("read", stats)))
+            chunk = []
+            for name, record, error in self.parse_pool.parse_many(messages, THREAD_MESSAGES):
+                if error is not None:
+                    print(f"Skipped {name}: {error}")
+                    continue
+                subject, body, metadata = record
+                self.tokens_saved += metadata.get("tokens_saved", 0)
+                chunk.append((subject, body))
+                if len(chunk) == WORK_CHUNK:
+                    self.respond_to_chunk(chunk)
+                    chunk = []
+            self.respond_to_chunk(chunk)
+        except Exception as e:
+            self.ui_queue.put(("error", str(e)))
+
+    def respond_to_chunk(self, emails):
+        if not emails:
+            return
+        contexts = self.batch_context_selection([body for _, body in emails])
+        for (subject, body), relevant_context in zip(emails, contexts):
+            self.ui_queue.put(("start", subject))
+            response = self.generate_response(body, relevant_context,
+                                              on_token=lambda token: self.ui_queue.put(("token", token)))
+            self.ui_queue.put(("done", subject, response))
+
+    def poll_ui_queue(self):
+        """Apply worker updates on the Tk thread"""
+        try:
+            while True:
+                kind, *args = self.ui_queue.get_nowait()
+                if kind == "start":
+                    self.streaming = (args[0], [])
+                    self.subject_menu['values'] = list(dict.fromkeys([*self.email_data, args[0]]))
+                    self.subject_menu.set(args[0])
+                    self.output_text.delete("1.0", tk.END)
+                elif kind == "token":
+                    subject, parts = self.streaming
+                    parts.append(args[0])
+                    if self.subject_menu.get() == subject:
+                        self.output_text.insert(tk.END, args[0])
+                        self.output_text.see(tk.END)
+                elif kind == "done":
+                    # Full text is stored once the stream has finished
+                    self.email_data[args[0]] = args[1]
+                    self.streaming = None
+                    self.subject_menu['values'] = list(self.email_data.keys())
+                    stats = self.answer_cache.stats()
+                    self.cache_label.config(text=f"Answer cache: {stats['hits']} hits, {stats['misses']} misses")
+                elif kind == "read":
+                    stats = args[0]
+                    self.progress_label.config(text=f"Read {stats['messages']} messages, {stats['mb']} MB "
+                                                    f"({stats['messages_per_s']} messages/s, {stats['mb_per_s']} MB/s), "
+                                                    f"{self.tokens_saved} prompt tokens of quoted history and signatures left out")
+                elif kind == "error":
+                    self.streaming = None
+                    self.subject_menu['values'] = list(self.email_data.keys())
+                    messagebox.showerror("Error", f"Failed to process emails: {args[0]}")
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_ui_queue)
 
     def display_response(self, event=None):
-        """Display response (unchanged)"""
+        """Display response; a response still streaming shows what has arrived so far"""
         selected_subject = self.subject_menu.get()
-        response = self.email_data.get(selected_subject, "No response available.")
+        if self.streaming and self.streaming[0] == selected_subject:
+            response = "".join(self.streaming[1])
+        else:
+            response = self.email_data.get(selected_subject, "No response available.")
         self.output_text.delete("1.0", tk.END)
         self.output_text.insert("1.0", response)
 
@@ -0,0 +1,223 @@
+import os
+import sys
+import copy
+import time
+import numpy as np
+from vector_store import VectorStore, normalize_rows as _normalize, surviving_rows
+
+ANN_MIN_ROWS = 20_000       # Below this an exact scan is fast enough
+ANN_PROBE_FRACTION = 0.1    # Share of the lists scanned per query before calibration; nlist grows with
+                            # the KB, so a fixed count of lists would scan less of it, and recall drop, as it grows
+ANN_MIN_NPROBE = 8
+ANN_RECALL_TARGET = 0.95    # Recall@5 against an exact scan that build() tunes nprobe for
+ANN_CALIBRATION_QUERIES = 100
+
+def default_nprobe(nlist):
+    """Lists scanned per query when no calibrated value is known"""
+    return min(nlist, max(ANN_MIN_NPROBE, int(np.ceil(ANN_PROBE_FRACTION * nlist))))
+
+def _near_queries(matrix, count, seed=0):
+    """Rows of ``matrix`` with a little noise added: near, not identical, queries"""
+    rng = np.random.default_rng(seed)
+    sample = _normalize(matrix[np.sort(rng.choice(len(matrix), size=min(count, len(matrix)), replace=False))])
+    return _normalize(sample + rng.normal(scale=0.02, size=sample.shape).astype(sample.dtype))
+
+def _exact_top_k(matrix, queries, k, chunk_size=8192):
+    """Positions of the ``k`` rows nearest to each query, by a full scan"""
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_positions = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(matrix), chunk_size):
+        chunk = _normalize(matrix[start:start + chunk_size])
+        scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+        positions = np.concatenate([best_positions,
+                                    np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))],
+                                   axis=1)
+        top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_positions = np.take_along_axis(positions, top, axis=1)
+    return [set(row.tolist()) for row in best_positions]
+
+class IVFIndex:
+    """Inverted-file (IVF-flat) index over cosine similarity, built with NumPy.
+
+    Rows are clustered around ``nlist`` centroids; a query scans only the rows
+    of its ``nprobe`` nearest clusters. Lists are held in CSR form: ``order``
+    holds row positions grouped by cluster, ``offsets`` delimits each cluster.
+    ``nprobe`` defaults to a fixed share of the lists (``default_nprobe``).
+    """
+
+    def __init__(self, centroids, assignments, nprobe=None):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.nprobe = nprobe or default_nprobe(len(centroids))
+        self._build_lists()
+
+    @classmethod
+    def build(cls, matrix, nlist=None, iterations=10, sample_size=50_000, nprobe=None, seed=0):
+        """Cluster the rows of ``matrix`` with spherical k-means; without an
+        explicit ``nprobe`` it is calibrated for ANN_RECALL_TARGET
+        """
+        rng = np.random.default_rng(seed)
+        count = len(matrix)
+        nlist = nlist or max(1, min(count, int(4 * np.sqrt(count))))
+
+        sample_positions = rng.choice(count, size=min(count, max(sample_size, nlist)), replace=False)
+        sample = _normalize(matrix[np.sort(sample_positions)])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            sums[empty] = centroids[empty]  # Keep empty clusters where they were
+            centroids = _normalize(sums)
+
+        index = cls(centroids, np.empty(0, dtype=np.int32), nprobe)
+        index.add(matrix)
+        if nprobe is None:
+            index.calibrate(matrix)
+        return index
+
+    def _assign(self, matrix, chunk_size=8192):
+        labels = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), chunk_size):
+            chunk = _normalize(matrix[start:start + chunk_size])
+            labels[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return labels
+
+    def _build_lists(self):
+        self.order = np.argsort(self.assignments, kind='stable').astype(np.int64)
+        self.offsets = np.searchsorted(self.assignments[self.order], np.arange(len(self.centroids) + 1))
+
+    def add(self, rows):
+        """Append rows (taking the next positions) to their nearest clusters"""
+        self.assignments = np.concatenate([self.assignments, self._assign(rows)])
+        self._build_lists()
+
+    def extended(self, rows):
+        """Copy of the index with ``rows`` appended (taking the next positions);
+        the new positions are spliced into the lists instead of re-sorting them
+        """
+        labels = self._assign(rows)
+        positions = np.arange(len(self.assignments), len(self.assignments) + len(rows))
+        by_list = np.argsort(labels, kind='stable')
+        index = copy.copy(self)
+        index.assignments = np.concatenate([self.assignments, labels])
+        index.order = np.insert(self.order, self.offsets[labels[by_list] + 1], positions[by_list])
+        index.offsets = self.offsets + np.concatenate(
+            [[0], np.cumsum(np.bincount(labels, minlength=len(self.centroids)))])
+        return index
+
+    def reassign(self, positions, rows):
+        """Move rows whose vectors changed in place to their new nearest clusters"""
+        self.assignments[positions] = self._assign(rows)
+        self._build_lists()
+
+    def candidates(self, query, nprobe=None):
+        """Positions of the rows in the clusters nearest to ``query``"""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        scores = self.centroids @ _normalize(query)
+        probed = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probed])
+
+    def recall(self, matrix, queries, expected, nprobe=None, k=5):
+        """Share of the exact top-``k`` rows (``expected``, from _exact_top_k) that a probed search finds"""
+        hits = 0
+        for query, exact in zip(queries, expected):
+            positions = np.sort(self.candidates(query, nprobe))
+            scores = _normalize(matrix[positions]) @ query
+            top = positions[np.argpartition(-scores, min(k, len(scores)) - 1)[:k]]
+            hits += len(exact & set(top.tolist()))
+        return hits / max(1, sum(len(exact) for exact in expected))
+
+    def calibrate(self, matrix, target=ANN_RECALL_TARGET, queries=ANN_CALIBRATION_QUERIES, k=5):
+        """Set ``nprobe`` to the smallest multiple of default_nprobe whose recall@``k``
+        on rows of ``matrix`` reaches ``target`` (at most all lists). Returns the
+        recall reached.
+        """
+        sample = _near_queries(matrix, queries)
+        expected = _exact_top_k(matrix, sample, k)
+        step = nprobe = default_nprobe(len(self.centroids))
+        while True:
+            reached = self.recall(matrix, sample, expected, nprobe, k)
+            if reached >= target or nprobe >= len(self.centroids):
+                self.nprobe = nprobe
+                return reached
+            nprobe = min(len(self.centroids), nprobe + step)
+
+    def save(self, path, ids, hashes):
+        """Persist the index, with its nprobe, along with the store rows it was built from"""
+        tmp_path = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(tmp_path, centroids=self.centroids, assignments=self.assignments, nprobe=self.nprobe,
+                 ids=np.asarray(ids), hashes=np.asarray(hashes))
+        os.replace(tmp_path, path)
+
+def index_path(store):
+    return f"{store.prefix}.ivf.npz"
+
+def load_or_build_index(store, ids, hashes, matrix, min_rows=ANN_MIN_ROWS, nprobe=None):
+    """Open the IVF index persisted next to ``store``, updating it for appended,
+    changed or deleted rows. Returns None when the corpus is small enough for an
+    exact scan. ``nprobe`` overrides the value calibrated when the index was built.
+    """
+    if len(ids) < min_rows:
+        return None
+
+    path = index_path(store)
+    if os.path.exists(path):
+        try:
+            saved = np.load(path)
+            saved_ids, saved_hashes = saved['ids'], saved['hashes']
+            saved_nprobe = int(saved['nprobe']) if 'nprobe' in saved.files else None
+            index = IVFIndex(saved['centroids'], saved['assignments'], nprobe or saved_nprobe)
+        except (OSError, ValueError, KeyError):
+            saved_ids = None
+        keep = None if saved_ids is None else surviving_rows(saved_ids, ids)
+        if keep is not None:
+            if len(keep) < len(saved_ids):
+                index = IVFIndex(index.centroids, index.assignments[keep], index.nprobe)  # Centroids stay valid
+            known = len(keep)
+            changed = np.flatnonzero(np.asarray(hashes[:known]) != saved_hashes[keep])
+            uncalibrated = nprobe is None and saved_nprobe is None  # Saved before nprobe was calibrated
+            if len(changed) or known < len(ids) or known < len(saved_ids) or uncalibrated:
+                if len(changed):
+                    index.reassign(changed, matrix[changed])
+                if known < len(ids):
+                    index.add(matrix[known:])
+                if uncalibrated:
+                    index.calibrate(matrix)
+                index.save(path, ids, hashes)
+            return index
+
+    # Rows were reordered or no index exists yet
+    index = IVFIndex.build(matrix, nprobe=nprobe)
+    index.save(path, ids, hashes)
+    return index
+
+def evaluate(store_prefix, queries=200, k=5):
+    """Report recall@k and latency of the IVF index against an exact scan for a range of nprobe values"""
+    cached = VectorStore(store_prefix).open()
+    if cached is None:
+        raise FileNotFoundError(f"No vector store at {store_prefix}")
+    header, ids, hashes, matrix = cached
+    # Small stores are searched exactly and keep no index; build one in memory to see what it would do
+    index = load_or_build_index(VectorStore(store_prefix), ids, hashes, matrix) or IVFIndex.build(matrix)
+    sample = _near_queries(matrix, queries, seed=1)
+    expected = _exact_top_k(matrix, sample, k)
+
+    nlist = len(index.centroids)
+    print(f"Rows: {len(ids)}, dim: {header['dim']}, lists: {nlist}, nprobe in use: {index.nprobe} "
+          f"(target recall@{k}: {ANN_RECALL_TARGET})")
+    candidates = {max(1, default_nprobe(nlist) * factor // 8) for factor in (1, 2, 4, 8, 16, 32, 64)} | {index.nprobe}
+    for nprobe in sorted(value for value in candidates if 1 <= value <= nlist):
+        started = time.perf_counter()
+        reached = index.recall(matrix, sample, expected, nprobe, k)
+        elapsed = time.perf_counter() - started
+        print(f"nprobe {nprobe:5d} ({nprobe / nlist:6.1%} of lists): recall@{k} {reached:.3f}, "
+              f"{1000 * elapsed / len(sample):.2f} ms/query")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python ann_index.py <vector store prefix>")
+        sys.exit(1)
+    evaluate(sys.argv[1])
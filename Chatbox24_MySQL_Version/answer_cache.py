@@ -0,0 +1,95 @@
+import time
+import threading
+import numpy as np
+from vector_store import normalize_rows, content_hash
+
+ANSWER_CACHE_THRESHOLD = 0.97  # Cosine similarity above which two queries count as the same question
+ANSWER_CACHE_TTL = 24 * 3600   # Seconds an answer may be reused
+ANSWER_CACHE_SIZE = 2000       # Entries kept; least recently used go first
+
+def context_key(relevant_context, *variant):
+    """Identify the context rows an answer was generated from by their content
+    fingerprints. An edited row no longer matches and a deleted one is no
+    longer retrieved, so answers built on either are never served again.
+    ``variant`` holds anything else the prompt depends on, e.g. the language.
+    """
+    return tuple(variant) + tuple(content_hash(content) for content in relevant_context)
+
+class AnswerCache:
+    """Generated answers looked up by query embedding.
+
+    Query vectors live in one preallocated matrix, so a lookup is a single
+    matrix-vector product; an answer is reused only when the query is similar
+    enough *and* the retrieved context is the same.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.vectors = None  # (max_entries, dim); free slots are zero rows and never reach the threshold
+        self.entries = {}    # slot -> [context key, answer, created, last used]
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0       # Similar queries whose context had changed
+        self._lock = threading.Lock()
+
+    def get(self, query_vector, key):
+        """Return a cached answer for a near-identical query with the same context, or None"""
+        query = normalize_rows(query_vector)
+        now = time.time()
+        with self._lock:
+            if self.vectors is None or len(query) != self.vectors.shape[1]:
+                self.misses += 1
+                return None
+            scores = self.vectors @ query
+            candidates = np.flatnonzero(scores >= self.threshold)
+            for slot in candidates[np.argsort(-scores[candidates])]:
+                entry = self.entries[slot]
+                if now - entry[2] > self.ttl:
+                    self._drop(slot)
+                elif entry[0] == key:
+                    entry[3] = now
+                    self.hits += 1
+                    return entry[1]
+                else:
+                    self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, query_vector, key, answer):
+        query = normalize_rows(query_vector)
+        now = time.time()
+        with self._lock:
+            if self.vectors is None or len(query) != self.vectors.shape[1]:
+                self.vectors = np.zeros((self.max_entries, len(query)), dtype=np.float32)
+                self.entries = {}
+            if len(self.entries) >= self.max_entries:
+                self._evict(now)
+            slot = next(slot for slot in range(self.max_entries) if slot not in self.entries)
+            self.vectors[slot] = query
+            self.entries[slot] = [key, answer, now, now]
+
+    def _evict(self, now):
+        expired = [slot for slot, entry in self.entries.items() if now - entry[2] > self.ttl]
+        for slot in expired or [min(self.entries, key=lambda slot: self.entries[slot][3])]:
+            self._drop(slot)
+
+    def _drop(self, slot):
+        self.vectors[slot] = 0
+        del self.entries[slot]
+
+    def clear(self):
+        with self._lock:
+            self.vectors = None
+            self.entries = {}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stale_context": self.stale,
+            "entries": len(self.entries),
+        }
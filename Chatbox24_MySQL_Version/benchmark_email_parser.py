@@ -0,0 +1,130 @@
+import os
+import re
+import sys
+import time
+import argparse
+import random
+from email import policy
+from email.parser import BytesParser
+from email.message import EmailMessage
+from email_parser import parse_email
+from mail_sources import iter_messages
+from parse_pool import ParsePool
+
+def legacy_parse(data):
+    """The process_eml_file the front-ends used before email_parser, for comparison"""
+    from bs4 import BeautifulSoup
+
+    msg = BytesParser(policy=policy.default).parsebytes(data)
+    subject = msg["subject"] or "No Subject"
+    text_content = ""
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == 'text/plain':
+                text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
+            elif part.get_content_type() == 'text/html':
+                html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
+                text_content += BeautifulSoup(html_content, 'lxml').get_text()
+    else:
+        if msg.get_content_type() == 'text/plain':
+            text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
+        elif msg.get_content_type() == 'text/html':
+            html_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
+            text_content = BeautifulSoup(html_content, 'lxml').get_text()
+
+    return subject, re.sub(r'\s+', ' ', text_content).strip()
+
+def synthetic_corpus(count, seed=0):
+    """Messages shaped like a support mailbox: plain replies, HTML newsletters with a
+    plain alternative, HTML-only mails, PDF attachments and legacy charsets
+    """
+    rng = random.Random(seed)
+    words = "invoice order delivery please thanks regards shipment account password reset error " \
+            "Rechnung Lieferung bitte danke Grüße Bestellung Konto".split()
+    sentence = lambda n: " ".join(rng.choice(words) for _ in range(n))
+    messages = []
+    for i in range(count):
+        msg = EmailMessage()
+        msg['Subject'] = f"Re: {sentence(4)} #{i}"
+        msg['From'] = "customer@example.com"
+        kind = i % 5
+        text = "\n".join(sentence(12) for _ in range(rng.randint(3, 30)))
+        if kind == 0:
+            msg.set_content(text)
+        elif kind == 1:
+            msg.set_content(text)
+            rows = "".join(f"<tr><td style='padding:4px'><a href='https://example.com/{j}'>{sentence(8)}</a></td></tr>"
+                           for j in range(rng.randint(200, 2000)))
+            msg.add_alternative(f"<html><head><style>td {{color: red}}</style></head><body><table>{rows}</table>"
+                                f"<script>track()</script></body></html>", subtype='html')
+        elif kind == 2:
+            msg.set_content(f"<html><body><p>{text.replace(chr(10), '</p><p>')}</p></body></html>", subtype='html')
+        elif kind == 3:
+            msg.set_content(text)
+            msg.add_attachment(rng.randbytes(rng.randint(200_000, 3_000_000)), maintype='application',
+                               subtype='pdf', filename="scan.pdf")
+        else:
+            msg.set_content(text, charset='iso-8859-1', cte='quoted-printable')
+        messages.append((f"synthetic-{i}.eml", msg.as_bytes()))
+    return messages
+
+def timed(parse, messages):
+    results, failures = [], 0
+    started = time.perf_counter()
+    for _, data in messages:
+        try:
+            results.append(parse(data))
+        except Exception:
+            results.append(None)
+            failures += 1
+    return time.perf_counter() - started, results, failures
+
+def timed_pool(messages, processes):
+    pool = ParsePool(processes)
+    pool.start()
+    started = time.perf_counter()
+    failures = sum(1 for _, _, error in pool.parse_many(messages) if error is not None)
+    return time.perf_counter() - started, failures
+
+def report(name, elapsed, count, size, failures):
+    print(f"{name:>8}: {elapsed:7.2f} s, {1000 * elapsed / count:7.2f} ms/message, "
+          f"{size / 2**20 / elapsed:7.1f} MB/s, {failures} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare email_parser with the previous BeautifulSoup parser and with the parse pool")
+    parser.add_argument("sources", nargs="*", help=".eml files, mbox files, zip archives or Maildir folders")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate this many messages instead")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 4, help="Worker processes for the pool run")
+    args = parser.parse_args()
+
+    messages = list(iter_messages(args.sources)) if args.sources else synthetic_corpus(args.synthetic or 500)
+    if not messages:
+        sys.exit("No messages found")
+    size = sum(len(data) for _, data in messages)
+    print(f"{len(messages)} messages, {size / 2**20:.1f} MB")
+
+    new_time, new_results, new_failures = timed(parse_email, messages)
+    pool_time, pool_failures = timed_pool(messages, args.processes)
+    report("new", new_time, len(messages), size, new_failures)
+    report("pool", pool_time, len(messages), size, pool_failures)
+    print(f" {args.processes} processes: {new_time / pool_time:.1f}x the single-process parse")
+    try:
+        import bs4, lxml  # noqa: F401
+    except ImportError:
+        sys.exit("beautifulsoup4 and lxml are needed for the legacy parser: pip install -r requirements-benchmark.txt")
+    legacy_time, legacy_results, legacy_failures = timed(legacy_parse, messages)
+
+    report("legacy", legacy_time, len(messages), size, legacy_failures)
+    print(f" speedup: {legacy_time / new_time:.1f}x")
+
+    compared = [(old[1], new[1]) for old, new in zip(legacy_results, new_results) if old and new]
+    same = sum(1 for old, new in compared if old == new)
+    old_chars = sum(len(old) for old, _ in compared)
+    new_chars = sum(len(new) for _, new in compared)
+    print(f"Bodies identical for {same}/{len(compared)} messages parsed by both; "
+          f"{old_chars} -> {new_chars} characters ({1 - new_chars / max(old_chars, 1):.0%} less, "
+          f"mostly HTML duplicates of the plain text)")
+
+if __name__ == "__main__":
+    main()
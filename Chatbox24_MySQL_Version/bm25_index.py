@@ -0,0 +1,176 @@
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from vector_store import content_hash
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+MAX_QUERY_TERMS = 32  # Rarest terms kept from long queries such as whole email bodies
+
+def tokenize(text):
+    """Lowercased word tokens; compound tokens such as part numbers
+    ("AB-1234/5") are kept whole and also split into their parts.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part)
+    return tokens
+
+def bm25_path(store_prefix):
+    return f"{store_prefix}.bm25.sqlite3"
+
+class BM25Index:
+    """Persistent BM25 inverted index over knowledge base rows.
+
+    Postings live in SQLite (WAL mode), so the process inserting rows and
+    the processes searching them can share one index file.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                length INTEGER NOT NULL,
+                hash INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            -- One row, kept in step with docs by add() and _delete(), so a search does not scan docs
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                doc_count INTEGER NOT NULL,
+                total_length INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (id, doc_count, total_length)
+                SELECT 0, COUNT(*), COALESCE(SUM(length), 0) FROM docs;
+        """)
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, rows):
+        """Index (id, content) rows, replacing any earlier version of the same id"""
+        rows = list(rows)
+        if not rows:
+            return
+        conn = self._connection()
+        with conn:
+            self._delete(conn, [row_id for row_id, _ in rows])
+            df = Counter()
+            total_length = 0
+            for row_id, content in rows:
+                counts = Counter(tokenize(content))
+                length = sum(counts.values())
+                conn.execute("INSERT INTO docs (id, length, hash) VALUES (?, ?, ?)",
+                             (row_id, length, self._signed(content_hash(content))))
+                conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                                 [(term, row_id, tf) for term, tf in counts.items()])
+                df.update(counts.keys())
+                total_length += length
+            conn.execute("UPDATE stats SET doc_count = doc_count + ?, total_length = total_length + ?",
+                         (len(rows), total_length))
+            conn.executemany("""
+                INSERT INTO terms (term, df) VALUES (?, ?)
+                ON CONFLICT(term) DO UPDATE SET df = df + excluded.df
+            """, df.items())
+
+    def delete(self, ids):
+        """Remove rows from the index"""
+        conn = self._connection()
+        with conn:
+            self._delete(conn, list(ids))
+
+    def _delete(self, conn, ids):
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            removed = conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE doc_id IN ({placeholders}) GROUP BY term", chunk).fetchall()
+            conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?", [(count, term) for term, count in removed])
+            conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", chunk)
+            count, length = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE id IN ({placeholders})", chunk).fetchone()
+            conn.execute("UPDATE stats SET doc_count = doc_count - ?, total_length = total_length - ?", (count, length))
+            conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", chunk)
+        conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def sync(self, rows):
+        """Bring the index in line with the full list of (id, content) rows"""
+        conn = self._connection()
+        indexed = dict(conn.execute("SELECT id, hash FROM docs"))
+        wanted = {row_id for row_id, _ in rows}
+        stale = [(row_id, content) for row_id, content in rows
+                 if indexed.get(row_id) != self._signed(content_hash(content))]
+        deleted = [row_id for row_id in indexed if row_id not in wanted]
+        if deleted:
+            self.delete(deleted)
+        for start in range(0, len(stale), 1000):
+            self.add(stale[start:start + 1000])
+        if stale or deleted:
+            print(f"BM25 index {self.path}: {len(stale)} rows indexed, {len(deleted)} removed")
+
+    def search(self, query, k=10):
+        """Return up to ``k`` (id, score) pairs, best first"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        conn = self._connection()
+        doc_count, total_length = conn.execute("SELECT doc_count, total_length FROM stats").fetchone()
+        if not doc_count:
+            return []
+        avg_length = total_length / doc_count
+
+        placeholders = ",".join("?" * len(terms))
+        frequencies = conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", list(terms)).fetchall()
+        # Long queries: only the rarest terms carry signal and they have the shortest postings
+        frequencies = sorted(frequencies, key=lambda item: item[1])[:MAX_QUERY_TERMS]
+        if not frequencies:
+            return []
+        idf = {term: math.log(1 + (doc_count - df + 0.5) / (df + 0.5)) for term, df in frequencies}
+
+        placeholders = ",".join("?" * len(idf))
+        scores = Counter()
+        for term, doc_id, tf, length in conn.execute(f"""
+                SELECT p.term, p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id
+                WHERE p.term IN ({placeholders})""", list(idf)):
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+            scores[doc_id] += idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(k)
+
+    @staticmethod
+    def _signed(value):
+        """SQLite integers are signed 64-bit"""
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists; returns (id, fused score) pairs, best first"""
+    fused = Counter()
+    for ranking in rankings:
+        for rank, row_id in enumerate(ranking):
+            fused[row_id] += 1.0 / (k + rank + 1)
+    return fused.most_common()
@@ -0,0 +1,192 @@
+import os
+import json
+import argparse
+import numpy as np
+import mysql.connector
+from db_config import DB_CONFIG
+from vector_store import VectorStore, content_hash, normalize_rows
+from embedding_cache import get_cache
+from embeddings import EMBEDDING_MODEL, embed_texts
+from ann_index import index_path, load_or_build_index
+from quantization import QUANTIZATION_KINDS, codes_path, load_or_build_codes
+from bm25_index import BM25Index, bm25_path
+
+VECTOR_STORE = "vault_vectors_db"  # Must match the store used by GUI_work / GUI_testing
+COMPACT_THRESHOLD = 0.95           # Cosine similarity above which two rows say the same thing
+MAX_BLOCK_BYTES = 256 * 2**20      # Similarity scores computed at a time
+
+def load_rows(db_config):
+    """All knowledge base rows as (id, content, source_type)"""
+    conn = mysql.connector.connect(**db_config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, content, source_type FROM knowledge_base ORDER BY id")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def cached_vectors(rows, store, model):
+    """Unit vectors for ``rows`` taken from the vector store, or from the embedding
+    cache for rows the store does not have yet; nothing is embedded. Returns
+    (positions of the rows with a vector, matrix).
+    """
+    stored = {}
+    opened = store.open()
+    if opened is not None and opened[0].get('model') == model:
+        _, ids, hashes, matrix = opened
+        stored = {int(row_id): (int(row_hash), pos) for pos, (row_id, row_hash) in enumerate(zip(ids, hashes))}
+
+    vectors = [None] * len(rows)
+    missing = []
+    for i, (row_id, content, _) in enumerate(rows):
+        row_hash, pos = stored.get(row_id, (None, None))
+        if row_hash == content_hash(content):
+            vectors[i] = matrix[pos]
+        else:
+            missing.append(i)
+    if missing:
+        for i, vector in zip(missing, get_cache().get_many(model, [rows[i][1].strip() for i in missing])):
+            vectors[i] = vector
+
+    positions = [i for i, vector in enumerate(vectors) if vector is not None]
+    if not positions:
+        return positions, np.empty((0, 0), dtype=np.float32)
+    return positions, normalize_rows(np.stack([vectors[i] for i in positions]))
+
+def near_duplicate_neighbors(matrix, threshold=COMPACT_THRESHOLD, max_block_bytes=MAX_BLOCK_BYTES):
+    """For each row, the later rows at or above ``threshold`` as {row: {other: score}}"""
+    neighbors = {}
+    count = len(matrix)
+    block = max(1, max_block_bytes // (4 * max(count, 1)))
+    for start in range(0, count, block):
+        scores = matrix[start:start + block] @ matrix.T
+        rows, cols = np.nonzero(scores >= threshold)
+        for row, col in zip(rows, cols):
+            if col > row + start:
+                score = float(scores[row, col])
+                neighbors.setdefault(row + start, {})[col] = score
+                neighbors.setdefault(col, {})[row + start] = score
+    return neighbors
+
+def propose_merges(rows, threshold=COMPACT_THRESHOLD, model=EMBEDDING_MODEL, store_prefix=VECTOR_STORE):
+    """Group near-identical rows; each group keeps its longest row and drops the rest.
+
+    Every dropped row is within ``threshold`` of the row it is merged into, so
+    chains of slightly different rows never collapse into one.
+    """
+    positions, matrix = cached_vectors(rows, VectorStore(store_prefix, normalize=True), model)
+    neighbors = near_duplicate_neighbors(matrix, threshold)
+
+    # Longest content first (it usually contains the others), then oldest
+    order = sorted(neighbors, key=lambda i: (-len(rows[positions[i]][1]), rows[positions[i]][0]))
+    merged = set()
+    proposals = []
+    for leader in order:
+        if leader in merged:
+            continue
+        members = [other for other in neighbors[leader] if other not in merged]
+        if not members:
+            continue
+        merged.add(leader)
+        merged.update(members)
+        keep = rows[positions[leader]]
+        proposals.append({
+            "keep": keep[0],
+            "keep_preview": keep[1][:120],
+            "remove": sorted(rows[positions[other]][0] for other in members),
+            "sources": sorted({rows[positions[other]][2] for other in members} | {keep[2]}),
+            "min_similarity": round(min(neighbors[leader][other] for other in members), 4),
+        })
+    return proposals, len(rows) - len(positions)
+
+def delete_rows(db_config, row_ids):
+    """Delete rows in one transaction"""
+    conn = mysql.connector.connect(**db_config)
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(row_ids), 500):
+            chunk = row_ids[start:start + 500]
+            cursor.execute(f"DELETE FROM knowledge_base WHERE id IN ({','.join(['%s'] * len(chunk))})", chunk)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def store_files(store_prefix):
+    store = VectorStore(store_prefix)
+    paths = [store.vec_file, store.ids_file, store.hashes_file, store.header_file, index_path(store),
+             bm25_path(store_prefix)] + [codes_path(store, kind) for kind in QUANTIZATION_KINDS]
+    return {path: os.path.getsize(path) for path in paths if os.path.exists(path)}
+
+def rebuild_indexes(rows, model=EMBEDDING_MODEL, store_prefix=VECTOR_STORE):
+    """Bring the store, IVF index, quantized codes and BM25 index in line with the
+    remaining rows. Deleted rows are dropped; vectors and centroids are reused.
+    """
+    opened = VectorStore(store_prefix).open()
+    dtype = opened[0]['dtype'] if opened is not None else 'float32'
+    store = VectorStore(store_prefix, dtype=dtype, normalize=True)
+    header, ids, hashes, matrix = store.sync(rows, lambda texts: embed_texts(texts, model=model), model=model)
+    if os.path.exists(index_path(store)):
+        load_or_build_index(store, ids, hashes, matrix)
+    for kind in QUANTIZATION_KINDS:
+        if os.path.exists(codes_path(store, kind)):
+            load_or_build_codes(store, ids, hashes, matrix, kind)
+    BM25Index(bm25_path(store_prefix)).sync(rows)
+    return header
+
+def print_proposals(proposals, limit):
+    for proposal in proposals[:limit]:
+        print(f"Keep {proposal['keep']} ({', '.join(proposal['sources'])}), remove {proposal['remove']} "
+              f"(similarity >= {proposal['min_similarity']}): {proposal['keep_preview']!r}")
+    if len(proposals) > limit:
+        print(f"... and {len(proposals) - limit} more groups")
+
+def format_bytes(size):
+    return f"{size / 2**20:.1f} MiB" if size >= 2**20 else f"{size / 2**10:.1f} KiB"
+
+def compact(apply=False, threshold=COMPACT_THRESHOLD, output=None, show=20, db_config=DB_CONFIG,
+            model=EMBEDDING_MODEL, store_prefix=VECTOR_STORE):
+    """Propose (or, with ``apply``, carry out) merges of near-duplicate rows"""
+    rows = load_rows(db_config)
+    proposals, unembedded = propose_merges(rows, threshold, model, store_prefix)
+    removed = sorted(row_id for proposal in proposals for row_id in proposal["remove"])
+
+    print(f"{len(rows)} rows, {len(proposals)} groups of near-duplicates (similarity >= {threshold}), "
+          f"{len(removed)} rows to remove")
+    if unembedded:
+        print(f"{unembedded} rows have no cached vector and were not compared; open the work GUI to embed them first")
+    print_proposals(proposals, show)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(proposals, f, ensure_ascii=False, indent=2)
+        print(f"Proposals written to {output}")
+    if not apply or not removed:
+        if removed:
+            print("Dry run; pass --apply to delete the rows")
+        return proposals
+
+    before = store_files(store_prefix)
+    delete_rows(db_config, removed)
+    removed_set = set(removed)
+    header = rebuild_indexes([(row_id, content) for row_id, content, _ in rows if row_id not in removed_set],
+                             model, store_prefix)
+    after = store_files(store_prefix)
+
+    print(f"Removed {len(removed)} of {len(rows)} rows ({len(removed) / len(rows):.1%})")
+    vector_bytes = len(removed) * header['dim'] * np.dtype(header['dtype']).itemsize
+    print(f"Vector matrix: {format_bytes(vector_bytes)} less to scan and keep in memory")
+    for path in sorted(before.keys() | after.keys()):
+        print(f"  {path}: {format_bytes(before.get(path, 0))} -> {format_bytes(after.get(path, 0))}")
+    print(f"Store and indexes on disk: {format_bytes(sum(before.values()))} -> {format_bytes(sum(after.values()))}")
+    return proposals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge near-duplicate knowledge base rows")
+    parser.add_argument("--apply", action="store_true", help="Delete the duplicate rows instead of only listing them")
+    parser.add_argument("--threshold", type=float, default=COMPACT_THRESHOLD)
+    parser.add_argument("--output", help="Write the proposed merges to this JSON file for review")
+    parser.add_argument("--show", type=int, default=20, help="Groups to print")
+    args = parser.parse_args()
+    compact(args.apply, args.threshold, args.output, args.show)
@@ -0,0 +1,43 @@
+import struct
+
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8600
+
+OP_SEARCH_TEXT = 1
+OP_SEARCH_TEXTS = 2
+OP_SEARCH_VECTOR = 3
+OP_STATS = 4
+OP_SEARCH_VECTORS = 5
+OP_ACQUIRE = 6       # LLM generation slot; held until the client closes the connection
+OP_SCHED_STATS = 7
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BUSY = 2
+
+# Wire format (little-endian). Request: header, then ``length`` payload bytes.
+#   header: op u8, vault u8, min_k u16, max_k u16, threshold f32, length u32
+#   text payload: utf-8 text; texts payload: count u32, then (len u32, utf-8)*;
+#   vector payload: float32 values; vectors payload: count u32, then count rows of float32 values
+# Response: status u8, length u32, then payload.
+#   ok payload: query count u32, then per query: hit count u32, then per hit
+#   id i64, score f32, content len u32, utf-8 content. stats payload: rows u64.
+#   error payload: utf-8 message
+# Acquire: the vault byte carries the priority class (its index in
+# llm_scheduler.PRIORITIES), the payload the model name; the answer (ok or
+# busy) comes once the slot is granted or refused.
+REQUEST_HEADER = struct.Struct("<BBHHfI")
+RESPONSE_HEADER = struct.Struct("<BI")
+HIT_HEADER = struct.Struct("<qfI")
+U32 = struct.Struct("<I")
+
+def recv_exact(sock, size):
+    """Exactly ``size`` bytes from ``sock``; raises ConnectionError if it closes first"""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
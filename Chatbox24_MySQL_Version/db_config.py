@@ -0,0 +1,13 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()  # Picks up a .env file in the working directory, if there is one
+
+# MySQL connection used by the GUI modules, the retrieval daemon and compact_kb.
+# Set DB_HOST, DB_USER, DB_PASSWORD and DB_NAME in the environment or in .env
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv('DB_PASSWORD', '1234'),
+    'database': os.getenv('DB_NAME', 'knowledge_db'),
+}
@@ -0,0 +1,134 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+import numpy as np
+
+INGESTED_INDEX_FILE = "ingested_index.sqlite3"
+SHINGLE_SIZE = 3        # Words per shingle
+NEAR_DUPLICATE_BITS = 7 # SimHash bits two bodies may differ in; one edited word in a short email moves 2-8 bits,
+                        # unrelated emails differ in 20 or more
+BANDS = 8               # 8-bit bands; with at most 7 differing bits, one band always matches exactly
+BAND_BITS = 64 // BANDS
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+def simhash(text):
+    """64-bit SimHash over word shingles: similar texts get hashes differing in few bits"""
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = Counter(" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1)))
+    hashes = np.frombuffer(b"".join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+                                    for shingle in shingles), dtype=np.uint8)
+    bits = np.unpackbits(hashes).reshape(len(shingles), 64).astype(np.int64)
+    weights = np.fromiter(shingles.values(), dtype=np.int64, count=len(shingles))
+    votes = weights @ (2 * bits - 1)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), 'big')
+
+def fingerprint(text):
+    """(exact hash, SimHash) of a body after whitespace and case normalization"""
+    text = normalize_text(text)
+    return hashlib.sha256(text.encode('utf-8')).digest(), simhash(text)
+
+def _bands(value):
+    return [(value >> (BAND_BITS * band)) & ((1 << BAND_BITS) - 1) for band in range(BANDS)]
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+class IngestedIndex:
+    """Fingerprints of every email already turned into knowledge base rows.
+
+    ``claim`` checks a body against the index and the emails still in flight,
+    and reserves it if it is new; ``commit`` persists claims once their rows
+    are written, ``release`` drops claims whose processing failed.
+    """
+
+    def __init__(self, path=INGESTED_INDEX_FILE, max_distance=NEAR_DUPLICATE_BITS):
+        self.path = path
+        self.max_distance = max_distance
+        self.pending = {}  # exact hash -> (simhash, source) of claimed, unwritten emails
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        band_columns = [f"band{band}" for band in range(BANDS)]
+        conn = self._connection()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS ingested (
+                exact BLOB PRIMARY KEY,
+                simhash INTEGER NOT NULL,
+                {", ".join(f"{column} INTEGER NOT NULL" for column in band_columns)},
+                source TEXT,
+                ingested_at REAL NOT NULL
+            )
+        """)
+        for column in band_columns:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ingested_{column} ON ingested ({column})")
+        conn.commit()
+        self._band_query = ("SELECT simhash, source FROM ingested WHERE "
+                            + " OR ".join(f"{column} = ?" for column in band_columns))
+        self._insert = f"INSERT OR IGNORE INTO ingested VALUES ({', '.join('?' * (BANDS + 4))})"
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        (count,) = self._connection().execute("SELECT COUNT(*) FROM ingested").fetchone()
+        return count
+
+    def _near(self, a, b):
+        return bin(a ^ b).count("1") <= self.max_distance
+
+    def find(self, fp):
+        """Return ('exact' | 'near', source) of an earlier matching email, or None"""
+        exact, hashed = fp
+        if exact in self.pending:
+            return "exact", self.pending[exact][1]
+        for other, source in self.pending.values():
+            if self._near(hashed, other):
+                return "near", source
+
+        conn = self._connection()
+        row = conn.execute("SELECT source FROM ingested WHERE exact = ?", (exact,)).fetchone()
+        if row:
+            return "exact", row[0]
+        bands = _bands(hashed)
+        for other, source in conn.execute(self._band_query, bands):
+            if self._near(hashed, other & 0xFFFFFFFFFFFFFFFF):
+                return "near", source
+        return None
+
+    def claim(self, fp, source):
+        """Reserve a new email; returns the earlier match instead if it is a duplicate"""
+        with self._lock:
+            match = self.find(fp)
+            if match is None:
+                self.pending[fp[0]] = (fp[1], source)
+            return match
+
+    def release(self, fp):
+        with self._lock:
+            self.pending.pop(fp[0], None)
+
+    def commit(self, fps):
+        """Persist claimed emails whose rows have been written"""
+        now = time.time()
+        with self._lock:
+            rows = [(exact, _signed(hashed), *_bands(hashed), self.pending.get(exact, (None, None))[1], now)
+                    for exact, hashed in fps]
+            conn = self._connection()
+            conn.executemany(self._insert, rows)
+            conn.commit()
+            for exact, _ in fps:
+                self.pending.pop(exact, None)
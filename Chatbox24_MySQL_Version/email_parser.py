@@ -0,0 +1,208 @@
+import re
+import html
+import codecs
+import base64
+import binascii
+from email import policy
+from email.parser import BytesParser
+from email.header import decode_header, make_header
+from prompt_builder import count_tokens
+from reply_extractor import extract_reply
+
+MAX_MESSAGE_BYTES = 16 * 2**20  # Read of a message; text parts come first, attachments after them are cut off
+MAX_PART_BYTES = 512 * 2**10   # Decoded bytes kept per text part
+MAX_TEXT_CHARS = 100_000       # Characters of body text returned
+
+# Labels that are commonly used for text in a wider encoding
+CHARSET_SUPERSETS = {
+    'us-ascii': 'utf-8', 'ascii': 'utf-8',
+    'iso-8859-1': 'cp1252', 'latin1': 'cp1252', 'latin-1': 'cp1252',
+    'gb2312': 'gb18030', 'gbk': 'gb18030',
+    'ks_c_5601-1987': 'cp949', 'euc-kr': 'cp949',
+    'shift_jis': 'cp932', 'x-sjis': 'cp932',
+}
+
+HTML_SKIP = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+HTML_BREAK = re.compile(r"<(?:br|/?p|/?div|/?tr|/?li|/?h[1-6]|/?table|/?blockquote|hr)\b[^>]*>", re.IGNORECASE)
+HTML_TAG = re.compile(r"<[^>]*>")
+WHITESPACE = re.compile(r"\s+")
+HEADER_END = re.compile(rb"\r?\n\r?\n")
+LINE_END = re.compile(rb"[ \t]*\r?\n")
+MAX_NESTING = 8
+
+_parser = BytesParser(policy=policy.compat32)  # The default policy's header objects cost more than the whole body
+
+def html_to_text(markup):
+    """Visible text of an HTML part: script, style and comments dropped, block tags as line breaks"""
+    markup = HTML_SKIP.sub(" ", markup)
+    markup = HTML_BREAK.sub("\n", markup)
+    return html.unescape(HTML_TAG.sub("", markup))
+
+def decode_text(data, charset):
+    """Decode with the declared charset (or its common superset), then UTF-8, then cp1252 with replacement"""
+    for candidate in (CHARSET_SUPERSETS.get(charset, charset), 'utf-8'):
+        if not candidate:
+            continue
+        try:
+            codecs.lookup(candidate)
+            return data.decode(candidate)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return data.decode('cp1252', errors='replace')
+
+def _is_attachment(headers):
+    return str(headers.get('Content-Disposition', '')).split(';')[0].strip().lower() == 'attachment'
+
+def drop_binary_bodies(data, depth=0):
+    """Empty the bodies of attachments, non-text parts and HTML alternatives of a
+    plain text part with a byte-level split on the MIME boundaries, so the full
+    parse never walks their lines
+    """
+    match = HEADER_END.search(data)
+    if match is None or depth > MAX_NESTING:
+        return data
+    headers = _parser.parsebytes(data[:match.end()], headersonly=True)
+    boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+    if not boundary:
+        return data
+    delimiter = b"--" + boundary.encode('ascii', 'ignore')
+    preamble, *pieces = data[match.end():].split(delimiter)
+    parts = [None if piece.startswith(b"--") else _split_part(piece) for piece in pieces]
+    has_plain = headers.get_content_subtype() == 'alternative' and any(
+        part is not None and part[2].get_content_type() == 'text/plain' for part in parts)
+
+    kept = []
+    for piece, part in zip(pieces, parts):
+        if part is None:
+            kept.append(piece)
+            continue
+        start, end, part_headers = part
+        content_type = part_headers.get_content_type()
+        if part_headers.get_content_maintype() == 'multipart':
+            kept.append(piece[:start] + drop_binary_bodies(piece[start:], depth + 1))
+        elif content_type.startswith('message/'):
+            kept.append(piece)  # Forwarded emails are often the actual question
+        elif (content_type.startswith('text/') and not _is_attachment(part_headers)
+              and not (has_plain and content_type == 'text/html')):
+            kept.append(piece)
+        else:
+            kept.append(piece[:end] + (b"\r\n" if piece.endswith(b"\r\n") else b"\n"))
+    return data[:match.end()] + preamble + delimiter + delimiter.join(kept)
+
+def _split_part(piece):
+    """(header start, body start, headers) of a part between two boundaries, or None
+    when it has no headers and is plain text by default
+    """
+    line_end = LINE_END.match(piece)  # Rest of the boundary line
+    if line_end is None or piece.startswith((b"\r\n", b"\n"), line_end.end()):
+        return None
+    match = HEADER_END.search(piece, line_end.end())
+    if match is None:
+        return None
+    return line_end.end(), match.end(), _parser.parsebytes(piece[line_end.end():match.end()], headersonly=True)
+
+def decode_payload(part, limit=MAX_PART_BYTES):
+    """Transfer-decoded bytes of a part, at most ``limit``; base64 beyond the limit is never decoded"""
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return b""
+    encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+    if encoding != 'base64':
+        return (part.get_payload(decode=True) or b"")[:limit]  # Restores 8-bit bytes the parser kept escaped
+    encoded = "".join(payload[:limit * 4 // 3 + limit // 32 + 4].split())  # Line breaks are not counted
+    try:
+        return base64.b64decode(encoded[:len(encoded) // 4 * 4])[:limit]
+    except (binascii.Error, ValueError):
+        return b""
+
+def decode_header_value(value):
+    """Header text with RFC 2047 encoded words decoded and whitespace collapsed; "" when missing"""
+    if value is None:
+        return ""
+    try:
+        text = str(make_header(decode_header(value)))
+    except (LookupError, UnicodeDecodeError, ValueError, binascii.Error):
+        text = str(value)
+    return WHITESPACE.sub(" ", text).strip()
+
+def decode_subject(value):
+    return decode_header_value(value) or "No Subject"
+
+def _has_plain(part):
+    """Whether ``part`` holds an inline text/plain part outside forwarded messages"""
+    if part.get_content_type().startswith('message/'):
+        return False
+    if part.is_multipart():
+        return any(_has_plain(child) for child in part.get_payload())
+    return part.get_content_type() == 'text/plain' and not _is_attachment(part)
+
+def text_parts(msg, depth=0):
+    """(content type, part) of the inline text parts in reading order. Of the
+    versions in a multipart/alternative, those with plain text are used, the
+    HTML ones only when there is none; attachments and non-text parts are
+    skipped without decoding them
+    """
+    if msg.is_multipart():
+        if depth > MAX_NESTING:
+            return
+        children = msg.get_payload()
+        if msg.get_content_type() == 'multipart/alternative':
+            children = [child for child in children if _has_plain(child)] or children
+        for child in children:
+            yield from text_parts(child, depth + 1)
+        return
+    content_type = msg.get_content_type()
+    if content_type in ('text/plain', 'text/html') and not _is_attachment(msg):
+        yield content_type, msg
+
+def parse_record(data, thread_messages=None, max_bytes=MAX_MESSAGE_BYTES, max_part_bytes=MAX_PART_BYTES,
+                 max_chars=MAX_TEXT_CHARS):
+    """(subject, body, metadata) of a raw email. Every inline text part is used,
+    HTML converted to text; where a multipart/alternative has a plain text
+    version its HTML version is left out. Whitespace is collapsed. metadata
+    holds the sender, date, Message-ID, In-Reply-To, the message size, how many
+    text parts the body came from and whether any of them was HTML.
+
+    With ``thread_messages`` only the newest that many messages of the thread
+    are kept (see reply_extractor.extract_reply), without quoted history,
+    signatures and disclaimers; metadata then also records the characters and
+    estimated tokens this removed.
+    """
+    msg = _parser.parsebytes(drop_binary_bodies(data[:max_bytes]))
+    texts, length, from_html = [], 0, False
+    for content_type, part in text_parts(msg):
+        text = decode_text(decode_payload(part, max_part_bytes), part.get_content_charset())
+        if content_type == 'text/html':
+            text = html_to_text(text)
+            from_html = True
+        texts.append(text)
+        length += len(text)
+        if length >= max_chars:
+            break
+
+    text = "\n".join(texts)
+    body = WHITESPACE.sub(" ", text).strip()[:max_chars]
+    saved = {}
+    if thread_messages:
+        full_body, body = body, WHITESPACE.sub(" ", extract_reply(text, thread_messages)).strip()[:max_chars]
+        saved = {"chars_saved": len(full_body) - len(body), "tokens_saved": count_tokens(full_body) - count_tokens(body)}
+    metadata = {
+        "from": decode_header_value(msg['from']),
+        "date": decode_header_value(msg['date']),
+        "message_id": decode_header_value(msg['message-id']),
+        "in_reply_to": decode_header_value(msg['in-reply-to']),
+        "bytes": len(data),
+        "text_parts": len(texts),
+        "html": from_html,
+        **saved,
+    }
+    return decode_subject(msg['subject']), body, metadata
+
+def parse_email(data, thread_messages=None, max_bytes=MAX_MESSAGE_BYTES, max_part_bytes=MAX_PART_BYTES,
+                max_chars=MAX_TEXT_CHARS):
+    """(subject, body) of a raw email; see parse_record"""
+    return parse_record(data, thread_messages, max_bytes, max_part_bytes, max_chars)[:2]
+
+def parse_eml_file(file, thread_messages=None):
+    """(subject, body) of an email read from a binary file object"""
+    return parse_email(file.read(MAX_MESSAGE_BYTES), thread_messages)
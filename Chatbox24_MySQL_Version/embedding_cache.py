@@ -0,0 +1,107 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+CACHE_FILE = "embedding_cache.sqlite3"
+
+def text_key(model, text):
+    """Content address of an embedding: the model name plus a hash of the text"""
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).digest()
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model, text hash) with LRU eviction.
+
+    Backed by SQLite in WAL mode so the GUI and web processes can read and
+    write the same file concurrently. Each thread gets its own connection.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=200_000, evict_every=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model, texts):
+        """Return cached vectors aligned with ``texts`` (None where missing)"""
+        keys = [text_key(model, text) for text in texts]
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for key, vector in conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk):
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+
+        if found:
+            try:
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                 [(time.time(), key) for key in found])
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()  # Another process holds the write lock; recency is best effort
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model, texts, vectors):
+        """Store vectors for ``texts``; None entries are skipped"""
+        now = time.time()
+        rows = [(text_key(model, text), model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors) if vector is not None]
+        if not rows:
+            return
+        conn = self._connection()
+        conn.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+
+        with self._lock:
+            self._puts_since_evict += len(rows)
+            if self._puts_since_evict < self.evict_every:
+                return
+            self._puts_since_evict = 0
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries beyond ``max_entries``"""
+        conn = self._connection()
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            conn.execute("""
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+                )
+            """, (count - self.max_entries,))
+            conn.commit()
+
+_shared_cache = None
+
+def get_cache():
+    """Process-wide cache instance, opened on first use"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = EmbeddingCache()
+    return _shared_cache
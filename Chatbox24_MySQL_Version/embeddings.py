@@ -0,0 +1,106 @@
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from embedding_cache import get_cache
+from llm_client import embed, embed_async
+
+EMBEDDING_MODEL = "mxbai-embed-large"
+
+def _embed_batch(texts, model, retries):
+    """Embed one batch with Ollama's list input, retrying with backoff"""
+    for attempt in range(retries + 1):
+        try:
+            return embed(texts, model=model, retries=0)  # Retried here, with bisection on failure
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"Embedding batch of {len(texts)} failed (attempt {attempt + 1}): {e}")
+            time.sleep(min(2 ** attempt, 30))
+
+def _embed_batch_isolated(texts, model, retries):
+    """Embed a batch; if it keeps failing, bisect it so one bad text only loses itself"""
+    try:
+        return _embed_batch(texts, model, retries)
+    except Exception as e:
+        if len(texts) == 1:
+            print(f"Failed to generate embedding for content: {texts[0][:200]}\nError: {e}")
+            return [None]
+    mid = len(texts) // 2
+    return _embed_batch_isolated(texts[:mid], model, 1) + _embed_batch_isolated(texts[mid:], model, 1)
+
+def embed_texts(texts, model=EMBEDDING_MODEL, batch_size=64, max_workers=4, retries=3, progress_every=5.0):
+    """Embed many texts, serving repeats from the shared on-disk cache.
+
+    Returns float32 vectors aligned with ``texts``; rows that failed every
+    retry are None so the caller can skip them without misaligning ids and
+    vectors. Each distinct text reaches the model at most once.
+    """
+    cache = get_cache()
+    results = cache.get_many(model, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+    if not missing:
+        return results
+
+    fresh = _embed_uncached(missing, model, batch_size, max_workers, retries, progress_every)
+    fresh = [None if vector is None else np.asarray(vector, dtype=np.float32) for vector in fresh]
+    cache.put_many(model, missing, fresh)
+
+    embedded = dict(zip(missing, fresh))
+    return [vector if vector is not None else embedded[text] for text, vector in zip(texts, results)]
+
+async def embed_texts_async(texts, model=EMBEDDING_MODEL):
+    """Async counterpart of embed_texts for the web services; raises if the model fails"""
+    cache = get_cache()
+    results = cache.get_many(model, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+    if not missing:
+        return results
+
+    fresh = [np.asarray(vector, dtype=np.float32) for vector in await embed_async(missing, model)]
+    cache.put_many(model, missing, fresh)
+
+    embedded = dict(zip(missing, fresh))
+    return [vector if vector is not None else embedded[text] for text, vector in zip(texts, results)]
+
+def embed_text(text, model=EMBEDDING_MODEL):
+    """Embed a single query text through the shared cache"""
+    vector = embed_texts([text], model=model, retries=1, progress_every=None)[0]
+    if vector is None:
+        raise RuntimeError(f"Failed to generate embedding with {model}")
+    return vector
+
+def _embed_uncached(texts, model, batch_size, max_workers, retries, progress_every):
+    """Embed texts with batched requests and a bounded number in flight"""
+    results = [None] * len(texts)
+
+    batches = [(start, texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+    done_rows, started, last_report = 0, time.monotonic(), time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            # Keep at most two batches per worker queued so memory stays bounded
+            while next_batch < len(batches) and len(pending) < max_workers * 2:
+                start, batch = batches[next_batch]
+                pending[pool.submit(_embed_batch_isolated, batch, model, retries)] = (start, len(batch))
+                next_batch += 1
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                start, size = pending.pop(future)
+                results[start:start + size] = future.result()
+                done_rows += size
+
+            now = time.monotonic()
+            if progress_every is None:
+                continue
+            if now - last_report >= progress_every or done_rows == len(texts):
+                rate = done_rows / max(now - started, 1e-9)
+                print(f"Embedded {done_rows}/{len(texts)} rows ({rate:.1f} rows/s)")
+                last_report = now
+
+    failed = sum(1 for vector in results if vector is None)
+    if failed:
+        print(f"{failed} of {len(texts)} rows could not be embedded")
+    return results
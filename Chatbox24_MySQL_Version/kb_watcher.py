@@ -0,0 +1,180 @@
+import os
+import threading
+import mysql.connector
+
+POLL_INTERVAL = 2.0  # Seconds between change checks
+CHECK_BYTES = 64     # Bytes before the read offset compared to tell appends from rewrites
+
+class FileTail:
+    """Knowledge base file source: one row per non-empty line, keyed by line number.
+
+    Tracks the byte offset of the last complete line read, so a poll reads
+    only what was appended since. A shrunk or rewritten file is reported as
+    a reset and re-read in full.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = []
+        self.offset = 0
+        self.line_no = 0
+        self.check = b""
+        self.inode = None
+
+    def load(self):
+        """Read the whole file; returns the rows"""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"{self.path} does not exist.")
+        self.rows, self.offset, self.line_no, self.check = [], 0, 0, b""
+        self.inode = os.stat(self.path).st_ino
+        self._read_tail()
+        return self.rows
+
+    def poll(self):
+        """Returns (appended rows, reloaded); ([], False) when nothing changed"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return [], False
+        if stat.st_ino != self.inode or stat.st_size < self.offset or not self._prefix_unchanged():
+            self.load()
+            return [], True
+        if stat.st_size == self.offset:
+            return [], False
+        known = len(self.rows)
+        self._read_tail()
+        return self.rows[known:], False
+
+    def _prefix_unchanged(self):
+        start = self.offset - len(self.check)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(len(self.check)) == self.check
+
+    def _read_tail(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # A line still being written is read on the next poll
+        if not end:
+            return
+        # Same line splitting as reading the file in text mode
+        text = data[:end].decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+        for line in text.splitlines(keepends=True):
+            if line.strip():
+                self.rows.append((self.line_no, line))
+            self.line_no += 1
+        self.offset += end
+        start = max(0, self.offset - CHECK_BYTES)
+        self.check = (self.check + data[:end])[-(self.offset - start):]
+
+class TableHighWaterMark:
+    """knowledge_base table source. Rows with an id above the highest id seen
+    are appended; a row count that no longer matches means rows were deleted
+    and the table is re-read in full.
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.rows = []
+        self.high_water = 0
+
+    def _query(self, sql, params=()):
+        conn = mysql.connector.connect(**self.db_config)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def load(self):
+        """Read the whole table; returns the rows"""
+        self.rows = self._query("SELECT id, content FROM knowledge_base ORDER BY id")
+        self.high_water = self.rows[-1][0] if self.rows else 0
+        return self.rows
+
+    def poll(self):
+        """Same contract as FileTail.poll"""
+        (count, high_water), = self._query("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM knowledge_base")
+        if high_water == self.high_water and count == len(self.rows):
+            return [], False
+        appended = self._query("SELECT id, content FROM knowledge_base WHERE id > %s ORDER BY id", (self.high_water,))
+        if len(self.rows) + len(appended) != count:
+            self.load()
+            return [], True
+        self.rows = self.rows + appended
+        if appended:
+            self.high_water = appended[-1][0]
+        return appended, False
+
+class LiveRetriever:
+    """Retriever that follows a growing knowledge base (read-copy-update).
+
+    A background thread polls ``source``; on a change ``build`` (rows ->
+    Retriever) produces a new snapshot, embedding only rows the vector store
+    does not hold yet, and the ``current`` reference is swapped in one
+    assignment. Each search reads ``current`` once, so in-flight requests
+    finish on the snapshot they started with and are never blocked.
+
+    Appended rows go to ``extend`` ((snapshot, rows) -> Retriever or None)
+    when given, which copies the snapshot with just those rows added; it
+    falls back to ``build`` when it returns None or leaves rows out.
+    """
+
+    def __init__(self, source, build, interval=POLL_INTERVAL, extend=None):
+        self.source = source
+        self.build = build
+        self.extend = extend
+        self.current = build(source.load())
+        self._stale = False  # Set while source rows are ahead of ``current``
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Knowledge base reload failed: {e!r}")
+
+    def refresh(self):
+        """Pick up changes now; returns True if a new snapshot was swapped in"""
+        appended, reloaded = self.source.poll()
+        if not appended and not reloaded and not self._stale:
+            return False
+        snapshot = None
+        if appended and not reloaded and not self._stale and self.extend is not None:
+            self._stale = True  # A failed build is retried on the next poll
+            snapshot = self.extend(self.current, appended)
+            if snapshot is not None and len(snapshot) < len(self.current) + len(appended):
+                snapshot = None  # Rows that failed to embed are retried by the full build
+        if snapshot is None:
+            self._stale = True
+            snapshot = self.build(self.source.rows)
+        self.current = snapshot
+        self._stale = False
+        if reloaded:
+            print(f"Knowledge base reloaded: {len(snapshot)} rows")
+        else:
+            print(f"Knowledge base: {len(appended)} appended rows live, {len(snapshot)} rows")
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def __len__(self):
+        return len(self.current)
+
+    def search(self, query, min_k=1, max_k=5, threshold=0.8):
+        return self.current.search(query, min_k, max_k, threshold)
+
+    def search_batch(self, queries, min_k=1, max_k=5, threshold=0.8):
+        return self.current.search_batch(queries, min_k, max_k, threshold)
+
+    def search_text(self, text, min_k=1, max_k=5, threshold=0.8):
+        return self.current.search_text(text, min_k, max_k, threshold)
+
+    def search_texts(self, texts, min_k=1, max_k=5, threshold=0.8):
+        return self.current.search_texts(texts, min_k, max_k, threshold)
@@ -0,0 +1,86 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from langdetect import DetectorFactory, PROFILES_DIRECTORY, LangDetectException
+
+LANGUAGE_SAMPLE_CHARS = 1000   # Prefix of the body that is classified; more text does not change the answer
+LANGUAGE_SEED = 0              # langdetect samples n-grams at random; a fixed seed gives the same answer every time
+LANGUAGE_CACHE_SIZE = 4096     # Bodies remembered, so retries and resent emails skip detection
+PROMPT_LANGUAGES = {'de': "German"}  # Everything else is answered in English
+DEFAULT_PROMPT_LANGUAGE = "English"
+
+class LanguageIdentifier:
+    """Deterministic language identification with langdetect.
+
+    Only a bounded prefix of the text is classified, the profiles are loaded
+    once by ``load`` (call it at start-up, not on the first email), and results
+    are cached by a hash of the sample.
+    """
+
+    def __init__(self, sample_chars=LANGUAGE_SAMPLE_CHARS, cache_size=LANGUAGE_CACHE_SIZE, seed=LANGUAGE_SEED):
+        self.sample_chars = sample_chars
+        self.cache_size = cache_size
+        self.seed = seed
+        self._factory = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the language profiles (about 0.3 s); later calls return at once"""
+        with self._lock:
+            if self._factory is None:
+                factory = DetectorFactory()
+                factory.load_profile(PROFILES_DIRECTORY)
+                factory.set_seed(self.seed)
+                self._factory = factory
+        return self
+
+    def sample(self, text):
+        """The prefix that is classified, cut at a word boundary"""
+        text = " ".join(text[:2 * self.sample_chars].split())  # Whitespace runs do not count towards the sample
+        if len(text) <= self.sample_chars:
+            return text
+        cut = text.rfind(" ", 0, self.sample_chars)
+        return text[:cut if cut > self.sample_chars // 2 else self.sample_chars]
+
+    def identify(self, text):
+        """(language code, confidence) of ``text``, e.g. ("de", 0.99); (None, 0.0)
+        when it has no letters to go by
+        """
+        sample = self.sample(text)
+        key = hashlib.sha1(sample.encode('utf-8')).digest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        result = self._detect(sample)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _detect(self, sample):
+        detector = self.load()._factory.create()
+        detector.set_max_text_length(self.sample_chars)
+        detector.append(sample)
+        try:
+            best = detector.get_probabilities()[0]
+        except (LangDetectException, IndexError):
+            return None, 0.0
+        return best.lang, round(best.prob, 4)
+
+    def prompt_language(self, text):
+        """Language the response should be written in"""
+        language, _ = self.identify(text)
+        return PROMPT_LANGUAGES.get(language, DEFAULT_PROMPT_LANGUAGE)
+
+_shared_identifier = None
+
+def get_language_identifier():
+    """Process-wide identifier, created on first use; call ``.load()`` at start-up"""
+    global _shared_identifier
+    if _shared_identifier is None:
+        _shared_identifier = LanguageIdentifier()
+    return _shared_identifier
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import threading
+import httpx
+import ollama
+from llm_scheduler import llm_slot, llm_slot_async
+
+OLLAMA_HOST = "http://localhost:11434"
+CHAT_MODEL = "llama3"
+EMBED_MODEL = "mxbai-embed-large"
+
+KEEP_ALIVE = "30m"     # How long Ollama keeps a model loaded after the last call
+CHAT_TIMEOUT = 300.0   # Seconds; for streams this bounds the wait for each chunk
+EMBED_TIMEOUT = 60.0
+LLM_RETRIES = 2        # Extra attempts after a connection error, timeout or server error
+POOL_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client(kind, timeout):
+    """Shared pooled client per kind ('sync' or 'async') and timeout"""
+    key = (kind, timeout)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client_cls = ollama.Client if kind == 'sync' else ollama.AsyncClient
+                client = _clients[key] = client_cls(host=OLLAMA_HOST, timeout=timeout, limits=POOL_LIMITS)
+    return client
+
+def _retryable(error):
+    # Requests Ollama rejected (unknown model, bad input) fail the same way again
+    return not (isinstance(error, ollama.ResponseError) and 0 < error.status_code < 500)
+
+def _options(max_tokens):
+    return {'num_predict': max_tokens} if max_tokens else None
+
+def _retry(call, retries):
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == retries or not _retryable(e):
+                raise
+            print(f"LLM call failed (attempt {attempt + 1}): {e!r}")
+            time.sleep(min(2 ** attempt, 10))
+
+async def _retry_async(call, retries):
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not _retryable(e):
+                raise
+            print(f"LLM call failed (attempt {attempt + 1}): {e!r}")
+            await asyncio.sleep(min(2 ** attempt, 10))
+
+def chat(messages, model=CHAT_MODEL, max_tokens=None, timeout=CHAT_TIMEOUT, retries=LLM_RETRIES, priority='work'):
+    """Chat completion; returns the message content. Waits for a generation
+    slot of the given priority class ('work', 'training' or 'testing') and
+    raises SchedulerBusy when the model's queue is full.
+    """
+    with llm_slot(model, priority):
+        response = _retry(lambda: _client('sync', timeout).chat(
+            model=model, messages=messages, options=_options(max_tokens), keep_alive=KEEP_ALIVE), retries)
+    return response["message"]["content"]
+
+def chat_stream(messages, model=CHAT_MODEL, max_tokens=None, timeout=CHAT_TIMEOUT, retries=LLM_RETRIES,
+                priority='work'):
+    """Chat completion yielding text chunks as they arrive. Only the request up
+    to the first chunk is retried, so no chunk is ever yielded twice.
+    """
+    def start():
+        chunks = _client('sync', timeout).chat(model=model, messages=messages, options=_options(max_tokens),
+                                               keep_alive=KEEP_ALIVE, stream=True)
+        return chunks, next(chunks, None)
+
+    with llm_slot(model, priority):
+        chunks, first = _retry(start, retries)
+        if first is None:
+            return
+        yield first["message"]["content"]
+        for chunk in chunks:
+            yield chunk["message"]["content"]
+
+def embed(texts, model=EMBED_MODEL, timeout=EMBED_TIMEOUT, retries=LLM_RETRIES):
+    """Embed a list of texts; returns one vector per text"""
+    response = _retry(lambda: _client('sync', timeout).embed(model=model, input=texts, keep_alive=KEEP_ALIVE),
+                      retries)
+    embeddings = response["embeddings"]
+    if len(embeddings) != len(texts):
+        raise RuntimeError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+    return embeddings
+
+async def chat_async(messages, model=CHAT_MODEL, max_tokens=None, timeout=CHAT_TIMEOUT, retries=LLM_RETRIES,
+                     priority='work'):
+    """Chat completion without blocking the event loop; returns the message content"""
+    async with llm_slot_async(model, priority):
+        response = await _retry_async(lambda: _client('async', timeout).chat(
+            model=model, messages=messages, options=_options(max_tokens), keep_alive=KEEP_ALIVE), retries)
+    return response["message"]["content"]
+
+async def chat_stream_async(messages, model=CHAT_MODEL, max_tokens=None, timeout=CHAT_TIMEOUT, retries=LLM_RETRIES,
+                            priority='work'):
+    """Async counterpart of chat_stream"""
+    async def start():
+        chunks = await _client('async', timeout).chat(model=model, messages=messages, options=_options(max_tokens),
+                                                      keep_alive=KEEP_ALIVE, stream=True)
+        try:
+            return chunks, await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, None
+
+    async with llm_slot_async(model, priority):
+        chunks, first = await _retry_async(start, retries)
+        if first is None:
+            return
+        yield first["message"]["content"]
+        async for chunk in chunks:
+            yield chunk["message"]["content"]
+
+async def embed_async(texts, model=EMBED_MODEL, timeout=EMBED_TIMEOUT, retries=LLM_RETRIES):
+    """Embed a list of texts without blocking the event loop"""
+    response = await _retry_async(lambda: _client('async', timeout).embed(
+        model=model, input=texts, keep_alive=KEEP_ALIVE), retries)
+    embeddings = response["embeddings"]
+    if len(embeddings) != len(texts):
+        raise RuntimeError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+    return embeddings
+
+def warm_up(chat_models=(CHAT_MODEL,), embed_models=(EMBED_MODEL,)):
+    """Load the models into Ollama in the background, so the first real request
+    does not pay for the model load
+    """
+    def load():
+        client = _client('sync', CHAT_TIMEOUT)
+        for model in chat_models:
+            try:
+                client.generate(model=model, prompt="", keep_alive=KEEP_ALIVE)  # An empty prompt only loads the model
+            except Exception as e:
+                print(f"Warm-up of {model} failed: {e!r}")
+        for model in embed_models:
+            try:
+                client.embed(model=model, input=["warm-up"], keep_alive=KEEP_ALIVE)
+            except Exception as e:
+                print(f"Warm-up of {model} failed: {e!r}")
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
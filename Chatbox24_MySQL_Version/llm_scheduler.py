@@ -0,0 +1,227 @@
+import json
+import time
+import socket
+import asyncio
+import threading
+import contextlib
+from collections import deque
+from daemon_protocol import (DAEMON_HOST, DAEMON_PORT, OP_ACQUIRE, OP_SCHED_STATS, STATUS_OK, REQUEST_HEADER,
+                             RESPONSE_HEADER, recv_exact)
+
+PRIORITIES = ('work', 'training', 'testing')  # Index is the wire code; ties go to the earlier class
+PRIORITY_WEIGHTS = {'work': 4, 'training': 1, 'testing': 1}  # Share of freed slots while all classes wait
+MODEL_CONCURRENCY = {'llama3': 2}  # Generations Ollama runs at once per model
+DEFAULT_CONCURRENCY = 2
+QUEUE_LIMIT = 32  # Waiting requests per model and class before callers are told the model is busy
+
+class SchedulerBusy(Exception):
+    """Raised instead of queueing when a model's queue is full"""
+
+class _ModelState:
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.passes = {priority: 0.0 for priority in PRIORITIES}  # Stride scheduling virtual time
+        self.clock = 0.0
+        self.granted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class LLMScheduler:
+    """Per-model concurrency limit with weighted fair queuing between priority classes.
+
+    A freed slot goes to the waiting class with the lowest virtual time, which
+    then advances by 1 / weight: with weights 4:1:1, interactive work gets four
+    slots for each bulk one while all wait, and no class starves.
+    """
+
+    def __init__(self, limits=MODEL_CONCURRENCY, default_limit=DEFAULT_CONCURRENCY, queue_limit=QUEUE_LIMIT,
+                 weights=PRIORITY_WEIGHTS):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.queue_limit = queue_limit
+        self.weights = weights
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model):
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(self.limits.get(model, self.default_limit))
+        return state
+
+    def _enqueue(self, state, model, priority, grant):
+        """Take a free slot (True) or queue ``grant`` to be called when one is
+        handed over (False); called with the lock held
+        """
+        queue = state.queues[priority]
+        if state.running < state.limit and not any(state.queues.values()):
+            state.running += 1
+            self._record_wait(state, 0.0)
+            return True
+        if len(queue) >= self.queue_limit:
+            state.rejected += 1
+            raise SchedulerBusy(f"{model} is busy: {len(queue)} {priority} requests waiting")
+        if not queue:
+            # A class that was idle rejoins at the current virtual time instead of with banked credit
+            state.passes[priority] = max(state.passes[priority], state.clock)
+        queue.append(grant)
+        return False
+
+    def acquire(self, model, priority='work'):
+        """Block until a slot for ``model`` is free; raises SchedulerBusy if the queue is full"""
+        started = time.monotonic()
+        waiter = threading.Event()
+        with self._lock:
+            state = self._state(model)
+            if self._enqueue(state, model, priority, waiter.set):
+                return
+        waiter.wait()
+        with self._lock:
+            self._record_wait(state, time.monotonic() - started)
+
+    async def acquire_async(self, model, priority='work'):
+        """acquire for coroutines: waits on a future instead of a thread. If the
+        caller is cancelled while waiting, its place in the queue, or the slot
+        handed to it in the meantime, is given back.
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def granted():
+            if future.cancelled():
+                self.release(model)
+            else:
+                future.set_result(None)
+
+        def grant():
+            loop.call_soon_threadsafe(granted)
+
+        with self._lock:
+            state = self._state(model)
+            if self._enqueue(state, model, priority, grant):
+                return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    state.queues[priority].remove(grant)
+                    queued = True
+                except ValueError:
+                    queued = False
+            if not queued and future.done() and not future.cancelled():
+                self.release(model)  # Granted just as the caller was cancelled
+            raise
+        with self._lock:
+            self._record_wait(state, time.monotonic() - started)
+
+    def release(self, model):
+        with self._lock:
+            state = self._state(model)
+            state.running -= 1
+            while state.running < state.limit:
+                waiting = [priority for priority in PRIORITIES if state.queues[priority]]
+                if not waiting:
+                    break
+                priority = min(waiting, key=lambda p: state.passes[p])
+                state.clock = state.passes[priority]
+                state.passes[priority] += 1.0 / self.weights[priority]
+                state.running += 1
+                state.queues[priority].popleft()()
+
+    def _record_wait(self, state, waited):
+        state.granted += 1
+        state.wait_total += waited
+        state.wait_max = max(state.wait_max, waited)
+
+    def stats(self):
+        """Queue depth, running generations and wait times per model"""
+        with self._lock:
+            return {model: {
+                "running": state.running,
+                "limit": state.limit,
+                "queued": {priority: len(queue) for priority, queue in state.queues.items()},
+                "granted": state.granted,
+                "rejected": state.rejected,
+                "avg_wait_s": round(state.wait_total / state.granted, 3) if state.granted else 0.0,
+                "max_wait_s": round(state.wait_max, 3),
+            } for model, state in self._models.items()}
+
+# Used when no retrieval daemon runs; then the limit only holds within this process
+local_scheduler = LLMScheduler()
+
+def _acquire_request(model, priority):
+    payload = model.encode('utf-8')
+    return REQUEST_HEADER.pack(OP_ACQUIRE, PRIORITIES.index(priority), 0, 0, 0.0, len(payload)) + payload
+
+def _check_grant(status, body):
+    if status != STATUS_OK:
+        raise SchedulerBusy(body.decode('utf-8'))
+
+def _daemon_acquire(model, priority):
+    """Wait for a slot from the daemon's scheduler; the slot is held until the
+    returned socket is closed. Returns None if no daemon is running.
+    """
+    try:
+        sock = socket.create_connection((DAEMON_HOST, DAEMON_PORT), timeout=0.5)
+    except OSError:
+        return None
+    try:
+        sock.settimeout(None)
+        sock.sendall(_acquire_request(model, priority))
+        status, length = RESPONSE_HEADER.unpack(recv_exact(sock, RESPONSE_HEADER.size))
+        _check_grant(status, recv_exact(sock, length))
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+@contextlib.contextmanager
+def llm_slot(model, priority='work'):
+    """Hold one of ``model``'s generation slots for the duration of the block"""
+    sock = _daemon_acquire(model, priority)
+    if sock is None:
+        local_scheduler.acquire(model, priority)
+        try:
+            yield
+        finally:
+            local_scheduler.release(model)
+        return
+    try:
+        yield
+    finally:
+        sock.close()
+
+@contextlib.asynccontextmanager
+async def llm_slot_async(model, priority='work'):
+    """Async counterpart of llm_slot; waiting does not block the event loop"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(DAEMON_HOST, DAEMON_PORT), 0.5)
+    except (OSError, asyncio.TimeoutError):
+        await local_scheduler.acquire_async(model, priority)
+        try:
+            yield
+        finally:
+            local_scheduler.release(model)
+        return
+    try:
+        writer.write(_acquire_request(model, priority))
+        status, length = RESPONSE_HEADER.unpack(await reader.readexactly(RESPONSE_HEADER.size))
+        _check_grant(status, await reader.readexactly(length))
+        yield
+    finally:
+        writer.close()
+
+def scheduler_stats():
+    """Stats of the daemon's scheduler, or of this process's when no daemon runs"""
+    try:
+        with socket.create_connection((DAEMON_HOST, DAEMON_PORT), timeout=2.0) as sock:
+            sock.sendall(REQUEST_HEADER.pack(OP_SCHED_STATS, 0, 0, 0, 0.0, 0))
+            status, length = RESPONSE_HEADER.unpack(recv_exact(sock, RESPONSE_HEADER.size))
+            return json.loads(recv_exact(sock, length))
+    except OSError:
+        return local_scheduler.stats()
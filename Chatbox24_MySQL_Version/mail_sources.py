@@ -0,0 +1,112 @@
+import os
+import re
+import time
+import zipfile
+from email_parser import MAX_MESSAGE_BYTES
+
+MBOX_SUFFIXES = ('.mbox', '.mbx')
+PROGRESS_EVERY = 5.0  # Seconds between throughput reports
+
+MBOXRD_FROM = re.compile(rb"^>+From ")
+
+def is_mail_source(path):
+    """Whether ``path`` is something iter_messages can read: an .eml file, an mbox
+    file, a zip archive or a directory (Maildir or a folder of .eml files)
+    """
+    return os.path.isdir(path) or (os.path.isfile(path) and path.lower().endswith(('.eml', '.zip') + MBOX_SUFFIXES))
+
+def read_capped(file):
+    """Contents of a binary file, cut off after MAX_MESSAGE_BYTES like the parser does"""
+    return file.read(MAX_MESSAGE_BYTES)
+
+def read_mbox(file, name):
+    """Yield (name#n, bytes) for each message of an mbox file opened in binary
+    mode. Only the current message is held in memory, up to MAX_MESSAGE_BYTES.
+    """
+    lines, number, size = None, 0, 0
+    for line in file:
+        if line.startswith(b"From "):
+            if lines:
+                yield f"{name}#{number}", _mbox_message(lines)
+            lines, number, size = [], number + 1, 0
+        elif lines is not None and size < MAX_MESSAGE_BYTES:  # The rest of an oversized message is skipped
+            lines.append(line[1:] if MBOXRD_FROM.match(line) else line)  # Undo ">From " quoting
+            size += len(lines[-1])
+    if lines:
+        yield f"{name}#{number}", _mbox_message(lines)
+
+def _mbox_message(lines):
+    if lines[-1] in (b"\n", b"\r\n"):
+        lines.pop()  # Blank line separating it from the next message
+    return b"".join(lines)
+
+def zip_messages(path, name=None):
+    """Yield the .eml, Maildir and mbox messages inside a zip archive (a path or a
+    seekable binary file), one member at a time
+    """
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            member = info.filename.lower()
+            member_name = f"{name or path}:{info.filename}"
+            if member.endswith(MBOX_SUFFIXES):
+                with archive.open(info) as f:
+                    yield from read_mbox(f, member_name)
+            elif member.endswith(".eml") or "/cur/" in f"/{member}" or "/new/" in f"/{member}":
+                with archive.open(info) as f:
+                    yield member_name, read_capped(f)
+
+def directory_messages(path):
+    """Yield messages under a directory: Maildir cur/ and new/ entries, .eml files,
+    and the mbox files and zip archives found along the way
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        in_maildir = os.path.basename(root) in ("cur", "new")
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            if in_maildir or file_name.lower().endswith(".eml"):
+                with open(file_path, 'rb') as f:
+                    yield file_path, read_capped(f)
+            elif file_name.lower().endswith(('.zip',) + MBOX_SUFFIXES):
+                yield from iter_messages([file_path])
+
+def iter_messages(paths):
+    """Yield (name, bytes) for every message in ``paths``, lazily: however large
+    the archive, one message of at most MAX_MESSAGE_BYTES is read at a time
+    """
+    for path in paths:
+        lower = path.lower()
+        if os.path.isdir(path):
+            yield from directory_messages(path)
+        elif lower.endswith(".zip"):
+            yield from zip_messages(path)
+        elif lower.endswith(MBOX_SUFFIXES):
+            with open(path, 'rb') as f:
+                yield from read_mbox(f, path)
+        else:
+            with open(path, 'rb') as f:
+                yield path, read_capped(f)
+
+def with_throughput(messages, report, every=PROGRESS_EVERY):
+    """Pass (name, bytes) messages through, calling ``report(stats)`` with the
+    number read, megabytes and rates every ``every`` seconds and at the end
+    """
+    count, size, started = 0, 0, time.monotonic()
+    last_report = started
+
+    def stats():
+        elapsed = max(time.monotonic() - started, 1e-9)
+        return {"messages": count, "mb": round(size / 2**20, 1), "messages_per_s": round(count / elapsed, 1),
+                "mb_per_s": round(size / 2**20 / elapsed, 2)}
+
+    for name, data in messages:
+        count += 1
+        size += len(data)
+        yield name, data
+        now = time.monotonic()
+        if now - last_report >= every:
+            report(stats())
+            last_report = now
+    report(stats())
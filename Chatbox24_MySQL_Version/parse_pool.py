@@ -0,0 +1,165 @@
+import os
+import sys
+import asyncio
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email_parser import MAX_MESSAGE_BYTES, parse_record
+
+PARSE_PROCESSES = os.cpu_count() or 4
+PARSE_CHUNK = 16                # Messages per task; one round trip to a worker carries a whole chunk
+MAX_CHUNK_BYTES = 4 * 2**20     # A chunk is sent early once its messages reach this size
+MAX_SHIPPED_BYTES = 256 * 2**10 # Larger messages are parsed here: copying them to a worker costs more
+                                # than the parse, which skips attachment bytes without decoding them
+CHUNKS_PER_PROCESS = 2          # Chunks in flight per worker, so reading never runs far ahead of parsing
+
+def parse_source(source, thread_messages=None):
+    """(subject, body, metadata) of a message given as raw bytes or a file path"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return parse_record(bytes(source), thread_messages)
+    with open(source, 'rb') as f:
+        return parse_record(f.read(MAX_MESSAGE_BYTES), thread_messages)
+
+def parse_chunk(sources, thread_messages=None):
+    """Worker side: (record, error) per source; a message that fails to parse
+    does not take the rest of the chunk with it
+    """
+    results = []
+    for source in sources:
+        try:
+            results.append((parse_source(source, thread_messages), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+    return results
+
+def _mp_context():
+    # On Linux forked workers start in milliseconds and never re-run the launching script.
+    # Elsewhere the platform default is kept: macOS crashes in children forked after
+    # threads or Tk have started, and Windows cannot fork at all
+    return multiprocessing.get_context('fork') if sys.platform.startswith('linux') else multiprocessing.get_context()
+
+class ParsePool:
+    """Email parsing on worker processes, so large drops use every core instead
+    of queueing on the GIL.
+
+    Sources are raw bytes or paths of .eml files (a path is read by the worker,
+    so only the name crosses the process boundary). Messages are sent in chunks
+    of ``chunk_size`` to amortize the IPC round trip, and results come back as
+    (subject, body, metadata) records in input order. ``thread_messages`` is
+    passed on to email_parser.parse_record.
+    """
+
+    def __init__(self, processes=PARSE_PROCESSES, chunk_size=PARSE_CHUNK):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=_mp_context())
+            return self._executor
+
+    def start(self):
+        """Start the workers now; front-ends call this at start-up, before they run other threads"""
+        if self.processes > 1:
+            self.executor().submit(parse_chunk, []).result()
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _submit(self, sources, thread_messages):
+        if self.processes < 2:
+            return None, None  # One core: shipping messages to a worker only adds the IPC
+        executor = self.executor()
+        try:
+            return executor, executor.submit(parse_chunk, sources, thread_messages)
+        except BrokenProcessPool:
+            self._reset(executor)
+            return None, None
+
+    def _results(self, executor, future, sources, thread_messages):
+        """Results of a chunk; if a worker died (e.g. killed for memory) the chunk is parsed here instead"""
+        if future is not None:
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self._reset(executor)
+        return parse_chunk(sources, thread_messages)
+
+    def parse_many(self, items, thread_messages=None):
+        """Yield (tag, record, error) for (tag, source) items, in input order. The
+        tags stay in this process. Items are pulled lazily, a few chunks per worker
+        ahead of the consumer. A drop smaller than one chunk and messages over
+        MAX_SHIPPED_BYTES are parsed in this process instead.
+        """
+        pending = deque()
+        tags, sources, size = [], [], 0
+        for tag, source in items:
+            if len(source) > MAX_SHIPPED_BYTES:  # A path counts only its name; the worker reads the file
+                if sources:
+                    pending.append((tags, sources) + self._submit(sources, thread_messages))
+                    tags, sources, size = [], [], 0
+                pending.append(([tag], [source], None, None))
+            else:
+                tags.append(tag)
+                sources.append(source)
+                size += len(source)
+                if len(sources) < self.chunk_size and size < MAX_CHUNK_BYTES:
+                    continue
+                pending.append((tags, sources) + self._submit(sources, thread_messages))
+                tags, sources, size = [], [], 0
+            while len(pending) >= self.processes * CHUNKS_PER_PROCESS:
+                yield from self._collect(*pending.popleft(), thread_messages)
+        if sources:
+            submitted = self._submit(sources, thread_messages) if pending else (None, None)
+            pending.append((tags, sources) + submitted)
+        while pending:
+            yield from self._collect(*pending.popleft(), thread_messages)
+
+    def _collect(self, tags, sources, executor, future, thread_messages):
+        for tag, (record, error) in zip(tags, self._results(executor, future, sources, thread_messages)):
+            yield tag, record, error
+
+    async def parse_async(self, source, thread_messages=None):
+        """(subject, body, metadata) of one message, parsed on a worker without blocking the event loop"""
+        [(record, error)] = await self.parse_many_async([source], thread_messages)
+        if error is not None:
+            raise ValueError(error)
+        return record
+
+    async def parse_many_async(self, sources, thread_messages=None):
+        """(record, error) for each source, split evenly over the workers"""
+        if not sources:
+            return []
+        size = min(self.chunk_size, -(-len(sources) // self.processes))
+        chunks = [sources[start:start + size] for start in range(0, len(sources), size)]
+        submitted = [self._submit(chunk, thread_messages) for chunk in chunks]
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            asyncio.wrap_future(future) if future is not None else loop.run_in_executor(None, parse_chunk, chunk, thread_messages)
+            for chunk, (_, future) in zip(chunks, submitted)), return_exceptions=True)
+        merged = []
+        for chunk, (executor, _), result in zip(chunks, submitted, results):
+            if isinstance(result, BrokenProcessPool):
+                self._reset(executor)
+                result = await loop.run_in_executor(None, parse_chunk, chunk, thread_messages)
+            elif isinstance(result, BaseException):
+                raise result
+            merged.extend(result)
+        return merged
+
+_shared_pool = None
+
+def get_parse_pool():
+    """Process-wide pool, created on first use"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = ParsePool()
+    return _shared_pool
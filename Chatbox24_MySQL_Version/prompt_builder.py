@@ -0,0 +1,64 @@
+import re
+
+PROMPT_TOKEN_BUDGET = 3000  # Tokens for system prompt, context and email; the reply has its own max_tokens
+BODY_SHARE = 0.5            # Share of the budget the email keeps even when context would fill it
+
+# Kept byte-identical across requests, services and languages, so the model
+# server can reuse its cached prefix; everything variable comes after it.
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Answer the user's email concisely and accurately, "
+    "using the relevant context from the knowledge base where it applies."
+)
+CONTEXT_HEADER = "Relevant Context:\n"
+INPUT_HEADER = "\n\nUser Input:\n"
+NO_CONTEXT = "No relevant context found."
+TRUNCATION_MARK = " [...]"
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    """Estimate of the llama3 token count: one per word or punctuation mark, or
+    one per four UTF-8 bytes for long words and non-Latin text, whichever is more
+    """
+    return max(len(TOKEN_PATTERN.findall(text)), (len(text.encode('utf-8')) + 3) // 4)
+
+def truncate_to_tokens(text, max_tokens):
+    """Keep the start of ``text`` (the newest message of a thread) within ``max_tokens``"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens - count_tokens(TRUNCATION_MARK))
+    end = min(len(text), limit * 4)
+    while end > 0 and count_tokens(text[:end]) > limit:
+        end = int(end * 0.9)
+    cut = text.rfind(" ", 0, end)
+    return text[:cut if cut > end // 2 else end].rstrip() + TRUNCATION_MARK
+
+def build_messages(user_input, relevant_context, prompt_language=None, budget=PROMPT_TOKEN_BUDGET):
+    """Chat messages for a RAG response within ``budget`` tokens.
+
+    ``relevant_context`` is ordered best first; the lowest-scoring chunks are
+    dropped first, and an email longer than its share of the budget is cut.
+    Returns (messages, context actually used).
+    """
+    tail = f"\n\nRespond in {prompt_language}." if prompt_language else ""
+    available = budget - count_tokens(SYSTEM_PROMPT + CONTEXT_HEADER + INPUT_HEADER + tail)
+
+    context_tokens = [count_tokens(chunk) + 1 for chunk in relevant_context]
+    body_budget = max(int(available * BODY_SHARE), available - sum(context_tokens))
+    body = truncate_to_tokens(user_input, body_budget)
+
+    remaining = available - count_tokens(body)
+    used_context = []
+    for chunk, tokens in zip(relevant_context, context_tokens):
+        if tokens > remaining:
+            break
+        used_context.append(chunk)
+        remaining -= tokens
+
+    if body is not user_input or len(used_context) < len(relevant_context):
+        print(f"Prompt trimmed to {budget} tokens: {len(relevant_context) - len(used_context)} context chunks dropped"
+              f"{', email truncated' if body is not user_input else ''}")
+
+    context_str = "\n".join(used_context) if used_context else NO_CONTEXT
+    prompt = CONTEXT_HEADER + context_str + INPUT_HEADER + body + tail
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}], used_context
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import numpy as np
+from vector_store import VectorStore, normalize_rows, surviving_rows
+
+QUANTIZATION_KINDS = ('int8', 'pq')
+SCAN_CHUNK_ROWS = 16_384  # Rows decoded at a time during a coarse scan
+
+class Int8Quantizer:
+    """Symmetric per-dimension scalar quantization to int8 (4x smaller than float32)"""
+
+    kind = 'int8'
+
+    def __init__(self, scale):
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, matrix, sample_size=50_000, seed=0):
+        sample = _sample(matrix, sample_size, seed)
+        return cls(np.maximum(np.abs(sample).max(axis=0), 1e-12) / 127.0)
+
+    def encode(self, matrix):
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, len(matrix), SCAN_CHUNK_ROWS):
+            chunk = np.asarray(matrix[start:start + SCAN_CHUNK_ROWS], dtype=np.float32) / self.scale
+            codes[start:start + len(chunk)] = np.clip(np.rint(chunk), -127, 127)
+        return codes
+
+    def scores(self, codes, queries):
+        """Approximate inner products; the query stays in float (asymmetric distance)"""
+        queries = np.atleast_2d(queries) * self.scale
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_CHUNK_ROWS):
+            chunk = codes[start:start + SCAN_CHUNK_ROWS].astype(np.float32)
+            out[:, start:start + len(chunk)] = queries @ chunk.T
+        return out
+
+    def state(self):
+        return {'scale': self.scale}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['scale'])
+
+class ProductQuantizer:
+    """Product quantization: each row is split into ``subspaces`` slices, each
+    stored as one byte indexing a 256-entry codebook for that slice.
+    """
+
+    kind = 'pq'
+
+    def __init__(self, codebooks):
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)  # (subspaces, 256, sub_dim)
+
+    @classmethod
+    def train(cls, matrix, subspaces=None, sample_size=50_000, iterations=12, seed=0):
+        sample = _sample(matrix, sample_size, seed)
+        dim = sample.shape[1]
+        subspaces = subspaces or max(1, dim // 4)  # 4 floats -> 1 byte: 16x smaller
+        if dim % subspaces:
+            raise ValueError(f"Dimension {dim} is not divisible into {subspaces} subspaces")
+        sub_dim = dim // subspaces
+        codebooks = np.stack([
+            _kmeans(sample[:, j * sub_dim:(j + 1) * sub_dim], 256, iterations, seed + j)
+            for j in range(subspaces)
+        ])
+        return cls(codebooks)
+
+    def encode(self, matrix):
+        subspaces, _, sub_dim = self.codebooks.shape
+        codes = np.empty((len(matrix), subspaces), dtype=np.uint8)
+        for start in range(0, len(matrix), SCAN_CHUNK_ROWS):
+            chunk = np.asarray(matrix[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+            for j in range(subspaces):
+                codes[start:start + len(chunk), j] = _nearest(chunk[:, j * sub_dim:(j + 1) * sub_dim],
+                                                              self.codebooks[j])
+        return codes
+
+    def scores(self, codes, queries):
+        """Asymmetric distance: per-subspace lookup tables built from the float query"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        subspaces, _, sub_dim = self.codebooks.shape
+        # tables[q, j, c] = <query q slice j, codebook j entry c>
+        tables = np.einsum('qjd,jcd->qjc', queries.reshape(len(queries), subspaces, sub_dim), self.codebooks)
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        columns = np.arange(subspaces)
+        for start in range(0, len(codes), SCAN_CHUNK_ROWS):
+            chunk = codes[start:start + SCAN_CHUNK_ROWS]
+            for q, table in enumerate(tables):
+                out[q, start:start + len(chunk)] = table[columns, chunk].sum(axis=1)
+        return out
+
+    def state(self):
+        return {'codebooks': self.codebooks}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['codebooks'])
+
+def _sample(matrix, sample_size, seed):
+    rng = np.random.default_rng(seed)
+    positions = np.sort(rng.choice(len(matrix), size=min(len(matrix), sample_size), replace=False))
+    return np.asarray(matrix[positions], dtype=np.float32)
+
+def _nearest(points, centroids):
+    distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+    return np.argmin(distances, axis=1)
+
+def _kmeans(points, k, iterations, seed):
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), size=k, replace=len(points) < k)].copy()
+    for _ in range(iterations):
+        labels = _nearest(points, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+def codes_path(store, kind):
+    return f"{store.prefix}.{kind}.npz"
+
+def load_or_build_codes(store, ids, hashes, matrix, kind):
+    """Open the compressed codes persisted next to ``store``, encoding appended or
+    changed rows with the existing codebooks and dropping deleted ones.
+    Returns (quantizer, codes).
+    """
+    if kind not in QUANTIZATION_KINDS:
+        raise ValueError(f"Unknown quantization: {kind}")
+    quantizer_cls = Int8Quantizer if kind == 'int8' else ProductQuantizer
+    path = codes_path(store, kind)
+
+    if os.path.exists(path):
+        try:
+            saved = np.load(path)
+            saved_ids, saved_hashes, codes = saved['ids'], saved['hashes'], saved['codes']
+            quantizer = quantizer_cls.from_state(saved)
+        except (OSError, ValueError, KeyError):
+            saved_ids = None
+        keep = None if saved_ids is None else surviving_rows(saved_ids, ids)
+        if keep is not None:
+            known = len(keep)
+            codes = codes[keep]  # Codebooks stay valid for the remaining rows
+            changed = np.flatnonzero(np.asarray(hashes[:known]) != saved_hashes[keep])
+            if len(changed) or known < len(ids) or known < len(saved_ids):
+                if len(changed):
+                    codes[changed] = quantizer.encode(matrix[changed])
+                if known < len(ids):
+                    codes = np.concatenate([codes, quantizer.encode(matrix[known:])])
+                _save_codes(path, quantizer, codes, ids, hashes)
+            return quantizer, codes
+
+    # Rows were reordered or no codes exist yet
+    quantizer = quantizer_cls.train(matrix)
+    codes = quantizer.encode(matrix)
+    _save_codes(path, quantizer, codes, ids, hashes)
+    return quantizer, codes
+
+def _save_codes(path, quantizer, codes, ids, hashes):
+    tmp_path = f"{path}.tmp{os.getpid()}.npz"
+    np.savez(tmp_path, codes=codes, ids=np.asarray(ids), hashes=np.asarray(hashes), **quantizer.state())
+    os.replace(tmp_path, path)
+
+def evaluate(store_prefix, kind, queries=200, k=5, rerank=4):
+    """Report memory and top-k recall of the quantized path against the exact float path"""
+    from retrieval import Retriever
+
+    cached = VectorStore(store_prefix).open()
+    if cached is None:
+        raise FileNotFoundError(f"No vector store at {store_prefix}")
+    header, ids, hashes, matrix = cached
+    contents = [None] * len(ids)
+    exact = Retriever(ids, matrix, contents, normalized=header.get('normalized', False))
+    quantizer, codes = load_or_build_codes(VectorStore(store_prefix), ids, hashes, exact.matrix, kind)
+    compressed = Retriever(ids, exact.matrix, contents, normalized=True,
+                           quantizer=quantizer, codes=codes, rerank=rerank)
+
+    rng = np.random.default_rng(0)
+    sample = normalize_rows(exact.matrix[rng.choice(len(ids), size=min(queries, len(ids)), replace=False)])
+    sample = normalize_rows(sample + rng.normal(scale=0.02, size=sample.shape))  # Near, not identical, queries
+
+    hits, exact_time, compressed_time = 0, 0.0, 0.0
+    for query in sample:
+        started = time.perf_counter()
+        expected = {row_id for row_id, _, _ in exact.search(query, k, k, 1.0)}
+        exact_time += time.perf_counter() - started
+        started = time.perf_counter()
+        found = {row_id for row_id, _, _ in compressed.search(query, k, k, 1.0)}
+        compressed_time += time.perf_counter() - started
+        hits += len(expected & found)
+
+    print(f"Rows: {len(ids)}, dim: {header['dim']}, quantization: {kind}")
+    print(f"{exact.matrix.dtype} matrix: {exact.matrix.nbytes / 2**20:.1f} MiB, codes: {codes.nbytes / 2**20:.1f} MiB "
+          f"({exact.matrix.nbytes / max(codes.nbytes, 1):.1f}x smaller)")
+    print(f"Recall@{k}: {hits / (k * len(sample)):.3f} "
+          f"(exact {1000 * exact_time / len(sample):.2f} ms/query, "
+          f"{kind} {1000 * compressed_time / len(sample):.2f} ms/query)")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[2] not in QUANTIZATION_KINDS:
+        print(f"Usage: python quantization.py <vector store prefix> {{{'|'.join(QUANTIZATION_KINDS)}}}")
+        sys.exit(1)
+    evaluate(sys.argv[1], sys.argv[2])
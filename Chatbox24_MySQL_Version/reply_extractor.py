@@ -0,0 +1,128 @@
+import re
+
+SIGNATURE_LINES = 6      # Lines after a closing like "Best regards," still taken as the signature
+SIGNATURE_LINE_CHARS = 60
+
+# "On Tue, 5 Mar 2024 at 10:02, Jane <jane@example.com> wrote:", "Am 05.03.2024 um 10:02 schrieb Jane:",
+# "Jane <jane@example.com> schrieb am 05.03.2024:", "Le 5 mars 2024 à 10:02, Jane a écrit :"
+REPLY_HEADER = re.compile(r"^(?:On\s.{1,200}\swrote|Am\s.{1,200}\sschrieb\b.{0,200}|.{1,200}\sschrieb\sam\s.{1,80}"
+                          r"|Le\s.{1,200}\sa\s[ée]crit)\s?:$", re.IGNORECASE)
+# Outlook puts the previous message under a From:/Sent:/To:/Subject: block instead
+HEADER_FROM = re.compile(r"^\*?(?:From|Von|De)\s*:\*?\s*\S", re.IGNORECASE)
+HEADER_DATE = re.compile(r"^\*?(?:Sent|Date|Gesendet|Datum|Envoyé)\s*:", re.IGNORECASE)
+HEADER_FIELD = re.compile(r"^\*?(?:From|Sent|Date|To|Cc|Subject|Von|Gesendet|Datum|An|Betreff|De|Envoyé|À|Objet"
+                          r"|Importance|Wichtigkeit)\s*:", re.IGNORECASE)
+ORIGINAL_MESSAGE = re.compile(r"^-{2,}\s*(?:Original Message|Ursprüngliche Nachricht|Original-Nachricht"
+                              r"|Originalnachricht|Message d'origine)\s*-{2,}$", re.IGNORECASE)
+# A forwarded email is kept: it is usually what the sender wants answered
+FORWARD_MARKER = re.compile(r"^(?:-{2,}\s*(?:Forwarded message|Weitergeleitete Nachricht|Message transféré)\s*-{2,}"
+                            r"|Begin forwarded message:|Anfang der weitergeleiteten Nachricht:)$", re.IGNORECASE)
+QUOTED = re.compile(r"^>")
+
+SIGNATURE_DELIMITER = re.compile(r"^--$")
+MOBILE_FOOTER = re.compile(r"^(?:Sent from (?:my )?\S.{0,40}|Get Outlook for \S.{0,20}|Von meinem \S.{0,40} gesendet\.?"
+                           r"|Gesendet von meinem \S.{0,40}|Envoyé de mon \S.{0,40})$", re.IGNORECASE)
+# Closings that end the message; bare thanks only with a comma ("Thanks," / "Danke, Jane"),
+# since "Thanks for the quick reply" usually starts the text
+_CLOSING = (r"(?:(?:best|kind|warm|warmest|with\s+kind|many\s+thanks\s+and|thanks\s+and)\s+)?regards|best(?:\s+wishes)?"
+            r"|all\s+the\s+best|cheers|sincerely|yours(?:\s+(?:sincerely|truly|faithfully))?"
+            r"|(?:mit\s+)?(?:freundlichen|besten|vielen|herzlichen|lieben|schönen)\s+gr(?:ü|ue)(?:ß|ss)en"
+            r"|(?:viele|beste|liebe|herzliche|schöne|freundliche)\s+gr(?:ü|ue)(?:ß|ss)e|gr(?:ü|ue)(?:ß|ss)e|gru(?:ß|ss)"
+            r"|mfg|lg|vg|alles\s+gute|cordialement|bien\s+à\s+vous")
+_THANKS = r"thanks(?:\s+again)?|many\s+thanks|thank\s+you|danke(?:\s+schön)?|vielen\s+dank|merci"
+VALEDICTION = re.compile(rf"^(?:(?:{_CLOSING})(?:[,.!]\s*\S+(?:\s+\S+){{0,2}})?[,.!]?|(?:{_THANKS})[,!](?:\s*\S+(?:\s+\S+){{0,2}})?)$",
+                         re.IGNORECASE)
+DISCLAIMER = re.compile(
+    r"\b(?:this|the)\s+(?:e-?mail|message|communication)\b.{0,80}\b(?:confidential|privileged)"
+    r"|\bintended\s+(?:solely\s+|only\s+)?for\s+the\s+(?:use\s+of\s+the\s+)?(?:named\s+)?(?:addressee|recipient)"
+    r"|\bif\s+you\s+(?:are\s+not\s+the\s+intended|have\s+received\s+this\b.{0,40}\bin\s+error)"
+    r"|\bdiese\s+(?:e-?mail|nachricht)\b.{0,80}\bvertraulich|\bnicht\s+der\s+(?:richtige|beabsichtigte)\s+(?:adressat|empfänger)"
+    r"|\b(?:irrtümlich|versehentlich)\s+erhalten|\bplease\s+consider\s+the\s+environment\s+before\s+printing"
+    r"|\bbitte\s+denken\s+sie\s+an\s+die\s+umwelt|^(?:geschäftsführer(?:in|ung)?|amtsgericht|registergericht"
+    r"|sitz\s+der\s+gesellschaft)\s*:|\bHRB\s?\d|\bUSt-?IdNr|\bregistered\s+(?:office|in\s+england)"
+    r"|\bcompany\s+(?:registration|reg\.?)\s+(?:no|number)", re.IGNORECASE)
+SEPARATOR = re.compile(r"^[-_=*~\s]*$")
+
+def _header_span(lines, i):
+    """Number of lines of the reply header starting at line ``i``, 0 if there is none"""
+    line = lines[i]
+    if REPLY_HEADER.match(line) or ORIGINAL_MESSAGE.match(line):
+        return 1
+    if i + 1 < len(lines) and line[:3].lower() in ("on ", "am ", "le ") and REPLY_HEADER.match(f"{line} {lines[i + 1]}"):
+        return 2  # Long headers are wrapped before "wrote:"
+    if HEADER_FROM.match(line) and any(HEADER_DATE.match(following) for following in lines[i + 1:i + 6]):
+        end = i + 1
+        while end < len(lines) and end < i + 8 and (HEADER_FIELD.match(lines[end]) or not lines[end]):
+            end += 1
+        return end - i
+    return 0
+
+def _unquote(lines):
+    return [line[1:].lstrip(" ") if QUOTED.match(line) else line for line in lines]
+
+def split_newest(lines):
+    """(lines of the newest message, lines of the earlier ones with one level of
+    quoting removed). The newest message ends at the first reply header; quoted
+    lines inside it belong to the earlier messages.
+    """
+    own, quoted = [], []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if QUOTED.match(line):
+            quoted.append(line)
+            i += 1
+            continue
+        if FORWARD_MARKER.match(line):
+            if i + 1 < len(lines) and HEADER_FROM.match(lines[i + 1]):
+                i += 1 + _header_span(lines, i + 1)  # Keep the forwarded text, drop its header block
+            else:
+                i += 1
+            continue
+        span = _header_span(lines, i)
+        if span:
+            return own, _unquote(quoted + lines[i + span:])
+        own.append(line)
+        i += 1
+    return own, _unquote(quoted)
+
+def strip_signature(lines):
+    """Drop mobile footers, the "-- " signature, legal disclaimers and the closing
+    with the name, title and phone lines under it
+    """
+    lines = [line for line in lines if not MOBILE_FOOTER.match(line)]
+    for i, line in enumerate(lines):
+        if SIGNATURE_DELIMITER.match(line) or (i and DISCLAIMER.search(line)):
+            lines = lines[:i]
+            break
+    filled = [i for i, line in enumerate(lines) if line]
+    for i in reversed(filled[1:][-SIGNATURE_LINES - 1:]):  # Never the first line: something has to remain
+        signature = [line for line in lines[i + 1:] if line]
+        if VALEDICTION.match(lines[i]) and all(len(line) <= SIGNATURE_LINE_CHARS and not line.endswith("?")
+                                               for line in signature):
+            lines = lines[:i]
+            break
+    while lines and SEPARATOR.match(lines[-1]):
+        lines.pop()
+    return lines
+
+def thread_messages(text):
+    """Yield the messages of an email thread, newest first, each without its
+    signature and disclaimer
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    while lines:
+        newest, lines = split_newest(lines)
+        yield "\n".join(strip_signature(newest)).strip()
+
+def extract_reply(text, messages=1):
+    """The newest ``messages`` non-empty messages of a thread, oldest first: 1 is
+    the email being answered, 2 adds the message it replies to (a Q&A pair)
+    """
+    kept = []
+    for message in thread_messages(text):
+        if message:
+            kept.append(message)
+            if len(kept) == messages:
+                break
+    return "\n\n".join(reversed(kept)) if kept else text.strip()
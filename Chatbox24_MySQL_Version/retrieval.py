@@ -0,0 +1,283 @@
+import copy
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from vector_store import VectorStore, normalize_rows
+from embeddings import embed_texts, embed_text, EMBEDDING_MODEL
+from ann_index import load_or_build_index, ANN_MIN_ROWS
+from quantization import load_or_build_codes, SCAN_CHUNK_ROWS
+from bm25_index import BM25Index, bm25_path, reciprocal_rank_fusion
+
+EMBED_TIMEOUT = 15.0  # Seconds to wait for a query embedding before answering from BM25 alone
+
+_embedding_pool = ThreadPoolExecutor(max_workers=4)
+
+class Retriever:
+    """Cosine-similarity retrieval over one snapshot of the knowledge base.
+
+    The matrix is normalized once (the vector store already keeps unit-length
+    rows, in which case it is used as mapped), so scoring a query is a single
+    matrix-vector product followed by a partial sort. float16 stores stay
+    mapped and are upcast to float32 one chunk of rows at a time.
+
+    With a ``quantizer`` the coarse scan runs over the compressed ``codes``
+    only; the ``rerank`` * k best rows are then re-scored exactly against the
+    float matrix, whose pages stay on disk unless a shortlist touches them.
+
+    With a ``lexical`` BM25 index, text searches fuse dense and lexical
+    rankings and still answer when the embedding model is unavailable.
+    Lexical matches are scored by cosine like the dense hits, so ``threshold``
+    and ``min_k`` apply to the fused result and scores stay cosine scores.
+    """
+
+    def __init__(self, ids, matrix, contents, ann_index=None, normalized=False,
+                 quantizer=None, codes=None, rerank=4, lexical=None):
+        matrix = np.asarray(matrix) if isinstance(matrix, list) else matrix
+        if not normalized:
+            matrix = normalize_rows(matrix)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.matrix = matrix
+        self.contents = contents
+        self.ann_index = ann_index
+        self.quantizer = quantizer
+        self.codes = codes
+        self.rerank = rerank
+        self.lexical = lexical
+        self.positions = {int(row_id): pos for pos, row_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extended(self, ids, matrix, contents, ann_index=None, codes=None):
+        """Copy of this snapshot with rows appended: ``ids`` and ``contents`` are
+        the new rows, ``matrix``, ``ann_index`` and ``codes`` cover all rows
+        """
+        snapshot = copy.copy(self)
+        start = len(self.ids)
+        snapshot.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        snapshot.matrix = matrix
+        snapshot.contents = self.contents + list(contents)
+        snapshot.ann_index = ann_index
+        snapshot.codes = codes
+        snapshot.positions = dict(self.positions)
+        snapshot.positions.update((int(row_id), start + i) for i, row_id in enumerate(ids))
+        return snapshot
+
+    def _exact(self, positions, query):
+        return np.asarray(self.matrix[positions], dtype=np.float32) @ query
+
+    def _scan(self, queries):
+        """Exact scores of ``queries`` against every row"""
+        if self.matrix.dtype == np.float32:
+            return queries @ self.matrix.T
+        return np.concatenate([
+            queries @ np.asarray(self.matrix[start:start + SCAN_CHUNK_ROWS], dtype=np.float32).T
+            for start in range(0, len(self.matrix), SCAN_CHUNK_ROWS)
+        ], axis=-1)
+
+    def _shortlist(self, approx, size, positions=None):
+        """Positions of the ``size`` best approximate scores"""
+        if len(approx) > size:
+            best = np.argpartition(-approx, size - 1)[:size]
+        else:
+            best = np.arange(len(approx))
+        return best if positions is None else positions[best]
+
+    def scores(self, query, nprobe=None, shortlist=None):
+        """Cosine scores for ``query``; returns (positions, scores).
+
+        With an ANN index only the probed clusters are scored, otherwise every
+        row is (exact scan). With a quantizer and a ``shortlist`` size, only the
+        best approximate candidates get exact scores. ``positions`` maps scores
+        back to matrix rows.
+        """
+        query = normalize_rows(query)
+        positions = None
+        if self.ann_index is not None:
+            positions = self.ann_index.candidates(query, nprobe)
+            if not len(positions):
+                positions = None
+        if self.quantizer is not None and shortlist:
+            codes = self.codes if positions is None else self.codes[positions]
+            positions = self._shortlist(self.quantizer.scores(codes, query)[0], shortlist, positions)
+        if positions is None:
+            return np.arange(len(self.ids)), self._scan(query)
+        return positions, self._exact(positions, query)
+
+    def search(self, query, min_k=1, max_k=5, threshold=0.8, nprobe=None):
+        """Return up to ``max_k`` (id, score, content) hits scoring at least
+        ``threshold``, padded with the best rows up to ``min_k``, best first.
+        """
+        if not len(self):
+            return []
+        positions, scores = self.scores(query, nprobe, shortlist=self.rerank * max(max_k, min_k, 1))
+        return self._hits(positions, scores, select_top(scores, min_k, max_k, threshold))
+
+    def _hits(self, positions, scores, selected):
+        return [(int(self.ids[positions[i]]), float(scores[i]), self.contents[positions[i]]) for i in selected]
+
+    def search_batch(self, queries, min_k=1, max_k=5, threshold=0.8, max_chunk_bytes=256 * 2**20):
+        """Search many queries at once; returns one hit list per query.
+
+        Queries are scored with one matrix-matrix product per chunk (against
+        the codes when quantized, then re-ranked per query), chunks being
+        sized so the score block stays under ``max_chunk_bytes``.
+        """
+        if not len(self) or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        queries = normalize_rows(queries)
+        chunk_size = max(1, max_chunk_bytes // (4 * len(self.ids)))
+        k = min(max(max_k, min_k), len(self.ids))
+        all_positions = np.arange(len(self.ids))
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+            if self.quantizer is not None:
+                for query, approx in zip(chunk, self.quantizer.scores(self.codes, chunk)):
+                    positions = self._shortlist(approx, self.rerank * max(k, 1))
+                    scores = self._exact(positions, query)
+                    results.append(self._hits(positions, scores, select_top(scores, min_k, max_k, threshold)))
+                continue
+
+            scores = self._scan(chunk)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if 0 < k < scores.shape[1] else None
+            for row, row_scores in enumerate(scores):
+                candidates = top[row] if top is not None else None
+                results.append(self._hits(all_positions, row_scores,
+                                          select_top(row_scores, min_k, max_k, threshold, candidates)))
+        return results
+
+    def search_text(self, text, min_k=1, max_k=5, threshold=0.8, embedding_model=EMBEDDING_MODEL,
+                    embed_timeout=EMBED_TIMEOUT):
+        """Search for a query text: dense hits fused with BM25 hits. Falls back to
+        lexical hits alone if the embedding fails or takes over ``embed_timeout``.
+        """
+        if not len(self):
+            return []
+        query, dense_hits = None, []
+        try:
+            query = _embedding_pool.submit(embed_text, text, embedding_model).result(timeout=embed_timeout)
+            dense_hits = self.search(query, min_k, max_k, threshold)
+        except Exception as e:
+            query = None
+            print(f"Dense retrieval unavailable, using lexical matches only: {e!r}")
+        return self._fuse(text, query, dense_hits, min_k, max_k, threshold)
+
+    def search_texts(self, texts, min_k=1, max_k=5, threshold=0.8, embedding_model=EMBEDDING_MODEL):
+        """Embed ``texts`` in one batch and search them together; texts that
+        could not be embedded get lexical hits only.
+        """
+        results = [[] for _ in texts]
+        if not len(self) or not texts:
+            return results
+        embeddings = embed_texts(texts, model=embedding_model, progress_every=None)
+        embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        if embedded:
+            hits = self.search_batch(np.stack([embeddings[i] for i in embedded]), min_k, max_k, threshold)
+            for i, text_hits in zip(embedded, hits):
+                results[i] = text_hits
+        return [self._fuse(text, embedding, text_hits, min_k, max_k, threshold)
+                for text, embedding, text_hits in zip(texts, embeddings, results)]
+
+    def _fuse(self, text, query, dense_hits, min_k, max_k, threshold):
+        """Reciprocal rank fusion of dense hits with the BM25 ranking for ``text``.
+
+        BM25 matches get their exact cosine score against ``query`` and, like
+        the dense hits, count only at or above ``threshold``; the passing rows
+        are ordered by fused rank and padded by cosine up to ``min_k``. Without
+        a query (the embedding failed) the BM25 matches are returned alone,
+        with a score of 0.0.
+        """
+        if self.lexical is None:
+            return dense_hits
+        lexical_ids = [row_id for row_id, _ in self.lexical.search(text, k=max(max_k, min_k))
+                       if row_id in self.positions]
+        if query is None:
+            return [(row_id, 0.0, self.contents[self.positions[row_id]]) for row_id in lexical_ids[:max_k]]
+        if not lexical_ids:
+            return dense_hits
+
+        scores = {row_id: score for row_id, score, _ in dense_hits}
+        new_ids = [row_id for row_id in lexical_ids if row_id not in scores]
+        if new_ids:
+            positions = np.array([self.positions[row_id] for row_id in new_ids])
+            scores.update(zip(new_ids, self._exact(positions, normalize_rows(query)).tolist()))
+
+        fused = [row_id for row_id, _ in reciprocal_rank_fusion([[row_id for row_id, _, _ in dense_hits], lexical_ids])]
+        selected = [row_id for row_id in fused if scores[row_id] >= threshold][:max_k]
+        if len(selected) < min_k:
+            rest = sorted((row_id for row_id in scores if row_id not in selected), key=lambda row_id: -scores[row_id])
+            selected += rest[:min_k - len(selected)]
+        return [(row_id, float(scores[row_id]), self.contents[self.positions[row_id]]) for row_id in selected]
+
+def select_top(scores, min_k, max_k, threshold, candidates=None):
+    """Indices of the best scores above ``threshold`` (at least ``min_k``), best first.
+
+    ``candidates`` may hold the positions of the k best scores if already known.
+    """
+    k = min(max(max_k, min_k), len(scores))
+    if k == 0:
+        return []
+    if candidates is not None:
+        top = candidates
+    else:
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind='stable')]
+    passing = int(np.count_nonzero(scores[top] >= threshold))
+    if passing >= min_k:
+        return top[:min(passing, max_k)]
+    return top[:min_k]
+
+def load_retriever(rows, store_prefix, embedding_model=EMBEDDING_MODEL, dtype='float32', quantization=None):
+    """Sync the vector store with ``rows`` ((id, content) pairs) and open a Retriever.
+
+    ``quantization`` ('int8' or 'pq') keeps only compressed codes in memory and
+    re-ranks a shortlist against the mapped float matrix.
+    """
+    if not rows:
+        return Retriever([], np.empty((0, 0), dtype=np.float32), [])
+
+    store = VectorStore(store_prefix, dtype=dtype, normalize=True)
+    embed = lambda texts: embed_texts(texts, model=embedding_model)
+    header, ids, hashes, matrix = store.sync(rows, embed, model=embedding_model)
+    ann_index = load_or_build_index(store, ids, hashes, matrix)
+    quantizer, codes = None, None
+    if quantization and len(ids):
+        quantizer, codes = load_or_build_codes(store, ids, hashes, matrix, quantization)
+    lexical = BM25Index(bm25_path(store_prefix))
+    lexical.sync(rows)
+
+    contents = dict(rows)
+    return Retriever(ids, matrix, [contents[int(row_id)] for row_id in ids], ann_index,
+                     normalized=header.get('normalized', False), quantizer=quantizer, codes=codes,
+                     lexical=lexical)
+
+def append_rows(snapshot, rows, store_prefix, embedding_model=EMBEDDING_MODEL, dtype='float32'):
+    """Extend a ``snapshot`` opened by load_retriever with appended ``rows``:
+    only the new rows are embedded, assigned to IVF lists, encoded and indexed
+    for BM25. The persisted IVF index and codes catch up on the next
+    load_retriever. Rows that could not be embedded are left out.
+
+    Returns None when a full load_retriever is needed instead: the snapshot is
+    empty or outgrows the exact scan, or the store changed underneath it.
+    """
+    if not len(snapshot) or (snapshot.ann_index is None and len(snapshot) + len(rows) >= ANN_MIN_ROWS):
+        return None
+    store = VectorStore(store_prefix, dtype=dtype, normalize=True)
+    embed = lambda texts: embed_texts(texts, model=embedding_model)
+    cached = store.append(rows, embed, snapshot.ids, model=embedding_model)
+    if cached is None:
+        return None
+    header, ids, hashes, matrix = cached
+    if snapshot.lexical is not None:
+        snapshot.lexical.add(rows)
+
+    known = len(snapshot)
+    ann_index, codes = snapshot.ann_index, snapshot.codes
+    if ann_index is not None:
+        ann_index = ann_index.extended(matrix[known:])
+    if snapshot.quantizer is not None:
+        codes = np.concatenate([codes, snapshot.quantizer.encode(matrix[known:])])
+    contents = dict(rows)
+    return snapshot.extended(ids[known:], matrix, [contents[int(row_id)] for row_id in ids[known:]],
+                             ann_index, codes)
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+import numpy as np
+from kb_watcher import FileTail, TableHighWaterMark, LiveRetriever
+from db_config import DB_CONFIG
+from llm_client import warm_up
+from llm_scheduler import LLMScheduler, SchedulerBusy, PRIORITIES
+from daemon_protocol import (DAEMON_HOST, DAEMON_PORT, OP_SEARCH_TEXT, OP_SEARCH_TEXTS, OP_SEARCH_VECTOR, OP_STATS,
+                             OP_SEARCH_VECTORS, OP_ACQUIRE, OP_SCHED_STATS, STATUS_OK, STATUS_ERROR, STATUS_BUSY,
+                             REQUEST_HEADER, RESPONSE_HEADER, HIT_HEADER, U32, recv_exact)
+
+VAULT_DB = 0    # knowledge_base table, used by the GUI modules
+VAULT_TXT = 1   # Knowledge Base.txt, used by the web modules
+VAULT_NAMES = {'db': VAULT_DB, 'txt': VAULT_TXT}
+
+VAULT_SETTINGS = {
+    VAULT_DB: {'store': "vault_vectors_db", 'dtype': "float32", 'quantization': None},
+    VAULT_TXT: {'store': "vault_vectors_txt", 'dtype': "float32", 'quantization': None, 'path': "Knowledge Base.txt"},
+}
+
+def load_vault(vault):
+    """Build the live retriever for a vault; appended rows are picked up in the background"""
+    from retrieval import load_retriever, append_rows
+
+    settings = VAULT_SETTINGS[vault]
+    source = TableHighWaterMark(DB_CONFIG) if vault == VAULT_DB else FileTail(settings['path'])
+    build = lambda rows: load_retriever(rows, settings['store'], dtype=settings['dtype'],
+                                        quantization=settings['quantization'])
+    extend = lambda snapshot, rows: append_rows(snapshot, rows, settings['store'], dtype=settings['dtype'])
+    return LiveRetriever(source, build, extend=extend)
+
+def _pack_texts(texts):
+    parts = [U32.pack(len(texts))]
+    for text in texts:
+        data = text.encode('utf-8')
+        parts.append(U32.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def _unpack_texts(payload):
+    (count,), offset, texts = U32.unpack_from(payload), U32.size, []
+    for _ in range(count):
+        (size,) = U32.unpack_from(payload, offset)
+        offset += U32.size
+        texts.append(payload[offset:offset + size].decode('utf-8'))
+        offset += size
+    return texts
+
+def _pack_results(results):
+    parts = [U32.pack(len(results))]
+    for hits in results:
+        parts.append(U32.pack(len(hits)))
+        for row_id, score, content in hits:
+            data = content.encode('utf-8')
+            parts.append(HIT_HEADER.pack(row_id, score, len(data)))
+            parts.append(data)
+    return b"".join(parts)
+
+def _unpack_results(payload):
+    view = memoryview(payload)
+    (count,), offset, results = U32.unpack_from(view), U32.size, []
+    for _ in range(count):
+        (hit_count,) = U32.unpack_from(view, offset)
+        offset += U32.size
+        hits = []
+        for _ in range(hit_count):
+            row_id, score, size = HIT_HEADER.unpack_from(view, offset)
+            offset += HIT_HEADER.size
+            hits.append((row_id, score, bytes(view[offset:offset + size]).decode('utf-8')))
+            offset += size
+        results.append(hits)
+    return results
+
+class RetrievalServer(socketserver.ThreadingTCPServer):
+    """Owns the vectors, indexes and contents of each vault for all front-ends"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        self.retrievers = {}
+        self.scheduler = LLMScheduler()  # Shared by every process that talks to Ollama
+        self.load_lock = threading.Lock()
+        super().__init__(address, RetrievalHandler)
+
+    def retriever(self, vault):
+        """Return the retriever for a vault, loading it on first use"""
+        retriever = self.retrievers.get(vault)
+        if retriever is None:
+            with self.load_lock:
+                retriever = self.retrievers.get(vault)
+                if retriever is None:
+                    retriever = self.retrievers[vault] = load_vault(vault)
+                    print(f"Vault {vault} loaded with {len(retriever)} rows")
+        return retriever
+
+class RetrievalHandler(socketserver.BaseRequestHandler):
+    """Serves requests on one persistent client connection"""
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                op, vault, min_k, max_k, threshold, length = REQUEST_HEADER.unpack(
+                    recv_exact(self.request, REQUEST_HEADER.size))
+                payload = recv_exact(self.request, length)
+            except (ConnectionError, OSError):
+                return
+            if op == OP_ACQUIRE:
+                if not 0 <= vault < len(PRIORITIES):
+                    body = f"Unknown priority class: {vault}".encode('utf-8')
+                    self.request.sendall(RESPONSE_HEADER.pack(STATUS_ERROR, len(body)) + body)
+                    continue
+                self.hold_slot(payload.decode('utf-8'), PRIORITIES[vault])
+                return
+            try:
+                status, body = STATUS_OK, self.dispatch(op, vault, min_k, max_k, threshold, payload)
+            except Exception as e:
+                status, body = STATUS_ERROR, str(e).encode('utf-8')
+            self.request.sendall(RESPONSE_HEADER.pack(status, len(body)) + body)
+
+    def hold_slot(self, model, priority):
+        """Grant an LLM slot and keep it until the client disconnects"""
+        try:
+            self.server.scheduler.acquire(model, priority)
+        except SchedulerBusy as e:
+            body = str(e).encode('utf-8')
+            self.request.sendall(RESPONSE_HEADER.pack(STATUS_BUSY, len(body)) + body)
+            return
+        try:
+            self.request.sendall(RESPONSE_HEADER.pack(STATUS_OK, 0))
+            while self.request.recv(64):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.server.scheduler.release(model)
+
+    def dispatch(self, op, vault, min_k, max_k, threshold, payload):
+        if op == OP_SCHED_STATS:
+            return json.dumps(self.server.scheduler.stats()).encode('utf-8')
+        retriever = self.server.retriever(vault)
+        if op == OP_STATS:
+            return struct.pack("<Q", len(retriever))
+        if op == OP_SEARCH_TEXT:
+            return _pack_results([retriever.search_text(payload.decode('utf-8'), min_k, max_k, threshold)])
+        if op == OP_SEARCH_TEXTS:
+            return _pack_results(retriever.search_texts(_unpack_texts(payload), min_k, max_k, threshold))
+        if op == OP_SEARCH_VECTOR:
+            query = np.frombuffer(payload, dtype=np.float32)
+            return _pack_results([retriever.search(query, min_k, max_k, threshold)])
+        if op == OP_SEARCH_VECTORS:
+            (count,) = U32.unpack_from(payload)
+            queries = np.frombuffer(payload, dtype=np.float32, offset=U32.size).reshape(count, -1)
+            return _pack_results(retriever.search_batch(queries, min_k, max_k, threshold))
+        raise ValueError(f"Unknown operation: {op}")
+
+class RetrievalClient:
+    """Thin client with the same search API as retrieval.Retriever"""
+
+    def __init__(self, vault, host=DAEMON_HOST, port=DAEMON_PORT, timeout=60.0):
+        self.vault = vault
+        self.address = (host, port)
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _call(self, op, payload=b"", min_k=0, max_k=0, threshold=0.0):
+        request = REQUEST_HEADER.pack(op, self.vault, min_k, max_k, threshold, len(payload)) + payload
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = self._connect()
+                    self._sock.sendall(request)
+                    status, length = RESPONSE_HEADER.unpack(recv_exact(self._sock, RESPONSE_HEADER.size))
+                    body = recv_exact(self._sock, length)
+                    break
+                except (ConnectionError, OSError):
+                    if self._sock is not None:
+                        self._sock.close()
+                        self._sock = None
+                    if attempt:
+                        raise
+        if status != STATUS_OK:
+            raise RuntimeError(f"Retrieval daemon error: {body.decode('utf-8')}")
+        return body
+
+    def __len__(self):
+        return struct.unpack("<Q", self._call(OP_STATS))[0]
+
+    def search(self, query, min_k=1, max_k=5, threshold=0.8):
+        payload = np.asarray(query, dtype=np.float32).tobytes()
+        return _unpack_results(self._call(OP_SEARCH_VECTOR, payload, min_k, max_k, threshold))[0]
+
+    def search_batch(self, queries, min_k=1, max_k=5, threshold=0.8):
+        queries = np.asarray(queries, dtype=np.float32)
+        if not len(queries):
+            return []
+        payload = U32.pack(len(queries)) + np.ascontiguousarray(queries.reshape(len(queries), -1)).tobytes()
+        return _unpack_results(self._call(OP_SEARCH_VECTORS, payload, min_k, max_k, threshold))
+
+    def search_text(self, text, min_k=1, max_k=5, threshold=0.8):
+        payload = text.encode('utf-8')
+        return _unpack_results(self._call(OP_SEARCH_TEXT, payload, min_k, max_k, threshold))[0]
+
+    def search_texts(self, texts, min_k=1, max_k=5, threshold=0.8):
+        if not texts:
+            return []
+        return _unpack_results(self._call(OP_SEARCH_TEXTS, _pack_texts(texts), min_k, max_k, threshold))
+
+def connect_retriever(vault, load_local):
+    """Use the retrieval daemon if it is running, otherwise load the vault in-process"""
+    client = RetrievalClient(vault, timeout=None)
+    try:
+        client._sock = client._connect()
+    except OSError:
+        print("Retrieval daemon not reachable, loading the knowledge base in-process")
+        return load_local()
+    return client
+
+def daemon_running(host=DAEMON_HOST, port=DAEMON_PORT):
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+def start_daemon(vaults=(), wait=10.0):
+    """Start the daemon as a background process unless one is already listening.
+
+    Waits up to ``wait`` seconds for the socket, so front-ends started right
+    after connect to it instead of loading the knowledge base themselves.
+    """
+    import time
+    import subprocess
+
+    if daemon_running():
+        return None
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_daemon.py")
+    args = [sys.executable, script]
+    if vaults:
+        args += ["--vaults", ",".join(vaults)]
+    process = subprocess.Popen(args)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline and process.poll() is None and not daemon_running():
+        time.sleep(0.1)
+    return process
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared retrieval daemon for the GUI and web front-ends")
+    parser.add_argument("--vaults", default="", help="Comma-separated vaults to load at start: db, txt")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    args = parser.parse_args()
+
+    warm_up(chat_models=())  # Query embeddings need the embedding model loaded
+    # Bound before preloading: early clients queue in the backlog instead of loading in-process
+    with RetrievalServer((DAEMON_HOST, args.port)) as server:
+        for name in args.vaults.split(","):
+            if name:
+                server.retriever(VAULT_NAMES[name])
+        print(f"Retrieval daemon listening on {DAEMON_HOST}:{args.port}")
+        server.serve_forever()
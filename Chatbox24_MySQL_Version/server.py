@@ -1,23 +1,45 @@
 from fastapi import FastAPI, HTTPException
-import ollama
+from fastapi.responses import StreamingResponse
+from llm_client import chat, chat_stream, warm_up
+from llm_scheduler import SchedulerBusy
 
 app = FastAPI()
+warm_up(embed_models=())
 
 @app.get("/")
 def read_root():
     return {"message": "RAG Email Automation API is running!"}
 
 @app.post("/generate")
-def generate_response(user_input: str):
+def generate_response(user_input: str, stream: bool = False):
+    if stream:
+        return stream_response(user_input)
     try:
-        response = ollama.chat(
-            model="llama3",
-            messages=[{"role": "user", "content": user_input}]
-        )
-        return {"response": response["message"]["content"]}
+        response = chat([{"role": "user", "content": user_input}], model="llama3")
+        return {"response": response}
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def stream_response(user_input):
+    """Chunked plain-text response, sent as the model produces it"""
+    try:
+        chunks = chat_stream([{"role": "user", "content": user_input}], model="llama3")
+        first = next(chunks, None)  # Fail with a 429/500 before the response has started
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def tokens():
+        if first is None:
+            return
+        yield first
+        yield from chunks
+
+    return StreamingResponse(tokens(), media_type="text/plain; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
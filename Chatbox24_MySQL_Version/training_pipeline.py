@@ -0,0 +1,251 @@
+import os
+import time
+import queue
+import hashlib
+import threading
+from llm_scheduler import SchedulerBusy
+from dedup_index import fingerprint
+
+PARSE_WORKERS = os.cpu_count() or 4  # Threads parsing MIME/HTML
+LLM_WORKERS = 2        # Extraction calls in flight; match the model's slots in MODEL_CONCURRENCY
+WRITE_BATCH = 25       # Records per database transaction
+FLUSH_INTERVAL = 2.0   # Seconds before a partial batch is written anyway
+QUEUE_SIZE = 64        # Items buffered between stages, so a large drop is never all in memory
+BUSY_BACKOFF = 5.0     # Seconds to wait before retrying when the LLM queue is full
+CHECKPOINT_FILE = "training_checkpoint.txt"
+
+_DONE = object()
+
+def item_key(data):
+    """Content fingerprint of a dropped email; the same file resumes under the same key"""
+    return hashlib.sha1(data).hexdigest()
+
+class Checkpoint:
+    """Keys of emails whose records are committed, appended after each batch.
+
+    A run interrupted part-way leaves the file behind; feeding the same emails
+    again skips everything already written. A run that finishes without
+    failures removes it.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.keys = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.keys = {line.strip() for line in f if line.strip()}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, keys):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{key}\n" for key in keys)
+            f.flush()
+            os.fsync(f.fileno())
+        self.keys.update(keys)
+
+    def clear(self):
+        self.keys = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class TrainingPipeline:
+    """Parse -> LLM extraction -> batched write, each stage on its own threads.
+
+    ``parse(data)`` returns (subject, body), ``analyze(body)`` returns the
+    extracted {"Question", "Answer"} dict and ``write(records)`` stores a batch
+    of records in one transaction. Every item ends up as one result dict
+    (source, subject, question, answer, skipped, error);
+    ``on_progress(result, stats)`` is called for each from the writer thread,
+    in completion order.
+
+    With a ParsePool as ``parse_pool``, messages are parsed in chunks on its
+    worker processes instead of by ``parse`` on parse threads, keeping the newest
+    ``thread_messages`` of each thread; the characters and tokens of quoted
+    history, signatures and disclaimers left out are summed in the stats.
+
+    With an IngestedIndex as ``dedup``, bodies (after ``normalize``) that
+    match an email already ingested or in flight, exactly or by SimHash, are
+    skipped before the LLM call.
+    """
+
+    def __init__(self, parse, analyze, write, checkpoint=None, on_progress=None, dedup=None, normalize=None,
+                 parse_pool=None, thread_messages=None, parse_workers=PARSE_WORKERS, llm_workers=LLM_WORKERS, batch_size=WRITE_BATCH,
+                 flush_interval=FLUSH_INTERVAL, keep_results=True):
+        self.parse = parse
+        self.analyze = analyze
+        self.write = write
+        self.checkpoint = checkpoint
+        self.dedup = dedup
+        self.normalize = normalize
+        self.parse_pool = parse_pool
+        self.thread_messages = thread_messages
+        self.on_progress = on_progress
+        self.parse_workers = parse_workers
+        self.llm_workers = llm_workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_results = keep_results  # Off for large imports that only need on_progress
+
+    def run(self, items):
+        """Process (name, bytes) items, e.g. from mail_sources.iter_messages; they are
+        pulled only as fast as the stages drain. Blocks until all are written and
+        returns the results.
+        """
+        self.results = []
+        self.stats = {"queued": 0, "resumed": 0, "written": 0, "skipped": 0, "duplicates": 0, "llm_calls_saved": 0,
+                      "failed": 0, "chars_saved": 0, "tokens_saved": 0, "elapsed_s": 0.0}
+        self.started = time.monotonic()
+        parse_queue = queue.Queue(QUEUE_SIZE)
+        llm_queue = queue.Queue(QUEUE_SIZE)
+        write_queue = queue.Queue(QUEUE_SIZE)
+
+        stages = [
+            (llm_queue, [self._worker(llm_queue, write_queue, write_queue, self._analyze_item)
+                         for _ in range(self.llm_workers)]),
+            (write_queue, [self._thread(self._writer, write_queue)]),
+        ]
+
+        pending = self._pending(items)
+        if self.parse_pool is None:
+            stages.insert(0, (parse_queue, [self._worker(parse_queue, llm_queue, write_queue, self._parse_item)
+                                            for _ in range(self.parse_workers)]))
+            for item in pending:
+                parse_queue.put(item)
+        else:
+            parsed = self.parse_pool.parse_many(((item, item.pop("data")) for item in pending), self.thread_messages)
+            for item, record, error in parsed:
+                if error is not None:
+                    item["error"] = error
+                    write_queue.put(item)
+                else:
+                    item["subject"], item["body"], metadata = record
+                    self.stats["chars_saved"] += metadata.get("chars_saved", 0)
+                    self.stats["tokens_saved"] += metadata.get("tokens_saved", 0)
+                    llm_queue.put(item)
+
+        # Shut the stages down in order, so every item reaches the writer first
+        for inbox, threads in stages:
+            for _ in threads:
+                inbox.put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        if self.checkpoint is not None and not self.stats["failed"]:
+            self.checkpoint.clear()
+        self.stats["elapsed_s"] = round(time.monotonic() - self.started, 1)
+        return self.results
+
+    def _pending(self, items):
+        for name, data in items:
+            key = item_key(data)
+            if self.checkpoint is not None and key in self.checkpoint:
+                self.stats["resumed"] += 1
+                continue
+            self.stats["queued"] += 1
+            yield {"source": name, "key": key, "data": data}
+
+    def _thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def _worker(self, inbox, outbox, error_box, work):
+        def loop():
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    return
+                try:
+                    outbox.put(work(item))
+                except Exception as e:
+                    item["error"] = str(e)
+                    error_box.put(item)
+        return self._thread(loop)
+
+    def _parse_item(self, item):
+        item["subject"], item["body"] = self.parse(item.pop("data"))
+        return item
+
+    def _analyze_item(self, item):
+        body = item.pop("body").strip()
+        if not body:
+            item["skipped"] = "No text content"
+            return item
+        if self.dedup is not None:
+            item["fingerprint"] = fingerprint(self.normalize(body) if self.normalize else body)
+            match = self.dedup.claim(item["fingerprint"], item["source"])
+            if match is not None:
+                del item["fingerprint"]
+                kind, source = match
+                item["skipped"] = f"{'Duplicate' if kind == 'exact' else 'Near-duplicate'} of {source}"
+                item["duplicate"] = True
+                return item
+        while True:
+            try:
+                result = self.analyze(body)
+                break
+            except SchedulerBusy:
+                time.sleep(BUSY_BACKOFF)  # Bulk work waits its turn instead of failing
+        item["question"] = result.get("Question", "").strip()
+        item["answer"] = result.get("Answer", "").strip()
+        return item
+
+    def _writer(self, inbox):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = inbox.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                deadline = deadline or time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch):
+        records = [item for item in batch if "question" in item]
+        if records:
+            try:
+                self.write(records)
+            except Exception as e:
+                for item in records:
+                    item["error"] = f"Write failed: {e}"
+        if self.dedup is not None:
+            try:
+                self.dedup.commit([item["fingerprint"] for item in records if "error" not in item])
+            except Exception as e:
+                print(f"Failed to update ingested index: {e}")  # Rows are written; only later dedup misses them
+            for item in batch:
+                if "error" in item and "fingerprint" in item:
+                    self.dedup.release(item["fingerprint"])
+        if self.checkpoint is not None:
+            self.checkpoint.add([item["key"] for item in batch if "error" not in item])
+        for item in batch:
+            if "error" in item:
+                self.stats["failed"] += 1
+            elif "skipped" in item:
+                self.stats["skipped"] += 1
+                if item.get("duplicate"):
+                    self.stats["duplicates"] += 1
+                    self.stats["llm_calls_saved"] += 1
+            else:
+                self.stats["written"] += 1
+            self.stats["elapsed_s"] = round(time.monotonic() - self.started, 1)
+            result = {field: item.get(field) for field in ("source", "subject", "question", "answer", "skipped", "error")}
+            if self.keep_results:
+                self.results.append(result)
+            if self.on_progress is not None:
+                self.on_progress(result, dict(self.stats))
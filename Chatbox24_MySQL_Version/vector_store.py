@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import hashlib
+import contextlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized across processes
+    fcntl = None
+
+def normalize_rows(matrix):
+    """Scale rows to unit length so cosine similarity becomes a dot product"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def content_hash(content):
+    """64-bit fingerprint of a row's content, used to detect changed rows"""
+    return int.from_bytes(hashlib.md5(content.encode('utf-8')).digest()[:8], 'little')
+
+def surviving_rows(saved_ids, ids):
+    """Positions of the rows saved with an index that are still, in order, the
+    first rows of the store. Rows deleted since are left out, so the index can
+    drop them instead of being rebuilt. Returns None if the order changed.
+    """
+    saved_ids = np.asarray(saved_ids)
+    keep = np.flatnonzero(np.isin(saved_ids, ids))
+    if len(keep) > len(ids) or not np.array_equal(saved_ids[keep], ids[:len(keep)]):
+        return None
+    return keep
+
+class VectorStore:
+    """Binary embedding store: a contiguous row-major matrix opened with mmap.
+
+    A store named ``prefix`` consists of four files:
+        <prefix>.vec         raw float32 (or float16) matrix, one row per vector
+        <prefix>.ids.npy     int64 row ids, aligned with the matrix rows
+        <prefix>.hashes.npy  uint64 content fingerprints, aligned with the ids
+        <prefix>.json        header with dim, dtype, row count and cache metadata
+
+    The header's ``count`` is authoritative: the matrix and sidecars may hold
+    extra trailing rows while an append is in progress. With ``normalize`` the
+    vectors are stored at unit length, so readers can score the mapped matrix
+    directly without copying it.
+
+    Writers hold an exclusive lock on ``<prefix>.lock``. Rows that readers may
+    have mapped are never overwritten: changed rows go to a copy of the matrix
+    that replaces it, and appends only touch the file past ``count``.
+    """
+
+    DTYPES = ('float32', 'float16')
+
+    def __init__(self, prefix, dtype='float32', normalize=False):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        self.prefix = prefix
+        self.dtype = dtype
+        self.normalize = normalize
+        self.vec_file = f"{prefix}.vec"
+        self.ids_file = f"{prefix}.ids.npy"
+        self.hashes_file = f"{prefix}.hashes.npy"
+        self.header_file = f"{prefix}.json"
+        self.lock_file = f"{prefix}.lock"
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the store's write lock; writers in other processes wait for it"""
+        with open(self.lock_file, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield  # Closing the file releases the lock
+
+    def read_header(self):
+        """Return the store header, or None if the store is missing or incomplete"""
+        if not os.path.exists(self.header_file):
+            return None
+        try:
+            with open(self.header_file, 'r') as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        itemsize = np.dtype(header.get('dtype', 'float32')).itemsize
+        expected_size = header.get('count', 0) * header.get('dim', 0) * itemsize
+        if not os.path.exists(self.vec_file) or os.path.getsize(self.vec_file) < expected_size:
+            return None
+        if not os.path.exists(self.ids_file) or not os.path.exists(self.hashes_file):
+            return None
+        return header
+
+    def open(self):
+        """Map the store into memory; returns (header, ids, hashes, matrix) or None.
+
+        The matrix is a copy-on-write memmap, so every process opening the same
+        store shares the OS page cache and nothing is parsed or copied up front.
+        """
+        header = self.read_header()
+        if header is None:
+            return None
+
+        count = header['count']
+        ids = np.load(self.ids_file, mmap_mode='r')
+        hashes = np.load(self.hashes_file, mmap_mode='r')
+        if len(ids) < count or len(hashes) < count:
+            return None
+        if count == 0:
+            return header, ids[:0], hashes[:0], np.empty((0, header['dim']), dtype=header['dtype'])
+
+        matrix = np.memmap(self.vec_file, dtype=header['dtype'], mode='c', shape=(count, header['dim']))
+        return header, ids[:count], hashes[:count], matrix
+
+    def write(self, ids, hashes, vectors, **metadata):
+        """Atomically replace the store contents with the given rows"""
+        with self.locked():
+            return self._write(ids, hashes, vectors, **metadata)
+
+    def _write(self, ids, hashes, vectors, **metadata):
+        matrix = self._as_matrix(vectors, len(ids))
+        header = dict(metadata)
+        header.update({'dim': int(matrix.shape[1]), 'dtype': self.dtype, 'count': int(matrix.shape[0]),
+                       'normalized': self.normalize})
+
+        # Header goes last: a reader never sees a header without matching data
+        self._replace(self.vec_file, lambda f: f.write(matrix.tobytes()))
+        self._write_sidecars(ids, hashes)
+        self._write_header(header)
+        return header
+
+    def sync(self, rows, embed_fn, **metadata):
+        """Bring the store in line with ``rows``, a list of (id, content) pairs.
+
+        Only rows whose id is new or whose content changed are passed to
+        ``embed_fn(texts) -> vectors`` in one call; vectors of ids no longer
+        present are dropped. Rows embedded as None are left out and retried on
+        the next sync. Returns the reopened store as (header, ids, hashes, matrix).
+        """
+        with self.locked():
+            return self._sync(rows, embed_fn, **metadata)
+
+    def _sync(self, rows, embed_fn, **metadata):
+        cached = self.open()  # Read under the lock, so changes another process just made are seen
+        if cached is not None and (cached[0].get('normalized', False) != self.normalize
+                                   or any(cached[0].get(key) != value for key, value in metadata.items())):
+            cached = None  # Embedding model or layout changed, nothing can be reused
+        if cached is None:
+            header, ids, hashes, matrix = None, np.empty(0, np.int64), np.empty(0, np.uint64), None
+        else:
+            header, ids, hashes, matrix = cached
+
+        position = {int(row_id): pos for pos, row_id in enumerate(ids)}
+        wanted = {}
+        changed, added = [], []
+        for row_id, content in rows:
+            row_hash = content_hash(content)
+            wanted[row_id] = row_hash
+            pos = position.get(row_id)
+            if pos is None:
+                added.append((row_id, row_hash, content))
+            elif int(hashes[pos]) != row_hash:
+                changed.append((pos, row_id, row_hash, content))
+        deleted = [pos for row_id, pos in position.items() if row_id not in wanted]
+
+        if header is not None and not (changed or added or deleted):
+            return cached
+
+        embedded = self._embed_rows(added + changed, embed_fn)
+        added_rows = [row for row in embedded if len(row) == 3]
+        changed_rows = [row for row in embedded if len(row) == 4]
+
+        if header is None or deleted or header['dim'] == 0:
+            # Full rewrite; unchanged rows are copied from the old matrix, not re-embedded
+            keep = np.ones(len(ids), dtype=bool)
+            keep[deleted] = False
+            new_ids = list(ids[keep])
+            new_hashes = list(hashes[keep])
+            new_vectors = list(matrix[keep]) if matrix is not None and len(matrix) else []
+            updated = {row_id: (row_hash, vector) for _, row_id, row_hash, vector in changed_rows}
+            for i, row_id in enumerate(new_ids):
+                if int(row_id) in updated:
+                    new_hashes[i], new_vectors[i] = updated[int(row_id)]
+            for row_id, row_hash, vector in added_rows:
+                new_ids.append(row_id)
+                new_hashes.append(row_hash)
+                new_vectors.append(vector)
+            self._write(new_ids, new_hashes, new_vectors, **metadata)
+        else:
+            self._update_in_place(header, ids, hashes, changed_rows, added_rows)
+
+        print(f"Vector store {self.prefix}: {len(added_rows)}/{len(added)} added, "
+              f"{len(changed_rows)}/{len(changed)} updated, {len(deleted)} deleted")
+        return self.open()
+
+    def append(self, rows, embed_fn, known_ids, **metadata):
+        """Append new (id, content) rows to a store holding exactly ``known_ids``,
+        embedding only them. Returns the reopened store like sync, or None if
+        the store no longer matches ``known_ids`` or ``metadata`` or already
+        holds one of the ids; the caller then falls back to sync.
+        """
+        with self.locked():
+            cached = self.open()
+            if cached is None:
+                return None
+            header, ids, hashes, _ = cached
+            if (header['dim'] == 0 or header.get('normalized', False) != self.normalize
+                    or any(header.get(key) != value for key, value in metadata.items())
+                    or not np.array_equal(ids, known_ids)
+                    or np.isin([row_id for row_id, _ in rows], ids).any()):
+                return None
+
+            pending = [(row_id, content_hash(content), content) for row_id, content in rows]
+            added_rows = self._embed_rows(pending, embed_fn)
+            if added_rows:
+                self._update_in_place(header, ids, hashes, [], added_rows)
+            print(f"Vector store {self.prefix}: {len(added_rows)}/{len(pending)} appended")
+            return self.open()
+
+    def _embed_rows(self, pending, embed_fn):
+        if not pending:
+            return []
+        vectors = embed_fn([row[-1].strip() for row in pending])
+        if self.normalize:
+            vectors = [None if vector is None else normalize_rows(vector) for vector in vectors]
+        return [(*row[:-1], vector) for row, vector in zip(pending, vectors) if vector is not None]
+
+    def _update_in_place(self, header, ids, hashes, changed_rows, added_rows):
+        """Replace changed rows and append new ones without re-embedding the matrix.
+        Appends go to the end of the live file; changed rows are written to a copy
+        that replaces it, so processes that have the matrix mapped keep a
+        consistent view.
+        """
+        dtype, dim, count = np.dtype(header['dtype']), header['dim'], header['count']
+        ids = np.array(ids, dtype=np.int64)
+        hashes = np.array(hashes, dtype=np.uint64)
+
+        vec_path = self.vec_file
+        if changed_rows:
+            vec_path = f"{self.vec_file}.tmp{os.getpid()}"
+            shutil.copyfile(self.vec_file, vec_path)
+            matrix = np.memmap(vec_path, dtype=dtype, mode='r+', shape=(count, dim))
+            for pos, _, row_hash, vector in changed_rows:
+                matrix[pos] = vector
+                hashes[pos] = row_hash
+            matrix.flush()
+            del matrix
+
+        with open(vec_path, 'r+b') as f:
+            if added_rows:
+                appended = self._as_matrix([vector for _, _, vector in added_rows], len(added_rows), dtype)
+                f.seek(count * dim * dtype.itemsize)  # Drop any rows left by an interrupted append
+                f.write(appended.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        if changed_rows:
+            os.replace(vec_path, self.vec_file)
+
+        if added_rows:
+            ids = np.concatenate([ids, np.array([row[0] for row in added_rows], dtype=np.int64)])
+            hashes = np.concatenate([hashes, np.array([row[1] for row in added_rows], dtype=np.uint64)])
+
+        self._write_sidecars(ids, hashes)
+        header = dict(header, count=int(len(ids)))
+        self._write_header(header)
+
+    def _as_matrix(self, vectors, rows, dtype=None):
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=dtype or self.dtype))
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(rows, -1) if rows else matrix.reshape(0, 0)
+        if rows != matrix.shape[0]:
+            raise ValueError(f"Got {rows} ids for {matrix.shape[0]} vectors")
+        return matrix
+
+    def _write_sidecars(self, ids, hashes):
+        self._replace(self.ids_file, lambda f: np.save(f, np.asarray(ids, dtype=np.int64)))
+        self._replace(self.hashes_file, lambda f: np.save(f, np.asarray(hashes, dtype=np.uint64)))
+
+    def _write_header(self, header):
+        self._replace(self.header_file, lambda f: f.write(json.dumps(header).encode('utf-8')))
+
+    def _replace(self, path, writer):
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            writer(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, UploadFile, File, Form
 import subprocess
 import os
+from retrieval_daemon import start_daemon, DAEMON_PORT
 
 app = FastAPI()
 
@@ -9,7 +10,8 @@ services = {
     "load": 8000,       # 对应 GUI_load.py
     "work": 8004,       # 对应 GUI_work.py
     "training": 8003,   # 对应 GUI_training.py
-    "testing": 8002     # 对应 GUI_testing.py
+    "testing": 8002,    # 对应 GUI_testing.py
+    "retrieval": DAEMON_PORT  # 共享检索服务 retrieval_daemon.py
 }
 
 def start_service(script_name, port):
@@ -24,6 +26,12 @@ def start_service(script_name, port):
 def start_all_services():
     """启动所有 Web 服务"""
     responses = {}
+    # Started first so work/testing connect to it instead of loading the knowledge base themselves
+    try:
+        start_daemon(["txt"])
+        responses["retrieval"] = {"message": f"retrieval_daemon.py running on port {DAEMON_PORT}"}
+    except Exception as e:
+        responses["retrieval"] = {"error": f"Failed to start retrieval_daemon.py: {str(e)}"}
     responses["load"] = start_service("web_load.py", services["load"])
     responses["work"] = start_service("web_work.py", services["work"])
     responses["training"] = start_service("web_training.py", services["training"])
@@ -35,7 +43,8 @@ def get_services_status():
     """检查所有 Web 服务的状态"""
     status = {}
     for service, port in services.items():
-        status[service] = f"http://localhost:{port}/docs"
+        if service != "retrieval":
+            status[service] = f"http://localhost:{port}/docs"
     return status
 
 if __name__ == "__main__":
@@ -1,42 +1,44 @@
 from fastapi import FastAPI, UploadFile, File
-import torch
-import ollama
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+import io
 import os
 import json
 import re
-from email import policy
-from email.parser import BytesParser
-from bs4 import BeautifulSoup
+import threading
+from typing import List
+from email_parser import parse_eml_file
+from parse_pool import get_parse_pool
+from llm_client import chat, chat_async, warm_up
+from llm_scheduler import SchedulerBusy
+from training_pipeline import TrainingPipeline, Checkpoint
+from mail_sources import MBOX_SUFFIXES, read_mbox, zip_messages, with_throughput
+from dedup_index import IngestedIndex, fingerprint
 
 app = FastAPI()
 
 VAULT_FILE = "Knowledge Base.txt"
-
-def process_eml_file(file):
-    """Processes an .eml file and extracts the email subject and body."""
-    msg = BytesParser(policy=policy.default).parse(file)
-
-    subject = msg["subject"] or "No Subject"
-    text_content = ""
-
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == 'text/plain':
-                text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-            elif part.get_content_type() == 'text/html':
-                html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                text_content += BeautifulSoup(html_content, 'lxml').get_text()
-    else:
-        if msg.get_content_type() == 'text/plain':
-            text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-        elif msg.get_content_type() == 'text/html':
-            html_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-            text_content = BeautifulSoup(html_content, 'lxml').get_text()
-
-    return subject, re.sub(r'\s+', ' ', text_content).strip()
-
-def analyze_and_process_text(input_text, ollama_model="llama3"):
+CHECKPOINT_FILE = "training_checkpoint_web.txt"
+THREAD_MESSAGES = 2  # The reply and the message it answers; older history, signatures and disclaimers are left out
+INGESTED_INDEX_FILE = "ingested_index_web.sqlite3"  # Separate from the GUI's, which feeds MySQL instead of the file
+batch_lock = threading.Lock()  # One bulk import at a time; they share the LLM and the checkpoint
+parse_pool = get_parse_pool()
+parse_pool.start()  # Worker processes keep MIME/HTML parsing off the event loop and the GIL
+ingested = IngestedIndex(INGESTED_INDEX_FILE)
+warm_up(embed_models=())
+
+async def analyze_and_process_text(input_text, ollama_model="llama3"):
     """Uses Ollama to analyze the text and extract question-answer pairs."""
+    content = await chat_async(analysis_messages(input_text), model=ollama_model, priority="training")
+    return json.loads(extract_json_from_content(content))
+
+def analyze_text_blocking(input_text, ollama_model="llama3"):
+    """Blocking counterpart of analyze_and_process_text, for the pipeline's worker threads."""
+    content = chat(analysis_messages(input_text), model=ollama_model, priority="training")
+    return json.loads(extract_json_from_content(content))
+
+def analysis_messages(input_text):
+    """Builds the question-answer extraction prompt for an email body."""
     cleaned_text = clean_input_text(input_text)
 
     prompt = f"""
@@ -55,12 +57,7 @@ def analyze_and_process_text(input_text, ollama_model="llama3"):
       "Answer": "text of the answer (if applicable, otherwise empty)"
     }}
     """
-    response = ollama.chat(model=ollama_model, messages=[{"role": "system", "content": prompt}])
-
-    if "message" not in response or "content" not in response["message"]:
-        raise RuntimeError(f"Unexpected response format: {response}")
-
-    return json.loads(extract_json_from_content(response["message"]["content"]))
+    return [{"role": "system", "content": prompt}]
 
 def clean_input_text(input_text):
     """Removes duplicates and cleans email text."""
@@ -80,22 +77,84 @@ def extract_json_from_content(content):
         return match.group(0)
     raise ValueError("No valid JSON content found in the response.")
 
+async def parse_upload(file):
+    """Reads an uploaded .eml file and parses it on a worker process."""
+    subject, body, _ = await parse_pool.parse_async(await file.read(), THREAD_MESSAGES)
+    return subject, body
+
+def append_to_knowledge_base(question, answer):
+    """Appends a question-answer pair to the knowledge base file."""
+    write_records([{"question": question, "answer": answer}])
+
+def write_records(records):
+    """Appends a batch of extracted records to the knowledge base file in one write."""
+    with open(VAULT_FILE, "a", encoding="utf-8") as kb_file:
+        kb_file.write("".join(f"Question: {record['question']}\n"
+                              f"Answer: {record['answer'] if record['answer'] else '[No answer provided]'}\n\n"
+                              for record in records))
+        kb_file.flush()
+        os.fsync(kb_file.fileno())
+
+def run_batch(files):
+    """Runs uploaded files through the training pipeline; an interrupted batch resumes when re-sent."""
+    return run_pipeline((file.filename, file.file.read()) for file in files)
+
+def mailbox_messages(file):
+    """Messages of an uploaded mbox file or zip archive, read one at a time from the spooled upload."""
+    if file.filename.lower().endswith(".zip"):
+        return zip_messages(file.file, file.filename)
+    return read_mbox(file.file, file.filename)
+
+def run_pipeline(messages, keep_results=True):
+    """Runs (name, bytes) messages through the training pipeline."""
+    pipeline = TrainingPipeline(
+        parse=lambda data: parse_eml_file(io.BytesIO(data), THREAD_MESSAGES),
+        analyze=analyze_text_blocking,
+        write=write_records,
+        checkpoint=Checkpoint(CHECKPOINT_FILE),
+        dedup=ingested,
+        normalize=clean_input_text,
+        parse_pool=parse_pool,
+        thread_messages=THREAD_MESSAGES,
+        keep_results=keep_results,
+    )
+    results = pipeline.run(messages)
+    return results, pipeline.stats
+
+def busy_response(error):
+    """Fast 429 when the LLM queue is full, instead of a request that times out."""
+    return JSONResponse(status_code=429, content={"error": f"LLM busy, retry later: {error}"},
+                        headers={"Retry-After": "5"})
+
 @app.post("/upload_eml/")
 async def upload_eml(file: UploadFile = File(...)):
     """Handles uploading of an .eml file for analysis and question-answer extraction."""
     try:
-        subject, body = process_eml_file(file.file)
+        subject, body = await parse_upload(file)
         if not body.strip():
             return {"error": "Not a valid email for training."}
 
-        analysis_result = analyze_and_process_text(body.strip())
-        question = analysis_result.get("Question", "").strip()
-        answer = analysis_result.get("Answer", "").strip()
-
-        # Save to the knowledge base
-        with open(VAULT_FILE, "a", encoding="utf-8") as kb_file:
-            kb_file.write(f"Question: {question}\n")
-            kb_file.write(f"Answer: {answer if answer else '[No answer provided]'}\n\n")
+        body_print = await run_in_threadpool(fingerprint, clean_input_text(body.strip()))
+        match = await run_in_threadpool(ingested.claim, body_print, file.filename)
+        if match is not None:
+            kind, source = match
+            return {
+                "subject": subject,
+                "message": f"{'Duplicate' if kind == 'exact' else 'Near-duplicate'} of {source}; skipped",
+                "llm_call_skipped": True,
+            }
+
+        try:
+            analysis_result = await analyze_and_process_text(body.strip())
+            question = analysis_result.get("Question", "").strip()
+            answer = analysis_result.get("Answer", "").strip()
+
+            # Save to the knowledge base
+            await run_in_threadpool(append_to_knowledge_base, question, answer)
+        except BaseException:
+            ingested.release(body_print)
+            raise
+        await run_in_threadpool(ingested.commit, [body_print])
 
         return {
             "subject": subject,
@@ -103,9 +162,54 @@ async def upload_eml(file: UploadFile = File(...)):
             "answer": answer if answer else "[No answer provided]",
             "message": "Data appended to Knowledge Base.txt"
         }
+    except SchedulerBusy as e:
+        return busy_response(e)
     except Exception as e:
         return {"error": f"Error processing email: {str(e)}"}
 
+@app.post("/upload_eml_batch/")
+async def upload_eml_batch(files: List[UploadFile] = File(...)):
+    """Handles a bulk upload: parsing, extraction and writing overlap, and records are written in batches."""
+    if not batch_lock.acquire(blocking=False):
+        return JSONResponse(status_code=429, content={"error": "A batch is already being processed, retry later"},
+                            headers={"Retry-After": "30"})
+    try:
+        results, stats = await run_in_threadpool(run_batch, files)
+    except Exception as e:
+        return {"error": f"Error processing batch: {str(e)}"}
+    finally:
+        batch_lock.release()
+    return {
+        "results": [{
+            "file": result["source"],
+            "subject": result["subject"],
+            "question": result["question"],
+            "answer": (result["answer"] or "[No answer provided]") if result["question"] is not None else None,
+            "error": result["error"] or result["skipped"],
+        } for result in results],
+        "stats": stats,
+        "message": f"{stats['written']} records appended to Knowledge Base.txt",
+    }
+
+@app.post("/upload_mailbox/")
+async def upload_mailbox(file: UploadFile = File(...)):
+    """Handles an mbox file or a zip archive (of .eml files, Maildir folders or mbox files).
+    Messages are streamed from the upload into the pipeline; only counts and failures are returned."""
+    if not file.filename.lower().endswith((".zip",) + MBOX_SUFFIXES):
+        return {"error": "Expected an mbox file (.mbox, .mbx) or a zip archive."}
+    if not batch_lock.acquire(blocking=False):
+        return JSONResponse(status_code=429, content={"error": "A batch is already being processed, retry later"},
+                            headers={"Retry-After": "30"})
+    read_stats = {}
+    try:
+        messages = with_throughput(mailbox_messages(file), read_stats.update)
+        _, stats = await run_in_threadpool(run_pipeline, messages, False)
+    except Exception as e:
+        return {"error": f"Error processing mailbox: {str(e)}"}
+    finally:
+        batch_lock.release()
+    return {"stats": stats, "read": read_stats, "message": f"{stats['written']} records appended to Knowledge Base.txt"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8003)
@@ -1,151 +1,255 @@
 from fastapi import FastAPI, UploadFile, File
-import torch
-import ollama
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import List
 import os
-import re
+import asyncio
 import json
-import hashlib
-from email import policy
-from email.parser import BytesParser
-from bs4 import BeautifulSoup
-from langdetect import detect
-from openai import OpenAI
+from retrieval import load_retriever, append_rows
+from kb_watcher import FileTail, LiveRetriever
+from retrieval_daemon import connect_retriever, VAULT_TXT
+from language_id import get_language_identifier
+from parse_pool import get_parse_pool
+from llm_client import chat_async, chat_stream_async, warm_up
+from llm_scheduler import SchedulerBusy, scheduler_stats, MODEL_CONCURRENCY, DEFAULT_CONCURRENCY
+from embeddings import embed_texts_async
+from answer_cache import AnswerCache, context_key
+from prompt_builder import build_messages
 
 app = FastAPI()
 
 VAULT_FILE = "Knowledge Base.txt"
-EMBEDDINGS_CACHE = "embeddings_cache.json"
-CACHE_INFO_FILE = "cache_info.json"
+VECTOR_STORE = "vault_vectors_txt"
+VECTOR_DTYPE = "float32"  # "float16" halves the store size on disk and in page cache
+VECTOR_QUANTIZATION = None  # "int8" (4x) or "pq" (16x) keeps only compressed codes in memory
+THREAD_MESSAGES = 1  # Answer the newest message; quoted history, signatures and disclaimers are left out
 
 email_data = {}  # Stores email subjects and RAG-generated responses
-
-def compute_file_hash(filepath):
-    """Computes the hash value of a file."""
-    with open(filepath, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
-
-def load_vault_content():
-    """Loads knowledge base content."""
-    with open(VAULT_FILE, 'r', encoding='utf-8') as f:
-        return f.readlines()
+answer_cache = AnswerCache()  # Reuses answers to near-identical emails with the same context
+extraction_stats = {"emails": 0, "chars_saved": 0, "tokens_saved": 0}  # Prompt text the reply extraction left out
+parse_pool = get_parse_pool()
+# Batch generations in flight, across all batch requests: as many as the model has slots, so a
+# large batch waits here instead of filling the scheduler queue and failing with 429
+batch_generations = asyncio.Semaphore(MODEL_CONCURRENCY.get("llama3", DEFAULT_CONCURRENCY))
+parse_pool.start()  # Worker processes keep MIME/HTML parsing off the event loop and the GIL
 
 def load_or_generate_embeddings(embedding_model='mxbai-embed-large'):
-    """Loads or generates embedding vectors."""
+    """Loads or generates embedding vectors; returns the retrieval engine."""
     if not os.path.exists(VAULT_FILE):
         raise FileNotFoundError(f"{VAULT_FILE} does not exist.")
 
-    current_hash = compute_file_hash(VAULT_FILE)
-
-    if os.path.exists(CACHE_INFO_FILE):
-        with open(CACHE_INFO_FILE, 'r') as f:
-            cache_info = json.load(f)
-        if cache_info.get('file_hash') == current_hash:
-            with open(EMBEDDINGS_CACHE, 'r') as f:
-                return torch.tensor(json.load(f))
-
-    vault_content = load_vault_content()
-    embeddings = []
-
-    for content in vault_content:
-        try:
-            response = ollama.embeddings(model=embedding_model, prompt=content.strip())
-            embeddings.append(response["embedding"])
-        except Exception as e:
-            print(f"Failed to generate embedding for content: {content.strip()}\nError: {e}")
-
-    with open(EMBEDDINGS_CACHE, 'w') as f:
-        json.dump(embeddings, f)
-    with open(CACHE_INFO_FILE, 'w') as f:
-        json.dump({'file_hash': current_hash}, f)
-
-    return torch.tensor(embeddings)
+    # Each non-empty line is a row, keyed by its line number. Appended lines are
+    # embedded and swapped in by a background thread, no restart needed
+    build = lambda rows: load_retriever(rows, VECTOR_STORE, embedding_model, VECTOR_DTYPE, VECTOR_QUANTIZATION)
+    extend = lambda snapshot, rows: append_rows(snapshot, rows, VECTOR_STORE, embedding_model, VECTOR_DTYPE)
+    return LiveRetriever(FileTail(VAULT_FILE), build, extend=extend)
 
-vault_embeddings_tensor = load_or_generate_embeddings()
-vault_content = load_vault_content()
+# Shared with the other services through the retrieval daemon when it runs
+retriever = connect_retriever(VAULT_TXT, load_or_generate_embeddings)
+warm_up()
+language_identifier = get_language_identifier().load()  # Profiles load at start-up, not on the first email
 
 def sparse_context_selection(input_text, min_k=1, max_k=5, threshold=0.8):
     """Selects the most relevant context based on the input."""
-    if vault_embeddings_tensor.nelement() == 0:
+    if not len(retriever):
         return []
 
-    input_embedding = ollama.embeddings(model='mxbai-embed-large', prompt=input_text)["embedding"]
-    cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), vault_embeddings_tensor)
+    hits = retriever.search_text(input_text, min_k, max_k, threshold)
+    return [content.strip() for _, _, content in hits]
 
-    valid_indices = torch.where(cos_scores >= threshold)[0].tolist()
-    if len(valid_indices) < min_k:
-        top_indices = torch.topk(cos_scores, k=min_k)[1].tolist()
-    else:
-        sorted_valid_indices = sorted(valid_indices, key=lambda i: cos_scores[i], reverse=True)
-        top_indices = sorted_valid_indices[:max_k]
+def batch_context_selection(input_texts, min_k=1, max_k=5, threshold=0.8):
+    """Selects context for many inputs with one batched embedding and scoring pass."""
+    hits = retriever.search_texts(input_texts, min_k, max_k, threshold)
+    return [[content.strip() for _, _, content in input_hits] for input_hits in hits]
 
-    return [vault_content[idx].strip() for idx in top_indices]
+def detect_prompt_language(user_input):
+    """Language the response should be written in; deterministic and cached by body."""
+    return language_identifier.prompt_language(user_input)
 
-def generate_response(user_input):
-    """Generates a response using Ollama combined with RAG."""
-    relevant_context = sparse_context_selection(user_input)
-    context_str = "\n".join(relevant_context) if relevant_context else "No relevant context found."
-
-    detected_language = detect(user_input)
-    prompt_language = "German" if detected_language == 'de' else "English"
-
-    prompt = f"""
-    You are a helpful assistant. The user expects a concise and accurate response in {prompt_language}.
-    
-    User Input:
-    {user_input}
-
-    Relevant Context:
-    {context_str}
+def language_fields(body):
+    """Detected language and confidence for a response."""
+    language, confidence = language_identifier.identify(body)
+    return {"language": language, "language_confidence": confidence}
 
-    Response:
-    """
-
-    client = OpenAI(base_url='http://localhost:11434/v1', api_key='llama3')
-    messages = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}]
-
-    response = client.chat.completions.create(model="llama3", messages=messages, max_tokens=2000)
-    return response.choices[0].message.content
-
-def process_eml_file(file):
-    """Parses .eml files and extracts email subjects and bodies."""
-    msg = BytesParser(policy=policy.default).parse(file)
-    subject = msg["subject"] or "No Subject"
-    text_content = ""
-
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == 'text/plain':
-                text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-            elif part.get_content_type() == 'text/html':
-                html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                text_content += BeautifulSoup(html_content, 'lxml').get_text()
-    else:
-        if msg.get_content_type() == 'text/plain':
-            text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-        elif msg.get_content_type() == 'text/html':
-            html_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-            text_content = BeautifulSoup(html_content, 'lxml').get_text()
-
-    return subject, re.sub(r'\s+', ' ', text_content).strip()
+async def query_embedding(user_input):
+    """Embedding of the query for the answer cache; None if the model is unavailable."""
+    try:
+        return (await embed_texts_async([user_input]))[0]
+    except Exception as e:
+        print(f"Answer cache skipped: {e!r}")
+        return None
+
+async def prepare_response(user_input, relevant_context):
+    """Retrieves context if needed; returns (messages, cache key, query embedding, cached answer)."""
+    if relevant_context is None:
+        relevant_context = await run_in_threadpool(sparse_context_selection, user_input)
+    prompt_language = detect_prompt_language(user_input)
+    # Token-budgeted: lowest-ranked context is dropped first, long emails are cut
+    messages, used_context = build_messages(user_input, relevant_context, prompt_language)
+    key = context_key(used_context, prompt_language)
+    query = await query_embedding(user_input)
+    cached = answer_cache.get(query, key) if query is not None else None
+    return messages, key, query, cached
+
+async def generate_response(user_input, relevant_context=None):
+    """Generates a response using Ollama combined with RAG."""
+    messages, key, query, cached = await prepare_response(user_input, relevant_context)
+    if cached is not None:
+        return cached
+
+    response = await chat_async(messages, model="llama3", max_tokens=2000)
+    if query is not None:
+        answer_cache.put(query, key, response)
+    return response
+
+async def stream_response(user_input, relevant_context=None):
+    """Generates a response like generate_response, yielding text chunks as they are produced."""
+    messages, key, query, cached = await prepare_response(user_input, relevant_context)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    async for token in chat_stream_async(messages, model="llama3", max_tokens=2000):
+        if token:
+            parts.append(token)
+            yield token
+    if query is not None:
+        answer_cache.put(query, key, "".join(parts))
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event; data is JSON so newlines in tokens survive."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def count_savings(metadata):
+    """Adds one parsed email to the extraction counters."""
+    extraction_stats["emails"] += 1
+    extraction_stats["chars_saved"] += metadata.get("chars_saved", 0)
+    extraction_stats["tokens_saved"] += metadata.get("tokens_saved", 0)
+
+async def parse_upload(file):
+    """Reads an uploaded .eml file and parses it on a worker process."""
+    subject, body, metadata = await parse_pool.parse_async(await file.read(), THREAD_MESSAGES)
+    count_savings(metadata)
+    return subject, body
+
+def busy_response(error):
+    """Fast 429 when the LLM queue is full, instead of a request that times out."""
+    return JSONResponse(status_code=429, content={"error": f"LLM busy, retry later: {error}"},
+                        headers={"Retry-After": "5"})
 
 @app.post("/upload_eml/")
 async def upload_eml(file: UploadFile = File(...)):
     """Handles uploading of an .eml file for parsing and RAG response generation."""
     try:
-        subject, body = process_eml_file(file.file)
+        subject, body = await parse_upload(file)
         if not body.strip():
             return {"error": "Not a valid email for processing."}
 
-        response = generate_response(body.strip())
+        response = await generate_response(body.strip())
         email_data[subject] = response
 
         return {
             "subject": subject,
-            "response": response
+            "response": response,
+            **language_fields(body.strip()),
         }
+    except SchedulerBusy as e:
+        return busy_response(e)
     except Exception as e:
         return {"error": f"Error processing email: {str(e)}"}
 
+@app.post("/upload_eml_batch/")
+async def upload_eml_batch(files: List[UploadFile] = File(...)):
+    """Handles uploading of many .eml files; context for all of them is retrieved in one batch."""
+    emails = []
+    results = []
+    uploads = await asyncio.gather(*(file.read() for file in files))
+    parsed = await parse_pool.parse_many_async(uploads, THREAD_MESSAGES)  # Chunked over the worker processes
+    for file, (record, error) in zip(files, parsed):
+        if error is not None:
+            results.append({"file": file.filename, "error": f"Error processing email: {error}"})
+            continue
+        subject, body, metadata = record
+        count_savings(metadata)
+        if not body.strip():
+            results.append({"file": file.filename, "error": "Not a valid email for processing."})
+            continue
+        emails.append((file.filename, subject, body.strip()))
+
+    contexts = await run_in_threadpool(batch_context_selection, [body for _, _, body in emails])
+
+    async def generate_batched(body, relevant_context):
+        async with batch_generations:
+            return await generate_response(body, relevant_context)
+
+    responses = await asyncio.gather(*(generate_batched(body, relevant_context)
+                                       for (_, _, body), relevant_context in zip(emails, contexts)),
+                                     return_exceptions=True)
+    for (filename, subject, body), response in zip(emails, responses):
+        if isinstance(response, Exception):
+            results.append({"file": filename, "error": f"Error processing email: {str(response)}"})
+            continue
+        email_data[subject] = response
+        results.append({"file": filename, "subject": subject, "response": response, **language_fields(body)})
+
+    return {"results": results}
+
+@app.post("/upload_eml_stream/")
+async def upload_eml_stream(file: UploadFile = File(...)):
+    """Like /upload_eml/, but streams the response as Server-Sent Events:
+    a "subject" event, one "token" event per chunk, then "done" (or "error").
+    """
+    try:
+        subject, body = await parse_upload(file)
+    except Exception as e:
+        return {"error": f"Error processing email: {str(e)}"}
+    if not body.strip():
+        return {"error": "Not a valid email for processing."}
+
+    tokens = stream_response(body.strip())
+    try:
+        first = await tokens.__anext__()  # Waits for a generation slot, so a full queue is still a 429
+    except StopAsyncIteration:
+        first = None
+    except SchedulerBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return {"error": f"Error processing email: {str(e)}"}
+
+    async def events():
+        yield sse_event("subject", {"subject": subject, **language_fields(body.strip())})
+        parts = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield sse_event("token", {"token": first})
+                async for token in tokens:
+                    parts.append(token)
+                    yield sse_event("token", {"token": token})
+        except Exception as e:
+            yield sse_event("error", {"error": f"Error processing email: {str(e)}"})
+            return
+        email_data[subject] = "".join(parts)  # Stored once the stream has finished
+        yield sse_event("done", {"subject": subject})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/cache_stats/")
+def cache_stats():
+    """Answer cache hit/miss counters."""
+    return answer_cache.stats()
+
+@app.get("/extraction_stats/")
+def get_extraction_stats():
+    """Characters and estimated tokens of quoted history, signatures and disclaimers kept out of prompts."""
+    return extraction_stats
+
+@app.get("/scheduler_stats/")
+async def get_scheduler_stats():
+    """LLM queue depth, running generations and wait times per model."""
+    return await run_in_threadpool(scheduler_stats)
+
 @app.get("/get_subjects/")
 def get_subjects():
     """Retrieves all email subjects."""